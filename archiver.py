@@ -0,0 +1,68 @@
+"""
+Scheduled archiving of transactions of closed years (see google_sheet.archive).
+"""
+import asyncio
+import datetime
+import logging
+import typing
+
+import journal
+from background import run_blocking
+from database import get_connected_users
+from google_sheet.archive import archive_transactions
+from metrics import Counter
+from settings_cache import apply_transactions, transaction_lock
+
+
+archived_transactions = Counter(
+    "archived_transactions_total", "Transactions moved to archive worksheets by type.", ["kind"]
+)
+
+
+async def archive_user(user_id: int, gsheet_id: str, first_open_year: int):
+    """
+    Moves transactions of closed years of the user to archive worksheets.
+
+    :param user_id: Telegram ID of the user.
+    :param gsheet_id: ID of user's Google sheet.
+    :param first_open_year: Transactions of this year and later are not archived.
+    """
+    # Rows of the transactions must not move while the bot writes to the table.
+    async with transaction_lock(user_id):
+        moved = await run_blocking(archive_transactions, gsheet_id, first_open_year)
+
+        for kind, count in moved.items():
+            if count == 0:
+                continue
+
+            apply_transactions(user_id, kind, -count, {})
+            await journal.forget_archived(user_id, kind, count)
+            archived_transactions.inc(count, kind=kind)
+
+
+async def archive_periodically(interval: float, keep_years: int, owns: typing.Callable[[int], bool] = None):
+    """
+    Periodically archives transactions of all connected users.
+
+    :param interval: Seconds between runs.
+    :param keep_years: Number of years (including the current one) kept on "Транзакции" worksheet.
+    :param owns: Returns True for users handled by this process (all users if None).
+    """
+    while True:
+        await asyncio.sleep(interval)
+
+        first_open_year = datetime.date.today().year - keep_years + 1
+        try:
+            users = await get_connected_users()
+        except Exception as exc:
+            logging.error("Exception during get_connected_users executing!", exc_info=exc)
+            continue
+
+        for user in users:
+            if owns is not None and not owns(user.user_id):
+                continue
+
+            try:
+                await archive_user(user.user_id, user.gsheet_id, first_open_year)
+            except Exception as exc:
+                logging.error("Exception during archive_transactions executing!", exc_info=exc)
@@ -0,0 +1,57 @@
+"""
+Tools for running blocking code and background tasks without stalling the event loop.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+
+from typing import Any, Callable, Coroutine
+
+
+_tasks = set()
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """
+    Runs blocking function (gspread call, file IO) in the default thread pool.
+
+    :param func: Blocking function.
+    :param args: Positional arguments of the function.
+    :param kwargs: Keyword arguments of the function.
+    :return: Result of the function.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args, **kwargs))
+
+
+def spawn(coro: Coroutine, name: str = None, user_id: int = None) -> asyncio.Task:
+    """
+    Starts coroutine as background task. Keeps a reference to the task
+    until it is done and logs its exception if any.
+
+    :param coro: Coroutine object.
+    :param name: Name of the task (used in logs, must not contain IDs of users).
+    :param user_id: Telegram ID of the user whose task it is (logged as user_id field, which is redacted).
+    :return: asyncio.Task
+    """
+    task = asyncio.get_running_loop().create_task(coro, name=name)
+    _tasks.add(task)
+    task.add_done_callback(functools.partial(_on_task_done, user_id=user_id))
+
+    return task
+
+
+def _on_task_done(task: asyncio.Task, user_id: int = None):
+    """Forgets finished task and logs its exception."""
+    _tasks.discard(task)
+
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(
+            "Exception in background task %s!",
+            task.get_name(),
+            exc_info=task.exception(),
+            extra=None if user_id is None else {"user_id": user_id},
+        )
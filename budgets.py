@@ -0,0 +1,111 @@
+"""
+Monthly budgets of expense categories. Spent amounts are taken from the local
+summary (see summary.py), which every write keeps up to date, so checking a budget
+costs one query to the bot's database and no requests to Google.
+"""
+import datetime
+import typing
+
+import summary
+from database import db
+from google_sheet.summary import get_month
+
+
+def format_amount(amount: float) -> str:
+    """Returns amount with groups of digits (e.g. 15 000 or 3 200.5)."""
+    text = f"{amount:,.2f}".rstrip("0").rstrip(".")
+    return text.replace(",", " ")
+
+
+async def set_budget(user_id: int, category: str, amount: float):
+    """
+    Sets monthly limit of the category.
+
+    :param user_id: Telegram ID of the user.
+    :param category: Name of expense category.
+    :param amount: Limit of the month.
+    """
+    await db.execute(
+        "INSERT INTO budget (user_id, category, amount) VALUES (?, ?, ?) "
+        "ON CONFLICT (user_id, category) DO UPDATE SET amount = excluded.amount",
+        user_id,
+        category.lower(),
+        amount,
+    )
+
+
+async def delete_budget(user_id: int, category: str):
+    """
+    Removes limit of the category.
+
+    :param user_id: Telegram ID of the user.
+    :param category: Name of expense category.
+    """
+    await db.execute("DELETE FROM budget WHERE user_id = ? AND category = ?", user_id, category.lower())
+
+
+async def get_budgets(user_id: int) -> typing.Dict[str, float]:
+    """
+    Returns limits by lowercase category name.
+
+    :param user_id: Telegram ID of the user.
+    """
+    rows = await db.fetchall("SELECT category, amount FROM budget WHERE user_id = ?", user_id)
+    return {category: amount for category, amount in rows}
+
+
+async def get_spent(user_id: int, month: str = None) -> typing.Optional[typing.Dict[str, float]]:
+    """
+    Returns expenses of the month by lowercase category name.
+
+    :param user_id: Telegram ID of the user.
+    :param month: Month (the current one if None).
+    :return: Dict or None if the summary is not built yet.
+    """
+    if not await summary.is_built(user_id):
+        return None
+
+    spent = dict()
+    totals = await summary.get_totals(user_id, "expense", month or get_month(datetime.date.today()))
+    for category, total in totals.items():
+        spent[category.lower()] = spent.get(category.lower(), 0) + total
+
+    return spent
+
+
+def describe_budget(category: str, limit: float, spent: float) -> str:
+    """
+    Returns state of the budget (e.g. «Еда»: осталось 3 200 из 15 000).
+
+    :param category: Name of the category.
+    :param limit: Limit of the month.
+    :param spent: Expenses of the month.
+    """
+    if spent > limit:
+        return f"⚠️ «{category}»: бюджет {format_amount(limit)} превышен на {format_amount(spent - limit)}"
+
+    return f"«{category}»: осталось {format_amount(limit - spent)} из {format_amount(limit)}"
+
+
+async def get_budget_status(user_id: int, category: str) -> typing.Optional[str]:
+    """
+    Returns state of the budget of the category in the current month.
+
+    :param user_id: Telegram ID of the user.
+    :param category: Name of expense category.
+    :return: Description or None if the category has no budget or spent amount is unknown.
+    """
+    limit = await db.fetchone(
+        "SELECT amount FROM budget WHERE user_id = ? AND category = ?",
+        user_id,
+        category.lower(),
+    )
+    if limit is None:
+        return None
+
+    spent = await get_spent(user_id)
+    if spent is None:
+        return None
+
+    return describe_budget(category, limit[0], spent.get(category.lower(), 0))
+
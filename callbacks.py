@@ -0,0 +1,155 @@
+"""
+Routing of callback queries. aiogram checks filters of every registered handler
+until one passes, so each button press costs a pass over all callback handlers.
+CallbackQueryRouter indexes handlers by prefix of callback data (the part before ":")
+and checks filters only of the handlers registered for the prefix of the query.
+
+A handler gets into the index if it is registered with text="<data>" filter
+or with a CallbackData factory filter (factory.filter(...)), the others are checked
+for every query as before.
+"""
+import typing
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.filters import Text
+from aiogram.dispatcher.filters.filters import FilterNotPassed, check_filters
+from aiogram.dispatcher.handler import (
+    CancelHandler,
+    Handler,
+    SkipHandler,
+    _check_spec,
+    ctx_data,
+    current_handler,
+)
+from aiogram.utils.callback_data import CallbackDataFilter
+
+
+SEPARATOR = ":"
+
+
+def get_route(callback_data: typing.Optional[str]) -> str:
+    """
+    Returns key of the route of callback data: its prefix before the separator.
+
+    :param callback_data: Data of the callback query.
+    """
+    return (callback_data or "").split(SEPARATOR, 1)[0]
+
+
+def get_handler_routes(handler_obj: Handler.HandlerObj) -> typing.Optional[typing.Set[str]]:
+    """
+    Returns routes of the handler or None if the handler can get a query of any route.
+
+    :param handler_obj: Registered handler.
+    """
+    for filter_obj in handler_obj.filters:
+        if isinstance(filter_obj.filter, Text) and filter_obj.filter.equals and not filter_obj.filter.ignore_case:
+            return {get_route(str(equals)) for equals in filter_obj.filter.equals}
+
+        if isinstance(filter_obj.filter, CallbackDataFilter) and filter_obj.filter.factory.sep == SEPARATOR:
+            return {filter_obj.filter.factory.prefix}
+
+    return None
+
+
+class CallbackQueryRouter(Handler):
+    """
+    Handler of callback queries which checks only handlers of the query's route
+    and handlers without route, keeping the order of registration.
+    """
+
+    def __init__(self, dispatcher, once=True, middleware_key=None):
+        super(CallbackQueryRouter, self).__init__(dispatcher, once=once, middleware_key=middleware_key)
+
+        self._routes: typing.Dict[str, typing.List[Handler.HandlerObj]] = dict()
+        self._fallbacks: typing.List[Handler.HandlerObj] = []
+
+    def register(self, handler, filters=None, index=None):
+        super(CallbackQueryRouter, self).register(handler, filters, index)
+        self._build_routes()
+
+    def unregister(self, handler):
+        result = super(CallbackQueryRouter, self).unregister(handler)
+        self._build_routes()
+        return result
+
+    def _build_routes(self):
+        """
+        Rebuilds routes from the list of handlers (handlers are registered once at startup).
+        Each route keeps its handlers together with handlers without route in the order of registration.
+        """
+        routes = dict()
+        fallbacks = []
+        for handler_obj in self.handlers:
+            handler_routes = get_handler_routes(handler_obj)
+            if handler_routes is None:
+                fallbacks.append(handler_obj)
+                for route_handlers in routes.values():
+                    route_handlers.append(handler_obj)
+                continue
+
+            for route in handler_routes:
+                routes.setdefault(route, list(fallbacks)).append(handler_obj)
+
+        self._routes = routes
+        self._fallbacks = fallbacks
+
+    def get_candidates(self, callback_data: typing.Optional[str]) -> typing.List[Handler.HandlerObj]:
+        """
+        Returns handlers which can get the query in the order of registration.
+
+        :param callback_data: Data of the callback query.
+        """
+        return self._routes.get(get_route(callback_data), self._fallbacks)
+
+    async def notify(self, *args):
+        """The same as Handler.notify, but goes only through candidates for the query."""
+        results = []
+
+        data = {}
+        ctx_data.set(data)
+
+        if self.middleware_key:
+            try:
+                await self.dispatcher.middleware.trigger(f"pre_process_{self.middleware_key}", args + (data,))
+            except CancelHandler:
+                return results
+
+        try:
+            for handler_obj in self.get_candidates(args[0].data):
+                try:
+                    data.update(await check_filters(handler_obj.filters, args))
+                except FilterNotPassed:
+                    continue
+
+                ctx_token = current_handler.set(handler_obj.handler)
+                try:
+                    if self.middleware_key:
+                        await self.dispatcher.middleware.trigger(f"process_{self.middleware_key}", args + (data,))
+                    response = await handler_obj.handler(*args, **_check_spec(handler_obj.spec, data))
+                    if response is not None:
+                        results.append(response)
+                    if self.once:
+                        break
+                except SkipHandler:
+                    continue
+                except CancelHandler:
+                    break
+                finally:
+                    current_handler.reset(ctx_token)
+        finally:
+            if self.middleware_key:
+                await self.dispatcher.middleware.trigger(
+                    f"post_process_{self.middleware_key}", args + (results, data)
+                )
+
+        return results
+
+
+class RoutingDispatcher(Dispatcher):
+    """Dispatcher which routes callback queries by CallbackQueryRouter."""
+
+    def _setup_filters(self):
+        # Builtin filters are bound to handler objects, so the router must be set before.
+        self.callback_query_handlers = CallbackQueryRouter(self, middleware_key="callback_query")
+        super(RoutingDispatcher, self)._setup_filters()
@@ -1,8 +1,13 @@
-import sqlite3
+import asyncio
 
-conn = sqlite3.connect("finance.db")
-cur = conn.cursor()
+from database import db
+from storage.migrations import migrate
 
-cur.execute("CREATE TABLE user (id integer primary key, google_sheet_id text)")
 
-conn.commit()
+async def create_db():
+    """Creates or updates tables in the database selected in config."""
+    await migrate(db)
+    await db.close()
+
+
+asyncio.run(create_db())
@@ -1,10 +1,35 @@
 """
-This file contains all necessary tools for working with finance.db
+This file contains all necessary tools for working with the bot's database
+(finance.db or a PostgreSQL database shared by several bot instances).
 """
-import sqlite3
+from cachetools import TTLCache
+
+from config import (
+    DATABASE_BACKEND,
+    DATABASE_PATH,
+    DATABASE_POOL_SIZE,
+    POSTGRES_DSN,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+)
+from metrics import Gauge
+from storage.base import Storage
+from storage.postgres import PostgresStorage
+from storage.sqlite import SQLiteStorage
+
+
+def create_storage() -> Storage:
+    """
+    Creates storage selected by DATABASE_BACKEND option.
+
+    :raise ValueError: If DATABASE_BACKEND is not sqlite or postgres.
+    """
+    if DATABASE_BACKEND == "sqlite":
+        return SQLiteStorage(DATABASE_PATH, pool_size=DATABASE_POOL_SIZE)
+    if DATABASE_BACKEND == "postgres":
+        return PostgresStorage(POSTGRES_DSN, pool_size=DATABASE_POOL_SIZE)
 
-con = sqlite3.connect("finance.db")
-cursor = con.cursor()
+    raise ValueError(f"DATABASE_BACKEND must be sqlite or postgres but not {DATABASE_BACKEND}!")
 
 
 class User:
@@ -14,7 +39,54 @@ class User:
         self.gsheet_id = gsheet_id
 
 
-def add_user(user_id: int, gsheet_id: str = "") -> User:
+class UserCache:
+    """Bounded LRU cache of users with hit rate counters."""
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: Max number of users in the cache.
+        :param ttl: Seconds after which user is read from the database again
+            (other bot instances may change it).
+        """
+        self._users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> User:
+        """
+        Returns cached user or None.
+
+        :param user_id: Telegram ID of the user.
+        """
+        user = self._users.get(user_id)
+        if user is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return user
+
+    def put(self, user: User):
+        """Puts user to the cache."""
+        self._users[user.user_id] = user
+
+    def invalidate(self, user_id: int):
+        """Drops user from the cache."""
+        self._users.pop(user_id, None)
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of lookups served from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+db = create_storage()
+users = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+Gauge("user_cache_hit_rate", "Share of users' lookups served from the cache.", function=lambda: users.hit_rate)
+
+
+async def add_user(user_id: int, gsheet_id: str = "") -> User:
     """
     Add new user to user table
 
@@ -22,39 +94,45 @@ def add_user(user_id: int, gsheet_id: str = "") -> User:
     :param gsheet_id: ID of the Google sheet
     :return: User
     """
-    cursor.execute(f"INSERT INTO user VALUES ({user_id}, {gsheet_id!r})")
-    con.commit()
+    await db.execute('INSERT INTO "user" (id, google_sheet_id) VALUES (?, ?)', user_id, gsheet_id)
 
-    return User(user_id)
+    user = User(user_id, gsheet_id)
+    users.put(user)
 
+    return user
 
-def update_gsheet_id(user_id: int, gsheet_id: str) -> User:
+
+async def update_gsheet_id(user_id: int, gsheet_id: str) -> User:
     """
     Add/update google_sheet_id field in the database
 
     :param user_id: telegram ID of the user
     :param gsheet_id: ID of the Google sheet
     """
-    cursor.execute(
-        f"UPDATE user SET google_sheet_id={gsheet_id!r} "
-        f"WHERE id={user_id}"
-    )
-    con.commit()
+    try:
+        await db.execute('UPDATE "user" SET google_sheet_id = ? WHERE id = ?', gsheet_id, user_id)
+    except Exception:
+        users.invalidate(user_id)
+        raise
 
-    return User(user_id, gsheet_id)
+    user = User(user_id, gsheet_id)
+    users.put(user)
+
+    return user
 
 
-def get_gsheet_id(user_id: int) -> str:
+async def get_gsheet_id(user_id: int) -> str:
     """
     Returns user's Google sheet ID.
 
     :param user_id: Telegram ID of the user.
+    :raise ValueError: if user with user_id does not exist in database
     """
-    _, gsheet_id = list(cursor.execute(f"SELECT * FROM user WHERE id={user_id}"))[0]
-    return gsheet_id
+    user = await get_user(user_id)
+    return user.gsheet_id
 
 
-def get_user(user_id: int) -> User:
+async def get_user(user_id: int) -> User:
     """
     Gets user from the database by user_id
 
@@ -62,15 +140,21 @@ def get_user(user_id: int) -> User:
     :return: User
     :raise ValueError: if user with user_id does not exist in database
     """
-    try:
-        user = list(cursor.execute(f"SELECT * FROM user WHERE id={user_id}"))[0]
-    except IndexError:
+    user = users.get(user_id)
+    if user is not None:
+        return user
+
+    row = await db.fetchone('SELECT id, google_sheet_id FROM "user" WHERE id = ?', user_id)
+    if row is None:
         raise ValueError("User does not exists in database!")
 
-    return User(user_id=user[0], gsheet_id=user[1])
+    user = User(user_id=row[0], gsheet_id=row[1])
+    users.put(user)
+
+    return user
 
 
-def get_or_add_user(user_id: int) -> User:
+async def get_or_add_user(user_id: int) -> User:
     """
     Gets and returns user by user_id if it exists
     in database otherwise adds a new user.
@@ -79,8 +163,18 @@ def get_or_add_user(user_id: int) -> User:
     :return: User
     """
     try:
-        user = get_user(user_id)
+        user = await get_user(user_id)
     except ValueError:
-        user = add_user(user_id)
+        user = await add_user(user_id)
 
     return user
+
+
+async def get_connected_users() -> list:
+    """
+    Returns users connected to Google sheets.
+
+    :return: List of User
+    """
+    rows = await db.fetchall('SELECT id, google_sheet_id FROM "user" WHERE google_sheet_id <> ?', "")
+    return [User(user_id=row[0], gsheet_id=row[1]) for row in rows]
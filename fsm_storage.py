@@ -0,0 +1,335 @@
+"""
+FSM storages. DatabaseStorage keeps users' states in the bot's database, so restarts
+and deploys do not break flows which users are in the middle of.
+
+Both storages expire flows abandoned by users (see FSM_STATE_TTL in config) and keep
+at most FSM_MAX_FLOWS of them. Expired flow leaves a tombstone, so the user is told
+about it on the next message.
+"""
+import asyncio
+import copy
+import json
+import logging
+import time
+import typing
+
+from collections import OrderedDict
+
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.dispatcher.storage import BaseStorage
+
+from config import FSM_DEFAULT_TTL, FSM_STATE_TTL, FSM_TOMBSTONE_TTL
+from storage.base import Storage
+
+
+EXPIRED_STATE = "expired"
+
+
+def state_ttl(state: str) -> float:
+    """
+    Returns number of seconds after which abandoned flow in the state expires.
+
+    :param state: Full name of the state (e.g. AddsExpense:amount).
+    """
+    ttl = FSM_STATE_TTL.get(state)
+    if ttl is None:
+        ttl = FSM_STATE_TTL.get(state.split(":")[0], FSM_DEFAULT_TTL)
+
+    return ttl
+
+
+class DatabaseStorage(BaseStorage):
+    """
+    Stores state and data of each (chat, user) in one row of fsm_state table.
+
+    Data is kept as compact JSON and holds only what user has entered: settings
+    (categories, accounts) are taken from the shared settings cache, so idle users
+    take no memory at all and a few bytes in the database.
+    """
+
+    def __init__(self, db: Storage, max_flows: int):
+        """
+        :param db: Storage object.
+        :param max_flows: Max number of flows kept, the least recently updated are expired first.
+        """
+        self.db = db
+        self.max_flows = max_flows
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = self.check_address(chat=chat, user=user)
+        row = await self.db.fetchone(
+            "SELECT state FROM fsm_state WHERE chat_id = ? AND user_id = ?", int(chat), int(user)
+        )
+
+        if row is None or row[0] is None or row[0] == EXPIRED_STATE:
+            return self.resolve_state(default)
+        return row[0]
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = self.check_address(chat=chat, user=user)
+        row = await self.db.fetchone(
+            "SELECT data FROM fsm_state WHERE chat_id = ? AND user_id = ?", int(chat), int(user)
+        )
+
+        if row is None or not row[0]:
+            return default or {}
+        return json.loads(row[0])
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.Optional[typing.AnyStr] = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        await self.db.execute(
+            "INSERT INTO fsm_state (chat_id, user_id, state, data, updated_at) VALUES (?, ?, ?, '', ?) "
+            "ON CONFLICT (chat_id, user_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            int(chat), int(user), self.resolve_state(state), time.time(),
+        )
+        if state is None:
+            await self._cleanup(chat, user)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user = self.check_address(chat=chat, user=user)
+        await self.db.execute(
+            "INSERT INTO fsm_state (chat_id, user_id, state, data, updated_at) VALUES (?, ?, NULL, ?, ?) "
+            "ON CONFLICT (chat_id, user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+            int(chat), int(user), _dump(data), time.time(),
+        )
+        if not data:
+            await self._cleanup(chat, user)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        current_data = await self.get_data(chat=chat, user=user)
+        current_data.update(data or {}, **kwargs)
+        await self.set_data(chat=chat, user=user, data=current_data)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        if not with_data:
+            await self.set_state(chat=chat, user=user, state=None)
+            return
+
+        chat, user = self.check_address(chat=chat, user=user)
+        await self.db.execute("DELETE FROM fsm_state WHERE chat_id = ? AND user_id = ?", int(chat), int(user))
+
+    async def get_flow(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None) -> typing.Tuple[typing.Optional[str], bool]:
+        """
+        Returns user's state and drops the flow if it has expired.
+
+        :return: State (None if there is no flow) and whether the flow has expired.
+        """
+        chat, user = self.check_address(chat=chat, user=user)
+        row = await self.db.fetchone(
+            "SELECT state, updated_at FROM fsm_state WHERE chat_id = ? AND user_id = ?", int(chat), int(user)
+        )
+        if row is None or row[0] is None:
+            return None, False
+
+        state, updated_at = row
+        if state == EXPIRED_STATE or time.time() - updated_at > state_ttl(state):
+            await self.reset_state(chat=chat, user=user)
+            return None, True
+
+        return state, False
+
+    async def sweep(self):
+        """Turns expired and the least recently updated flows over max_flows into tombstones."""
+        now = time.time()
+
+        # States with their own TTL, then all other states with the default one.
+        for state, ttl in FSM_STATE_TTL.items():
+            await self.db.execute(
+                "UPDATE fsm_state SET state = ?, data = '' WHERE (state = ? OR state LIKE ?) AND updated_at < ?",
+                EXPIRED_STATE, state, f"{state}:%", now - ttl,
+            )
+        exclusions = "".join(" AND state != ? AND state NOT LIKE ?" for _ in FSM_STATE_TTL)
+        await self.db.execute(
+            f"UPDATE fsm_state SET state = ?, data = '' WHERE state != ?{exclusions} AND updated_at < ?",
+            EXPIRED_STATE, EXPIRED_STATE,
+            *(value for state in FSM_STATE_TTL for value in (state, f"{state}:%")),
+            now - FSM_DEFAULT_TTL,
+        )
+        await self.db.execute(
+            "DELETE FROM fsm_state WHERE (state IS NULL OR state = ?) AND updated_at < ?",
+            EXPIRED_STATE, now - FSM_TOMBSTONE_TTL,
+        )
+
+        row = await self.db.fetchone("SELECT count(*) FROM fsm_state WHERE state != ?", EXPIRED_STATE)
+        if row[0] > self.max_flows:
+            await self.db.execute(
+                "UPDATE fsm_state SET state = ?, data = '' WHERE (chat_id, user_id) IN ("
+                "SELECT chat_id, user_id FROM fsm_state WHERE state != ? ORDER BY updated_at LIMIT ?)",
+                EXPIRED_STATE, EXPIRED_STATE, row[0] - self.max_flows,
+            )
+
+    async def _cleanup(self, chat: typing.Union[str, int], user: typing.Union[str, int]):
+        """Deletes row of user who has neither state nor data."""
+        await self.db.execute(
+            "DELETE FROM fsm_state WHERE chat_id = ? AND user_id = ? AND state IS NULL AND data = ''",
+            int(chat), int(user),
+        )
+
+
+def _dump(data: typing.Optional[dict]) -> str:
+    """Serializes FSM data to compact JSON (empty string for empty data)."""
+    if not data:
+        return ""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class MemoryFlowStorage(MemoryStorage):
+    """
+    MemoryStorage which expires abandoned flows and keeps at most max_flows of them
+    evicting the least recently updated ones. Reading does not create entries for users.
+    """
+
+    def __init__(self, max_flows: int):
+        """
+        :param max_flows: Max number of flows kept in memory.
+        """
+        super(MemoryFlowStorage, self).__init__()
+        self.max_flows = max_flows
+
+        # (chat, user) -> time of the last change, the least recently updated go first.
+        self._updated = OrderedDict()
+        # Tombstones of expired flows: (chat, user) -> time of expiration.
+        self._expired = OrderedDict()
+
+    async def get_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        return self.data.get(chat, {}).get(user, {}).get("state", self.resolve_state(default))
+
+    async def get_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        chat, user = map(str, self.check_address(chat=chat, user=user))
+        return copy.deepcopy(self.data.get(chat, {}).get(user, {}).get("data", default or {}))
+
+    async def set_state(self, *,
+                        chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        await super(MemoryFlowStorage, self).set_state(chat=chat, user=user, state=state)
+        self._touch(chat, user)
+
+    async def set_data(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        await super(MemoryFlowStorage, self).set_data(chat=chat, user=user, data=data)
+        self._touch(chat, user)
+
+    async def update_data(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None,
+                          **kwargs):
+        await super(MemoryFlowStorage, self).update_data(chat=chat, user=user, data=data, **kwargs)
+        self._touch(chat, user)
+
+    async def reset_state(self, *,
+                          chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        await super(MemoryFlowStorage, self).reset_state(chat=chat, user=user, with_data=with_data)
+        self._touch(chat, user)
+
+    async def get_flow(self, *,
+                       chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None) -> typing.Tuple[typing.Optional[str], bool]:
+        """
+        Returns user's state and drops the flow if it has expired.
+
+        :return: State (None if there is no flow) and whether the flow has expired.
+        """
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        if self._expired.pop(key, None) is not None:
+            return None, True
+
+        state = await self.get_state(chat=chat, user=user)
+        if state is not None and time.time() - self._updated.get(key, 0) > state_ttl(state):
+            await self.reset_state(chat=chat, user=user)
+            return None, True
+
+        return state, False
+
+    async def sweep(self):
+        """Turns expired and the least recently updated flows over max_flows into tombstones."""
+        now = time.time()
+
+        for (chat, user), updated_at in list(self._updated.items()):
+            state = self.data.get(chat, {}).get(user, {}).get("state")
+            ttl = FSM_DEFAULT_TTL if state is None else state_ttl(state)
+            if now - updated_at > ttl:
+                self._expire(chat, user, now, notify=state is not None)
+
+        while len(self._updated) > self.max_flows:
+            chat, user = next(iter(self._updated))
+            self._expire(chat, user, now)
+
+        while self._expired and (len(self._expired) > self.max_flows or
+                                 now - next(iter(self._expired.values())) > FSM_TOMBSTONE_TTL):
+            self._expired.popitem(last=False)
+
+    def _touch(self, chat: typing.Union[str, int, None], user: typing.Union[str, int, None]):
+        """Remembers time of the last change of the flow or forgets the finished flow."""
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        self._expired.pop(key, None)
+
+        if key[1] in self.data.get(key[0], {}):
+            self._updated[key] = time.time()
+            self._updated.move_to_end(key)
+        else:
+            self._updated.pop(key, None)
+
+    def _expire(self, chat: str, user: str, now: float, notify: bool = True):
+        """Drops the flow from memory leaving a tombstone."""
+        self.data.get(chat, {}).pop(user, None)
+        if not self.data.get(chat, True):
+            del self.data[chat]
+
+        self._updated.pop((chat, user), None)
+        if notify:
+            self._expired[(chat, user)] = now
+
+
+async def sweep_flows(storage: typing.Union[DatabaseStorage, MemoryFlowStorage], interval: float):
+    """
+    Periodically expires abandoned flows.
+
+    :param storage: FSM storage.
+    :param interval: Seconds between sweeps.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await storage.sweep()
+        except Exception as exc:
+            logging.error("Exception during sweeping FSM states!", exc_info=exc)
@@ -3,8 +3,7 @@ Functions for working with accounts (add, delete, rename, change_balance, change
 """
 import gspread
 
-
-service_account = gspread.service_account("google_token.json")
+from google_sheet.client import service_account
 
 
 def get_account_names(sheet: gspread.spreadsheet.Spreadsheet) -> list:
@@ -0,0 +1,146 @@
+"""
+Archive of transactions of closed years. Transactions of previous years are moved
+from "Транзакции" worksheet to "Архив <year>" worksheets (same layout) by one batchUpdate
+request with server-side cut and paste, so the worksheet used by the bot stays small.
+
+The tables are sorted from the newest transaction, so transactions of closed years
+are a block at the bottom of each table. Only this block is moved.
+"""
+import datetime
+import typing
+
+from gspread.urls import SPREADSHEET_URL, SPREADSHEET_VALUES_BATCH_URL
+
+from google_sheet.batch import BatchUpdate
+from google_sheet.client import service_account
+from google_sheet.transactions import TABLES, FIRST_ROW
+
+
+ARCHIVE_TITLE = "Архив {}"
+# Dates are stored as formulas, unformatted values are days since this date.
+SERIAL_DATE_EPOCH = datetime.date(1899, 12, 30)
+
+
+def get_sheets(gsheet_id: str) -> typing.Dict[str, dict]:
+    """
+    Returns properties (sheetId, title, gridProperties) of worksheets by their titles.
+
+    :param gsheet_id: ID of Google sheet.
+    """
+    response = service_account.request("get", SPREADSHEET_URL % gsheet_id, params={"fields": "sheets.properties"})
+    return {sheet["properties"]["title"]: sheet["properties"] for sheet in response.json()["sheets"]}
+
+
+def get_year(value) -> typing.Optional[int]:
+    """Returns year of the unformatted date cell or None if the cell is not a date."""
+    if not isinstance(value, (int, float)):
+        return None
+
+    return (SERIAL_DATE_EPOCH + datetime.timedelta(days=int(value))).year
+
+
+def get_closed_blocks(dates: list, first_open_year: int) -> typing.List[typing.Tuple[int, int, int]]:
+    """
+    Returns blocks of rows of closed years at the bottom of the table, the lowest block first.
+
+    :param dates: Unformatted date cells of the table, the newest first.
+    :param first_open_year: Transactions of this year and later are not archived.
+    :return: Tuples (year, index of the first row in dates, number of rows).
+    """
+    years = [get_year(value) for value in dates]
+
+    start = len(years)
+    while start > 0 and years[start - 1] is not None and years[start - 1] < first_open_year:
+        start -= 1
+
+    blocks = []
+    end = len(years)
+    while end > start:
+        block_start = end - 1
+        while block_start > start and years[block_start - 1] == years[end - 1]:
+            block_start -= 1
+
+        blocks.append((years[end - 1], block_start, end - block_start))
+        end = block_start
+
+    return blocks
+
+
+def archive_transactions(gsheet_id: str, first_open_year: int) -> typing.Dict[str, int]:
+    """
+    Moves transactions of the years before first_open_year to archive worksheets.
+    Reads only the date columns, everything is moved by one request.
+
+    :param gsheet_id: ID of Google sheet.
+    :param first_open_year: Transactions of this year and later stay on "Транзакции" worksheet.
+    :return: Number of moved transactions by type (expense/income).
+    """
+    sheets = get_sheets(gsheet_id)
+    transactions_sheet = sheets["Транзакции"]
+
+    columns = {kind: chr(ord("A") + start_column) for kind, (start_column, _) in TABLES.items()}
+    response = service_account.request(
+        "get",
+        SPREADSHEET_VALUES_BATCH_URL % gsheet_id,
+        params={
+            "ranges": [f"'Транзакции'!{column}{FIRST_ROW + 1}:{column}" for column in columns.values()],
+            "majorDimension": "COLUMNS",
+            "valueRenderOption": "UNFORMATTED_VALUE",
+        },
+    )
+    value_ranges = response.json().get("valueRanges", [])
+
+    blocks = dict()
+    for kind, value_range in zip(columns, value_ranges):
+        dates = value_range.get("values", [[]])[0]
+        blocks[kind] = get_closed_blocks(dates, first_open_year)
+
+    if not any(blocks.values()):
+        return {kind: 0 for kind in TABLES}
+
+    batch = BatchUpdate(gsheet_id)
+    column_count = transactions_sheet["gridProperties"]["columnCount"]
+    next_sheet_id = max(properties["sheetId"] for properties in sheets.values()) + 1
+
+    # Number of moved rows of each year by type.
+    counts = dict()
+    for kind, kind_blocks in blocks.items():
+        for year, _, count in kind_blocks:
+            counts.setdefault(year, dict()).setdefault(kind, 0)
+            counts[year][kind] += count
+
+    archive_ids = dict()
+    for year, year_counts in sorted(counts.items()):
+        title = ARCHIVE_TITLE.format(year)
+        if title in sheets:
+            archive_ids[year] = sheets[title]["sheetId"]
+            batch.append_rows(archive_ids[year], max(year_counts.values()))
+            # Rows archived before stay below the moved ones.
+            for kind, count in year_counts.items():
+                start_column, end_column = TABLES[kind]
+                batch.insert_rows(archive_ids[year], FIRST_ROW, count, start_column, end_column)
+        else:
+            archive_ids[year] = next_sheet_id
+            next_sheet_id += 1
+            batch.add_sheet(archive_ids[year], title, FIRST_ROW + max(year_counts.values()), column_count)
+            # Headers of the tables.
+            batch.copy_rows(transactions_sheet["sheetId"], 0, FIRST_ROW, column_count, archive_ids[year])
+
+    for kind, kind_blocks in blocks.items():
+        start_column, end_column = TABLES[kind]
+        offsets = {year: 0 for year in counts}
+        # From the top, so the rows keep their order in the archive.
+        for year, start, count in reversed(kind_blocks):
+            batch.move_rows(
+                transactions_sheet["sheetId"],
+                FIRST_ROW + start,
+                count,
+                start_column,
+                end_column,
+                archive_ids[year],
+                FIRST_ROW + offsets[year],
+            )
+            offsets[year] += count
+
+    batch.execute()
+    return {kind: sum(count for _, _, count in blocks[kind]) for kind in TABLES}
@@ -0,0 +1,215 @@
+"""
+Builder of spreadsheets.batchUpdate requests. Several changes of user's Google sheet
+(shifting a table, writing rows, changing balances) are sent as one atomic request,
+instead of reading and rewriting the table by separate calls.
+
+Rows and columns are 0-based, end indexes are exclusive (as in GridRange of Sheets API).
+"""
+import typing
+
+from gspread.urls import SPREADSHEET_BATCH_UPDATE_URL
+
+from google_sheet.client import service_account
+
+
+def cell_data(value) -> dict:
+    """
+    Returns CellData with user entered value: formulas start with "=", numbers are numbers.
+
+    :param value: Value of the cell.
+    """
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    if isinstance(value, str) and value.startswith("="):
+        return {"userEnteredValue": {"formulaValue": value}}
+
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+def grid_range(sheet_id: int, start_row: int, end_row: int, start_column: int, end_column: int) -> dict:
+    """Returns GridRange of the worksheet."""
+    return {
+        "sheetId": sheet_id,
+        "startRowIndex": start_row,
+        "endRowIndex": end_row,
+        "startColumnIndex": start_column,
+        "endColumnIndex": end_column,
+    }
+
+
+class BatchUpdate:
+    """Requests of one spreadsheets.batchUpdate call."""
+
+    def __init__(self, gsheet_id: str):
+        """
+        :param gsheet_id: ID of user's Google sheet.
+        """
+        self.gsheet_id = gsheet_id
+        self.requests = []
+
+    def insert_rows(self, sheet_id: int, start_row: int, count: int, start_column: int, end_column: int):
+        """
+        Inserts empty rows into the columns, cells below are shifted down.
+        Other columns of the worksheet are not changed.
+
+        :param sheet_id: ID of the worksheet.
+        :param start_row: Index of the first inserted row.
+        :param count: Number of inserted rows.
+        :param start_column: Index of the first column of the table.
+        :param end_column: Index of the column after the table.
+        """
+        self.requests.append({
+            "insertRange": {
+                "range": grid_range(sheet_id, start_row, start_row + count, start_column, end_column),
+                "shiftDimension": "ROWS",
+            }
+        })
+
+    def delete_rows(self, sheet_id: int, start_row: int, count: int, start_column: int, end_column: int):
+        """
+        Deletes rows of the columns, cells below are shifted up.
+        Other columns of the worksheet are not changed.
+
+        :param sheet_id: ID of the worksheet.
+        :param start_row: Index of the first deleted row.
+        :param count: Number of deleted rows.
+        :param start_column: Index of the first column of the table.
+        :param end_column: Index of the column after the table.
+        """
+        self.requests.append({
+            "deleteRange": {
+                "range": grid_range(sheet_id, start_row, start_row + count, start_column, end_column),
+                "shiftDimension": "ROWS",
+            }
+        })
+
+    def copy_format(self, sheet_id: int, source_row: int, start_row: int, count: int,
+                    start_column: int, end_column: int):
+        """
+        Copies format of the row to the rows (inserted cells have no format).
+
+        :param sheet_id: ID of the worksheet.
+        :param source_row: Index of the row whose format is copied.
+        :param start_row: Index of the first row getting the format.
+        :param count: Number of rows getting the format.
+        :param start_column: Index of the first column.
+        :param end_column: Index of the column after the last one.
+        """
+        self.requests.append({
+            "copyPaste": {
+                "source": grid_range(sheet_id, source_row, source_row + 1, start_column, end_column),
+                "destination": grid_range(sheet_id, start_row, start_row + count, start_column, end_column),
+                "pasteType": "PASTE_FORMAT",
+            }
+        })
+
+    def move_rows(self, sheet_id: int, start_row: int, count: int, start_column: int, end_column: int,
+                  destination_sheet_id: int, destination_row: int):
+        """
+        Cuts cells (values, formulas and format) and pastes them to the other place.
+        The source cells stay empty, nothing is shifted.
+
+        :param sheet_id: ID of the source worksheet.
+        :param start_row: Index of the first moved row.
+        :param count: Number of moved rows.
+        :param start_column: Index of the first column.
+        :param end_column: Index of the column after the last one.
+        :param destination_sheet_id: ID of the destination worksheet.
+        :param destination_row: Index of the row the first moved row is pasted to (columns are kept).
+        """
+        self.requests.append({
+            "cutPaste": {
+                "source": grid_range(sheet_id, start_row, start_row + count, start_column, end_column),
+                "destination": {
+                    "sheetId": destination_sheet_id,
+                    "rowIndex": destination_row,
+                    "columnIndex": start_column,
+                },
+                "pasteType": "PASTE_NORMAL",
+            }
+        })
+
+    def copy_rows(self, sheet_id: int, start_row: int, count: int, end_column: int, destination_sheet_id: int):
+        """
+        Copies rows (values, formulas and format) to the same place of the other worksheet.
+
+        :param sheet_id: ID of the source worksheet.
+        :param start_row: Index of the first copied row.
+        :param count: Number of copied rows.
+        :param end_column: Index of the column after the last copied one.
+        :param destination_sheet_id: ID of the destination worksheet.
+        """
+        self.requests.append({
+            "copyPaste": {
+                "source": grid_range(sheet_id, start_row, start_row + count, 0, end_column),
+                "destination": grid_range(destination_sheet_id, start_row, start_row + count, 0, end_column),
+                "pasteType": "PASTE_NORMAL",
+            }
+        })
+
+    def add_sheet(self, sheet_id: int, title: str, row_count: int, column_count: int):
+        """
+        Adds worksheet. Its ID is chosen by the caller, so next requests of the batch can use it.
+
+        :param sheet_id: ID of the new worksheet (unique in the spreadsheet).
+        :param title: Title of the worksheet.
+        :param row_count: Number of rows.
+        :param column_count: Number of columns.
+        """
+        self.requests.append({
+            "addSheet": {
+                "properties": {
+                    "sheetId": sheet_id,
+                    "title": title,
+                    "gridProperties": {"rowCount": row_count, "columnCount": column_count},
+                }
+            }
+        })
+
+    def append_rows(self, sheet_id: int, count: int):
+        """
+        Adds empty rows to the end of the worksheet.
+
+        :param sheet_id: ID of the worksheet.
+        :param count: Number of rows.
+        """
+        self.requests.append({"appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": count}})
+
+    def update_cells(self, sheet_id: int, start_row: int, start_column: int, rows: typing.List[list]):
+        """
+        Writes values to the cells starting from the cell (start_row, start_column).
+
+        :param sheet_id: ID of the worksheet.
+        :param start_row: Index of the first row.
+        :param start_column: Index of the first column.
+        :param rows: Rows of values.
+        """
+        self.requests.append({
+            "updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": start_row, "columnIndex": start_column},
+                "rows": [{"values": [cell_data(value) for value in row]} for row in rows],
+                "fields": "userEnteredValue",
+            }
+        })
+
+    def clear_sheet(self, sheet_id: int):
+        """
+        Clears values of all cells of the worksheet (format is kept).
+
+        :param sheet_id: ID of the worksheet.
+        """
+        self.requests.append({"updateCells": {"range": {"sheetId": sheet_id}, "fields": "userEnteredValue"}})
+
+    def execute(self) -> dict:
+        """Sends all requests by one call. Nothing is changed if any of the requests fails."""
+        if not self.requests:
+            return {}
+
+        response = service_account.request(
+            "post",
+            SPREADSHEET_BATCH_UPDATE_URL % self.gsheet_id,
+            json={"requests": self.requests},
+        )
+        return response.json()
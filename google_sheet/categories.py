@@ -4,8 +4,7 @@ Functions for working with categories (add, rename, delete).
 import logging
 import gspread
 
-
-service_account = gspread.service_account("google_token.json")
+from google_sheet.client import service_account
 
 
 def get_categories(worksheet: gspread.Worksheet = None, gsheet_id: str = None) -> dict:
@@ -22,7 +21,7 @@ def get_categories(worksheet: gspread.Worksheet = None, gsheet_id: str = None) -
         if gsheet_id is None:
             raise ValueError("No one of the parameters (sheet or gsheet_id) were passed to the function!")
         else:
-            logging.info(f"Connecting to gsheet with key: {gsheet_id}")
+            logging.info("Connecting to gsheet with key: %s", gsheet_id)
             sheet = service_account.open_by_key(gsheet_id)
             worksheet = sheet.worksheet("Настройки")
 
@@ -0,0 +1,116 @@
+"""
+Google API client shared by all google_sheet modules. It counts requests per API method
+and HTTP status, measures their latency and retries requests rejected because of quota.
+"""
+import random
+import sys
+import time
+
+from urllib.parse import urlparse
+
+import gspread
+
+from gspread.exceptions import APIError
+
+from config import SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX, SHEETS_MAX_WAIT
+from metrics import Counter, Histogram
+from tracing import span
+
+
+sheets_requests = Counter(
+    "sheets_requests_total", "Requests to Google API by method and HTTP status.", ["method", "status"]
+)
+sheets_request_seconds = Histogram(
+    "sheets_request_seconds", "Latency of requests to Google API.", ["method"]
+)
+sheets_quota_wait_seconds = Counter(
+    "sheets_quota_wait_seconds_total", "Seconds spent waiting after requests rejected because of quota.", ["method"]
+)
+
+ACTIONS = {"append", "clear", "batchGet", "batchUpdate", "batchClear", "copyTo"}
+HTTP_METHODS = {"get": "get", "put": "update", "post": "create", "delete": "delete"}
+
+
+def get_api_method(method: str, endpoint: str) -> str:
+    """
+    Returns name of Google API method called by the request (e.g. values.append).
+
+    :param method: HTTP method.
+    :param endpoint: URL of the request.
+    """
+    path = urlparse(endpoint).path
+    if "/v4/spreadsheets/" not in path:
+        return f"drive.{HTTP_METHODS.get(method, method)}"
+
+    # {spreadsheet_id}[:action][/{resource}[/{id}][:action]]
+    parts = path.split("/v4/spreadsheets/", 1)[1].split("/")
+    resource, _, action = parts[-1].rpartition(":")
+    if action not in ACTIONS:
+        action = HTTP_METHODS.get(method, method)
+
+    if len(parts) == 1:
+        return action
+
+    return f"{parts[1].split(':')[0]}.{action}"
+
+
+def get_gspread_call() -> str:
+    """Returns name of gspread method called by the bot which made the request (e.g. open_by_key)."""
+    call = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        if frame.f_globals.get("__name__", "").startswith("gspread"):
+            call = frame.f_code.co_name
+        elif call is not None:
+            break
+        frame = frame.f_back
+
+    return call or "request"
+
+
+class InstrumentedClient(gspread.Client):
+    """gspread client which collects metrics and backs off when quota is exceeded."""
+
+    def request(self, method, endpoint, *args, **kwargs):
+        api_method = get_api_method(method, endpoint)
+
+        with span(f"sheets.{get_gspread_call()}", method=api_method) as request_span:
+            return self._request(api_method, request_span, method, endpoint, *args, **kwargs)
+
+    def _request(self, api_method, request_span, method, endpoint, *args, **kwargs):
+        """
+        Makes request retrying it while quota is exceeded. The request runs in a thread of
+        the default executor (see background.run_blocking), which is shared with other
+        requests, so the waits of a request are limited by SHEETS_MAX_WAIT in total and
+        then the quota error is raised to the caller.
+        """
+        waited = 0
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            request_span.attributes["attempts"] = attempt + 1
+            started_at = time.monotonic()
+            try:
+                response = super(InstrumentedClient, self).request(method, endpoint, *args, **kwargs)
+            except APIError as exc:
+                status = exc.response.status_code
+                sheets_requests.inc(method=api_method, status=status)
+                sheets_request_seconds.observe(time.monotonic() - started_at, method=api_method)
+
+                if status != 429 or attempt == SHEETS_MAX_RETRIES or waited >= SHEETS_MAX_WAIT:
+                    raise
+
+                wait = min(SHEETS_BACKOFF_BASE * 2 ** attempt, SHEETS_BACKOFF_MAX) * random.uniform(1, 1.5)
+                wait = min(wait, SHEETS_MAX_WAIT - waited)
+                waited += wait
+                sheets_quota_wait_seconds.inc(wait, method=api_method)
+                request_span.attributes["quota_wait"] = request_span.attributes.get("quota_wait", 0) + wait
+                time.sleep(wait)
+            except Exception:
+                sheets_requests.inc(method=api_method, status="error")
+                raise
+            else:
+                sheets_requests.inc(method=api_method, status=response.status_code)
+                sheets_request_seconds.observe(time.monotonic() - started_at, method=api_method)
+                return response
+
+
+service_account = gspread.service_account("google_token.json", client_factory=InstrumentedClient)
@@ -1,13 +1,8 @@
 """
-Functions for working with expenses (add).
+Functions for reading expenses. They are written by google_sheet.transactions.
 """
-import datetime
 import gspread
 
-from google_sheet.accounts import change_balance
-
-service_account = gspread.service_account("google_token.json")
-
 
 def get_expenses(worksheet: gspread.Worksheet) -> list:
     """
@@ -41,56 +36,3 @@ def get_total_expenses(worksheet: gspread.Worksheet) -> int:
     :param worksheet: Google worksheet with expenses table.
     """
     return len(worksheet.col_values(1)[2:])
-
-
-def add_expense(amount: float,
-                category: str,
-                account: str,
-                comment: str,
-                gsheet_id: str,
-                total_expenses: int = None,
-                account_names: list = None,
-                accounts: dict = None):
-    """
-    Adds expens to Google sheet.
-
-    :param amount: Money amount at account.
-    :param category: Category of expense.
-    :param account: Name of account.
-    :param comment: Description to expense.
-    :param gsheet_id: ID of Google sheet.
-    :param total_expenses: Number of expenses in table.
-    :param account_names: List of account names.
-    :param accounts: Dict of account properties.
-
-    :raise AssertionError: If amount less than 0.
-    """
-    sheet = service_account.open_by_key(gsheet_id)
-    transactions_worksheet = sheet.worksheet("Транзакции")
-    settings_worksheet = sheet.worksheet("Настройки")
-
-    assert amount >= 0
-
-    if total_expenses is None:
-        total_expenses = get_total_expenses(transactions_worksheet)
-        # total_expenses = len(get_expenses(transactions_worksheet))
-
-    current_time = datetime.datetime.now()
-
-    expenses = transactions_worksheet.get(f"A3:E{total_expenses + 2}")
-    for row in expenses:
-        if len(row) < 5:
-            row += [""]
-
-    transactions_worksheet.update(f"A4:E{total_expenses + 3}", expenses)
-    transactions_worksheet.update("B3:E3", [[category, amount, account, comment]])
-    transactions_worksheet.update_acell("A3", f"=date({current_time.year}, {current_time.month}, {current_time.day})")
-
-    change_balance(
-        "decrease",
-        account,
-        amount,
-        account_names=account_names,
-        accounts=accounts,
-        worksheet=settings_worksheet,
-    )
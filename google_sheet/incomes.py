@@ -1,13 +1,8 @@
 """
-Functions for working with incomes (add).
+Functions for reading incomes. They are written by google_sheet.transactions.
 """
-import datetime
 import gspread
 
-from google_sheet.accounts import change_balance
-
-service_account = gspread.service_account("google_token.json")
-
 
 def get_incomes(sheet: gspread.spreadsheet.Spreadsheet) -> list:
     """
@@ -43,55 +38,3 @@ def get_total_incomes(worksheet: gspread.Worksheet) -> int:
     :param worksheet: Google worksheet with incomes table.
     """
     return len(worksheet.col_values(7)[2:])
-
-
-def add_income(amount: float,
-               category: str,
-               account: str,
-               comment: str,
-               gsheet_id: str,
-               total_incomes: int = None,
-               account_names: list = None,
-               accounts: dict = None):
-    """
-    Adds income to Google sheet.
-
-    :param amount: Money amount at account.
-    :param category: Category of income.
-    :param account: Name of account.
-    :param gsheet_id: ID of Google sheet.
-    :param comment: Description to income.
-    :param total_incomes: Number of incomes in table.
-    :param account_names: List of account names.
-    :param accounts: Dict of account properties.
-
-    :raise AssertionError: If category does not exist or account does not exist or amount less than 0.
-    """
-    sheet = service_account.open_by_key(gsheet_id)
-    transactions_worksheet = sheet.worksheet("Транзакции")
-    settings_worksheet = sheet.worksheet("Настройки")
-
-    assert amount >= 0
-
-    if total_incomes is None:
-        total_incomes = get_total_incomes(transactions_worksheet)
-
-    current_time = datetime.datetime.now()
-
-    incomes = transactions_worksheet.get(f"G3:K{total_incomes + 2}")
-    for row in incomes:
-        if len(row) < 5:
-            row += [""]
-
-    transactions_worksheet.update(f"G4:K{total_incomes + 3}", incomes)
-    transactions_worksheet.update("H3:K3", [[category, amount, account, comment]])
-    transactions_worksheet.update_acell("G3", f"=date({current_time.year}, {current_time.month}, {current_time.day})")
-
-    change_balance(
-        "increase",
-        account,
-        amount,
-        account_names=account_names,
-        accounts=accounts,
-        worksheet=settings_worksheet,
-    )
@@ -0,0 +1,40 @@
+"""
+Functions for reading user's settings snapshot (categories, accounts, number of transactions).
+"""
+from google_sheet.categories import get_categories
+from google_sheet.accounts import get_accounts
+from google_sheet.expenses import get_total_expenses
+from google_sheet.incomes import get_total_incomes
+from google_sheet.client import service_account
+from google_sheet.summary import SUMMARY_TITLE
+
+
+def fetch_settings(gsheet_id: str) -> dict:
+    """
+    Reads everything the bot's flows need from user's Google sheet at once.
+
+    :param gsheet_id: ID of user's Google sheet.
+    :return: Dict with gsheet_id, sheet_ids, categories, account_names, accounts, total_expenses and total_incomes.
+    """
+    sheet = service_account.open_by_key(gsheet_id)
+    # One request for all worksheets instead of one per worksheet.
+    worksheets = {worksheet.title: worksheet for worksheet in sheet.worksheets()}
+    settings_worksheet = worksheets["Настройки"]
+    transactions_worksheet = worksheets["Транзакции"]
+
+    account_names, accounts = get_accounts(settings_worksheet)
+
+    return {
+        "gsheet_id": gsheet_id,
+        # For batch updates, which address worksheets by ID.
+        "sheet_ids": {
+            "transactions": transactions_worksheet.id,
+            "settings": settings_worksheet.id,
+            "summary": worksheets[SUMMARY_TITLE].id if SUMMARY_TITLE in worksheets else None,
+        },
+        "categories": get_categories(settings_worksheet),
+        "account_names": account_names,
+        "accounts": accounts,
+        "total_expenses": get_total_expenses(transactions_worksheet),
+        "total_incomes": get_total_incomes(transactions_worksheet),
+    }
@@ -0,0 +1,130 @@
+"""
+"Сводка" worksheet: totals of transactions by month, type and category, one row each.
+The bot keeps the same totals locally (see summary.py), so it knows the row and the new
+total of every changed cell and writes them in the batchUpdate request of the transactions.
+The table is read only once, when the worksheet is built.
+"""
+import datetime
+import typing
+
+from gspread.urls import SPREADSHEET_VALUES_BATCH_URL
+
+from google_sheet.archive import SERIAL_DATE_EPOCH, get_sheets
+from google_sheet.batch import BatchUpdate
+from google_sheet.client import service_account
+from google_sheet.transactions import TABLES, FIRST_ROW
+
+
+SUMMARY_TITLE = "Сводка"
+HEADER = ["Месяц", "Тип", "Категория", "Сумма"]
+KIND_NAMES = {"expense": "Расход", "income": "Доход"}
+
+
+def get_month(date: datetime.date) -> str:
+    """Returns month of the date as it is written in the summary (e.g. 2024-05)."""
+    return date.strftime("%Y-%m")
+
+
+def summary_row(key: typing.Tuple[str, str, str], total: float) -> list:
+    """
+    Returns row of the summary.
+
+    :param key: Tuple (kind, month, category).
+    :param total: Total of the transactions.
+    """
+    kind, month, category = key
+    return [month, KIND_NAMES[kind], category, round(total, 2)]
+
+
+class SummaryChanges:
+    """New totals of the summary written together with transactions."""
+
+    def __init__(self, sheet_id: int, next_row: int):
+        """
+        :param sheet_id: ID of "Сводка" worksheet.
+        :param next_row: Index of the first empty row of the worksheet.
+        """
+        self.sheet_id = sheet_id
+        self.next_row = next_row
+        self.totals = dict()  # (kind, month, category): (row, total)
+
+    def set_total(self, key: typing.Tuple[str, str, str], total: float, row: int = None):
+        """
+        Sets new total of the row. Rows of new keys are added to the end of the worksheet.
+
+        :param key: Tuple (kind, month, category).
+        :param total: New total.
+        :param row: Index of the row or None if the key is new.
+        """
+        if row is None:
+            row = self.totals[key][0] if key in self.totals else self.next_row + self.new_rows
+
+        self.totals[key] = (row, total)
+
+    @property
+    def new_rows(self) -> int:
+        """Number of rows added by the changes."""
+        return sum(1 for row, _ in self.totals.values() if row >= self.next_row)
+
+    def add_to_batch(self, batch: BatchUpdate):
+        """
+        Adds writing of the totals to the batch. Every total is written to its tracked row,
+        so the rows stay where the bot expects them whatever is written below by hand.
+        The worksheet has at least next_row rows, so it is extended by the number of new rows.
+        """
+        if self.new_rows:
+            batch.append_rows(self.sheet_id, self.new_rows)
+
+        for key, (row, total) in sorted(self.totals.items(), key=lambda item: item[1][0]):
+            batch.update_cells(self.sheet_id, row, 0, [summary_row(key, total)])
+
+
+def build_summary(gsheet_id: str) -> typing.Tuple[int, typing.List[tuple]]:
+    """
+    Reads transactions of "Транзакции" worksheet and rewrites "Сводка" worksheet
+    (it is created if needed) by their totals.
+
+    :param gsheet_id: ID of Google sheet.
+    :return: ID of "Сводка" worksheet and list of tuples (kind, month, category, total) in the order of rows.
+    """
+    sheets = get_sheets(gsheet_id)
+    response = service_account.request(
+        "get",
+        SPREADSHEET_VALUES_BATCH_URL % gsheet_id,
+        params={
+            "ranges": [
+                "'Транзакции'!{}{}:{}".format(chr(ord("A") + start), FIRST_ROW + 1, chr(ord("A") + end - 1))
+                for start, end in TABLES.values()
+            ],
+            "valueRenderOption": "UNFORMATTED_VALUE",
+        },
+    )
+
+    totals = dict()
+    names = dict()  # The same category typed in different case is one row.
+    for kind, value_range in zip(TABLES, response.json().get("valueRanges", [])):
+        for row in value_range.get("values", []):
+            if len(row) < 3 or not isinstance(row[0], (int, float)) or not isinstance(row[2], (int, float)):
+                continue
+
+            month = get_month(SERIAL_DATE_EPOCH + datetime.timedelta(days=int(row[0])))
+            key = (kind, month, names.setdefault((kind, str(row[1]).lower()), str(row[1])))
+            totals[key] = totals.get(key, 0) + row[2]
+
+    keys = sorted(totals, key=lambda key: (key[1], key[0], key[2]))
+
+    batch = BatchUpdate(gsheet_id)
+    if SUMMARY_TITLE in sheets:
+        sheet_id = sheets[SUMMARY_TITLE]["sheetId"]
+        batch.clear_sheet(sheet_id)
+        missing_rows = len(keys) + 1 - sheets[SUMMARY_TITLE]["gridProperties"]["rowCount"]
+        if missing_rows > 0:
+            batch.append_rows(sheet_id, missing_rows)
+    else:
+        sheet_id = max(properties["sheetId"] for properties in sheets.values()) + 1
+        batch.add_sheet(sheet_id, SUMMARY_TITLE, max(1000, len(keys) + 1), len(HEADER))
+
+    batch.update_cells(sheet_id, 0, 0, [HEADER] + [summary_row(key, totals[key]) for key in keys])
+    batch.execute()
+
+    return sheet_id, [key + (totals[key],) for key in keys]
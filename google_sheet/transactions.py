@@ -0,0 +1,341 @@
+"""
+Functions for writing several transactions (expenses or incomes) at once.
+The rows are inserted into the top of the table and balances of the accounts
+are changed by one batchUpdate request, once per account.
+"""
+import datetime
+import typing
+from urllib.parse import quote
+
+from gspread.urls import SPREADSHEET_VALUES_BATCH_URL, SPREADSHEET_VALUES_URL
+from gspread.utils import rowcol_to_a1
+
+from google_sheet.batch import BatchUpdate
+from google_sheet.client import service_account
+
+
+# Columns of the tables on "Транзакции" worksheet: (first, after the last), 0-based.
+TABLES = {
+    "expense": (0, 5),  # A:E
+    "income": (6, 11),  # G:K
+}
+FIRST_ROW = 2  # Row 3, the newest transaction.
+ACCOUNTS_FIRST_ROW = 3  # Row 4 of "Настройки" worksheet.
+BALANCE_COLUMN = 5  # Column F of "Настройки" worksheet.
+
+
+def transaction_row(entry: dict, date: datetime.date) -> list:
+    """
+    Returns row of the transactions table.
+
+    :param entry: Dict with amount, category, account, comment and optional date (ISO format).
+    :param date: Date of the transaction if the entry has no date.
+    """
+    if "date" in entry:
+        date = datetime.date.fromisoformat(entry["date"])
+
+    return [
+        f"=date({date.year}, {date.month}, {date.day})",
+        entry["category"],
+        entry["amount"],
+        entry["account"],
+        entry.get("comment", ""),
+    ]
+
+
+def get_balance_deltas(kind: str, entries: typing.List[dict]) -> typing.Dict[str, float]:
+    """
+    Returns total change of balance of each account (lowercase name) made by the transactions.
+
+    :param kind: Type of transactions (expense/income).
+    :param entries: Dicts with amount and account.
+    """
+    deltas = dict()
+    for entry in entries:
+        amount = entry["amount"] if kind == "income" else -entry["amount"]
+        deltas[entry["account"].lower()] = deltas.get(entry["account"].lower(), 0) + amount
+
+    return deltas
+
+
+def get_balances(gsheet_id: str, rows: typing.Dict[str, int]) -> typing.Dict[str, typing.Optional[float]]:
+    """
+    Reads current balances of the accounts by one request.
+
+    :param gsheet_id: ID of Google sheet.
+    :param rows: Rows of the accounts on "Настройки" worksheet by lowercase account name.
+    :return: Balances by lowercase account name (None if the cell is not a number).
+    """
+    accounts = list(rows)
+    response = service_account.request(
+        "get",
+        SPREADSHEET_VALUES_BATCH_URL % gsheet_id,
+        params={
+            "ranges": [
+                f"'Настройки'!{rowcol_to_a1(rows[account] + 1, BALANCE_COLUMN + 1)}" for account in accounts
+            ],
+            "valueRenderOption": "UNFORMATTED_VALUE",
+        },
+    )
+
+    balances = dict()
+    for account, value_range in zip(accounts, response.json().get("valueRanges", [])):
+        values = value_range.get("values", [[0]])
+        balances[account] = values[0][0] if values[0] and isinstance(values[0][0], (int, float)) else None
+
+    return balances
+
+
+def add_balance_updates(batch: BatchUpdate, sheet_id: int, account_names: list, accounts: dict,
+                        deltas: typing.Dict[str, float]):
+    """
+    Adds writing of new balances of the accounts to the batch. The balances are read
+    from the table right before, because the settings snapshot may be older than a manual
+    edit of a balance, which would be overwritten otherwise.
+
+    :param batch: BatchUpdate object.
+    :param sheet_id: ID of "Настройки" worksheet.
+    :param account_names: List of account names.
+    :param accounts: Dict of account properties.
+    :param deltas: Changes of balances by lowercase account name.
+    """
+    if not deltas:
+        return
+
+    lowercase_account_names = list(map(lambda word: word.lower(), account_names))
+    rows = {account: ACCOUNTS_FIRST_ROW + lowercase_account_names.index(account) for account in deltas}
+    balances = get_balances(batch.gsheet_id, rows)
+    for account, delta in deltas.items():
+        balance = balances.get(account)
+        if balance is None:
+            balance = accounts[account]["amount"]
+
+        batch.update_cells(sheet_id, rows[account], BALANCE_COLUMN, [[balance + delta]])
+
+
+def add_transactions(kind: str,
+                     entries: typing.List[dict],
+                     gsheet_id: str,
+                     sheet_ids: dict,
+                     account_names: list,
+                     accounts: dict,
+                     summary=None) -> typing.Dict[str, float]:
+    """
+    Adds transactions to Google sheet by one request. The last entry becomes the top row,
+    as if the entries were added one by one.
+
+    :param kind: Type of transactions (expense/income).
+    :param entries: Dicts with amount, category, account and comment.
+    :param gsheet_id: ID of Google sheet.
+    :param sheet_ids: IDs of worksheets (transactions, settings) from settings snapshot.
+    :param account_names: List of account names.
+    :param accounts: Dict of account properties.
+    :param summary: SummaryChanges written by the same request (see google_sheet.summary).
+    :return: Changes of balances by lowercase account name.
+
+    :raise ValueError: If kind is not expense or income.
+    :raise AssertionError: If entries are empty, amount less than 0 or account does not exist.
+    """
+    deltas = write_transactions({kind: entries}, gsheet_id, sheet_ids, account_names, accounts, summary)
+    return deltas[kind]
+
+
+def write_transactions(entries_by_kind: typing.Dict[str, typing.List[dict]],
+                       gsheet_id: str,
+                       sheet_ids: dict,
+                       account_names: list,
+                       accounts: dict,
+                       summary=None) -> typing.Dict[str, typing.Dict[str, float]]:
+    """
+    Adds expenses and incomes to Google sheet by one request. Balance of each account
+    is written once with the total change made by both types.
+
+    :param entries_by_kind: Dicts with amount, category, account and comment by type (expense/income).
+    :param gsheet_id: ID of Google sheet.
+    :param sheet_ids: IDs of worksheets (transactions, settings) from settings snapshot.
+    :param account_names: List of account names.
+    :param accounts: Dict of account properties.
+    :param summary: SummaryChanges written by the same request (see google_sheet.summary).
+    :return: Changes of balances by lowercase account name by type.
+
+    :raise ValueError: If type is not expense or income.
+    :raise AssertionError: If entries of a type are empty, amount less than 0 or account does not exist.
+    """
+    for kind, entries in entries_by_kind.items():
+        if kind not in TABLES:
+            raise ValueError(f"kind must be expense or income but not {kind}!")
+
+        assert len(entries) > 0
+        for entry in entries:
+            assert entry["amount"] >= 0
+            assert entry["account"].lower() in accounts
+
+    today = datetime.date.today()
+    batch = BatchUpdate(gsheet_id)
+    deltas_by_kind = dict()
+    total_deltas = dict()
+
+    for kind, entries in entries_by_kind.items():
+        start_column, end_column = TABLES[kind]
+        rows = [transaction_row(entry, today) for entry in reversed(entries)]
+
+        batch.insert_rows(sheet_ids["transactions"], FIRST_ROW, len(rows), start_column, end_column)
+        # The previous top row is below the inserted ones now.
+        batch.copy_format(
+            sheet_ids["transactions"], FIRST_ROW + len(rows), FIRST_ROW, len(rows), start_column, end_column
+        )
+        batch.update_cells(sheet_ids["transactions"], FIRST_ROW, start_column, rows)
+
+        deltas_by_kind[kind] = get_balance_deltas(kind, entries)
+        for account, delta in deltas_by_kind[kind].items():
+            total_deltas[account] = total_deltas.get(account, 0) + delta
+
+    add_balance_updates(batch, sheet_ids["settings"], account_names, accounts, total_deltas)
+    if summary is not None:
+        summary.add_to_batch(batch)
+
+    batch.execute()
+    return deltas_by_kind
+
+
+def rows_match(kind: str, row: int, entries: typing.List[dict], gsheet_id: str) -> bool:
+    """
+    Reads only the rows of the transactions and checks that they were not changed
+    in the table by hand (the bot knows their positions but not manual edits).
+
+    :param kind: Type of transactions (expense/income).
+    :param row: Index of the top row (the last entry).
+    :param entries: Dicts with amount, category, account and comment in the order of adding.
+    :param gsheet_id: ID of Google sheet.
+    """
+    start_column, end_column = TABLES[kind]
+    range_name = "'Транзакции'!{}:{}".format(
+        rowcol_to_a1(row + 1, start_column + 1),
+        rowcol_to_a1(row + len(entries), end_column),
+    )
+    response = service_account.request(
+        "get",
+        SPREADSHEET_VALUES_URL % (gsheet_id, quote(range_name)),
+        params={"valueRenderOption": "UNFORMATTED_VALUE"},
+    )
+    values = response.json().get("values", [])
+    if len(values) != len(entries):
+        return False
+
+    for values_row, entry in zip(values, reversed(entries)):
+        values_row = values_row + [""] * (5 - len(values_row))
+        try:
+            amount = float(values_row[2])
+        except ValueError:
+            return False
+
+        if (values_row[1], values_row[3], str(values_row[4])) != (entry["category"], entry["account"],
+                                                                   entry.get("comment", "")):
+            return False
+        if round(amount - entry["amount"], 2) != 0:
+            return False
+
+    return True
+
+
+def delete_transactions(kind: str,
+                        row: int,
+                        entries: typing.List[dict],
+                        gsheet_id: str,
+                        sheet_ids: dict,
+                        account_names: list,
+                        accounts: dict,
+                        summary=None) -> typing.Optional[typing.Dict[str, float]]:
+    """
+    Deletes rows of the transactions added by one commit and returns their amounts
+    to the accounts by one request.
+
+    :param kind: Type of transactions (expense/income).
+    :param row: Index of the top row (the last entry).
+    :param entries: Dicts with amount, category, account and comment in the order of adding.
+    :param gsheet_id: ID of Google sheet.
+    :param sheet_ids: IDs of worksheets (transactions, settings) from settings snapshot.
+    :param account_names: List of account names.
+    :param accounts: Dict of account properties.
+    :param summary: SummaryChanges written by the same request (see google_sheet.summary).
+    :return: Changes of balances by lowercase account name or None if the rows were changed by hand
+        (nothing is deleted then).
+
+    :raise ValueError: If kind is not expense or income.
+    """
+    if kind not in TABLES:
+        raise ValueError(f"kind must be expense or income but not {kind}!")
+
+    if not rows_match(kind, row, entries, gsheet_id):
+        return None
+
+    start_column, end_column = TABLES[kind]
+    batch = BatchUpdate(gsheet_id)
+    batch.delete_rows(sheet_ids["transactions"], row, len(entries), start_column, end_column)
+
+    deltas = {account: -delta for account, delta in get_balance_deltas(kind, entries).items()}
+    add_balance_updates(batch, sheet_ids["settings"], account_names, accounts, deltas)
+    if summary is not None:
+        summary.add_to_batch(batch)
+
+    batch.execute()
+    return deltas
+
+
+def update_transaction(kind: str,
+                       row: int,
+                       old_entry: dict,
+                       new_entry: dict,
+                       gsheet_id: str,
+                       sheet_ids: dict,
+                       account_names: list,
+                       accounts: dict,
+                       summary=None) -> typing.Optional[typing.Dict[str, float]]:
+    """
+    Rewrites the row of the transaction (the date is kept) and corrects balances
+    of the accounts by one request.
+
+    :param kind: Type of transactions (expense/income).
+    :param row: Index of the row.
+    :param old_entry: Dict with amount, category, account and comment written in the row.
+    :param new_entry: Dict with new amount, category, account and comment.
+    :param gsheet_id: ID of Google sheet.
+    :param sheet_ids: IDs of worksheets (transactions, settings) from settings snapshot.
+    :param account_names: List of account names.
+    :param accounts: Dict of account properties.
+    :param summary: SummaryChanges written by the same request (see google_sheet.summary).
+    :return: Changes of balances by lowercase account name or None if the row was changed by hand
+        (nothing is written then).
+
+    :raise ValueError: If kind is not expense or income.
+    :raise AssertionError: If amount less than 0 or account does not exist.
+    """
+    if kind not in TABLES:
+        raise ValueError(f"kind must be expense or income but not {kind}!")
+
+    assert new_entry["amount"] >= 0
+    assert new_entry["account"].lower() in accounts
+
+    if not rows_match(kind, row, [old_entry], gsheet_id):
+        return None
+
+    start_column, _ = TABLES[kind]
+    batch = BatchUpdate(gsheet_id)
+    # Only category, amount, account and comment, the date formula stays.
+    batch.update_cells(
+        sheet_ids["transactions"],
+        row,
+        start_column + 1,
+        [[new_entry["category"], new_entry["amount"], new_entry["account"], new_entry.get("comment", "")]],
+    )
+
+    deltas = get_balance_deltas(kind, [new_entry])
+    for account, delta in get_balance_deltas(kind, [old_entry]).items():
+        deltas[account] = deltas.get(account, 0) - delta
+    deltas = {account: delta for account, delta in deltas.items() if delta != 0}
+    add_balance_updates(batch, sheet_ids["settings"], account_names, accounts, deltas)
+    if summary is not None:
+        summary.add_to_batch(batch)
+
+    batch.execute()
+    return deltas
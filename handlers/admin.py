@@ -0,0 +1,80 @@
+"""
+Commands for the bot's admins (ADMIN_IDS in config).
+"""
+import html
+
+from aiogram import Dispatcher, types
+
+from config import ADMIN_IDS
+from throttling import rate_limit
+from tracing import Trace, get_traces
+from utils import reply
+
+
+MAX_MESSAGE_LENGTH = 4000
+MAX_TRACES = 10
+
+
+@rate_limit("cached")
+async def trace_cmd(message: types.Message):
+    """Shows the slowest recent updates or breakdown of the trace: /trace [trace_id]."""
+    trace_id = message.get_args().strip()
+    traces = get_traces()
+
+    if not trace_id:
+        if not traces:
+            reply(message, "Трейсов пока нет.")
+            return
+
+        lines = ["Медленные обновления (/trace <id> покажет подробности):"]
+        for trace in sorted(traces, key=lambda trace: trace.root.duration, reverse=True)[:MAX_TRACES]:
+            handler = next((span.attributes["handler"] for span in trace.spans if span.name == "handler"), "-")
+            lines.append(f"<code>{trace.trace_id}</code> {trace.root.duration:.2f} с — {html.escape(handler)}")
+
+        reply(message, "\n".join(lines), parse_mode="HTML")
+        return
+
+    trace = next((trace for trace in traces if trace.trace_id == trace_id), None)
+    if trace is None:
+        reply(message, "Трейс не найден, возможно, он уже вытеснен более новыми.")
+        return
+
+    text = format_trace(trace)
+    if len(text) > MAX_MESSAGE_LENGTH:
+        text = text[:MAX_MESSAGE_LENGTH] + "\n..."
+
+    reply(message, f"<pre>{html.escape(text)}</pre>", parse_mode="HTML")
+
+
+def format_trace(trace: Trace) -> str:
+    """
+    Returns tree of spans of the trace with their durations.
+
+    :param trace: Trace object.
+    """
+    children = dict()
+    for span in sorted(trace.spans, key=lambda span: span.started_at):
+        children.setdefault(span.parent_id, []).append(span)
+
+    lines = []
+
+    def add_span(span, depth):
+        attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items() if value is not None)
+        error = f" ! {span.error}" if span.error else ""
+        lines.append(f"{'  ' * depth}{span.name} {span.duration * 1000:.0f} мс {attributes}{error}".rstrip())
+
+        for child in children.get(span.span_id, []):
+            add_span(child, depth + 1)
+
+    add_span(trace.root, 0)
+    return "\n".join(lines)
+
+
+def register_admin_handlers(dp: Dispatcher):
+    """Registers admins' commands."""
+    dp.register_message_handler(
+        trace_cmd,
+        lambda msg: msg.from_user.id in ADMIN_IDS,
+        commands=["trace"],
+        state="*",
+    )
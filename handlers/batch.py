@@ -0,0 +1,250 @@
+"""
+Batch session: user adds several expenses (e.g. an evening of receipts), reviews them
+and saves them all by one write to Google sheet.
+"""
+import datetime
+import logging
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
+
+import journal
+import summary
+from background import run_blocking
+from config import BATCH_MAX_ENTRIES, CREATOR
+from google_sheet.transactions import add_transactions
+from keyboards import main_keyboard, settings_keyboard
+from server import bot
+from settings_cache import prefetch_settings, get_settings, apply_transactions, transaction_lock
+from throttling import rate_limit
+from utils import auth, answer_keyboard_page, reply, update_message
+
+
+class BatchExpenses(StatesGroup):
+    amount = State()
+    category = State()
+    account = State()
+
+
+def format_entries(entries: list) -> str:
+    """
+    Returns list of entries of the session with their total.
+
+    :param entries: Dicts with amount, category and account.
+    """
+    lines = [
+        f"{i}. {entry['amount']:g} — {entry['category']} ({entry['account']})"
+        for i, entry in enumerate(entries, 1)
+    ]
+    lines.append(f"\nИтого: {sum(entry['amount'] for entry in entries):g}")
+
+    return "\n".join(lines)
+
+
+def session_keyboard() -> InlineKeyboardMarkup:
+    """Keyboard for saving or cancelling the session."""
+    markup = InlineKeyboardMarkup()
+    markup.row(InlineKeyboardButton("Сохранить ✅", callback_data="batch_commit"))
+    markup.row(InlineKeyboardButton("Отмена ❌", callback_data="batch_cancel"))
+
+    return markup
+
+
+@rate_limit("cached")
+@auth
+async def batch_cmd(message: types.Message, state: FSMContext):
+    """Starts batch session."""
+    await state.finish()
+    await BatchExpenses.amount.set()
+    await state.update_data(entries=[])
+
+    reply(
+        message,
+        "*Пакет расходов*\n\nДобавь несколько расходов подряд, а я запишу их в таблицу все разом.\n\n"
+        "Напиши сумму первого расхода.",
+        parse_mode="Markdown",
+    )
+
+    await prefetch_settings(message.from_user.id)
+
+
+@rate_limit("cached")
+async def get_amount_handler(message: types.Message, state: FSMContext):
+    """Gets amount of the next entry."""
+    try:
+        amount = float(message.text)
+    except ValueError:
+        reply(message, "Введи числовое значение!")
+        return
+
+    if amount < 0:
+        reply(message, "Сумма не может быть отрицательной!")
+        return
+
+    async with state.proxy() as data:
+        if len(data["entries"]) >= BATCH_MAX_ENTRIES:
+            reply(
+                message,
+                f"В пакете уже {BATCH_MAX_ENTRIES} записей, сохрани их, а потом начни новый пакет.",
+                reply_markup=session_keyboard(),
+            )
+            return
+
+        data["amount"] = amount
+
+    settings = await get_settings(message.from_user.id)
+    if len(settings["categories"]["expense"]) == 0:
+        reply(
+            message,
+            "Похоже, что ты еще не добавил ни одной категории расходов.\n"
+            "Чтобы ее добавить, введи команду /add_category"
+        )
+        return
+
+    reply(message, "Выбери категорию расхода.", reply_markup=settings_keyboard(settings, "expense"))
+    await BatchExpenses.category.set()
+
+
+@rate_limit("cached")
+async def get_category_handler(message: types.Message, state: FSMContext):
+    """Gets category of the entry."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "expense"):
+        return
+
+    categories = {category.lower(): category for category in settings["categories"]["expense"]}
+    if message.text.lower() not in categories:
+        reply(
+            message,
+            "Я не знаю такой категории, попробуй ввести ее еще раз!",
+            reply_markup=settings_keyboard(settings, "expense"),
+        )
+        return
+
+    await state.update_data(category=categories[message.text.lower()])
+
+    if len(settings["account_names"]) == 0:
+        reply(message, "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account")
+        return
+
+    reply(
+        message,
+        "Выбери счет, с которого была совершена покупка.",
+        reply_markup=settings_keyboard(settings, "accounts"),
+    )
+    await BatchExpenses.account.set()
+
+
+@rate_limit("cached")
+async def get_account_handler(message: types.Message, state: FSMContext):
+    """Gets account of the entry and adds the entry to the session."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    account = settings["accounts"].get(message.text.lower())
+    if account is None:
+        reply(
+            message,
+            "Я не знаю такого счета, попробуй ввести его еще раз!",
+            reply_markup=settings_keyboard(settings, "accounts"),
+        )
+        return
+
+    async with state.proxy() as data:
+        data["entries"].append({
+            "amount": data.pop("amount"),
+            "category": data.pop("category"),
+            "account": account["name"],
+        })
+        entries = data["entries"]
+
+    await BatchExpenses.amount.set()
+    reply(
+        message,
+        f"{format_entries(entries)}\n\nНапиши сумму следующего расхода или сохрани пакет.",
+        reply_markup=session_keyboard(),
+    )
+
+
+@rate_limit("sheets_write")
+async def commit_callback(call_query: types.CallbackQuery, state: FSMContext):
+    """Writes all entries of the session to Google sheet."""
+    user_id = call_query.from_user.id
+
+    try:
+        async with transaction_lock(user_id):
+            # A repeated tap waits for the lock while the batch is written, so the session is checked under it.
+            current_state = await state.get_state()
+            data = await state.get_data()
+            entries = data.get("entries", [])
+            if current_state not in BatchExpenses.all_states_names:
+                await call_query.answer("Пакет уже сохранен.")
+                return
+            if not entries:
+                await call_query.answer("В пакете нет ни одной записи.")
+                return
+
+            # The session is closed before writing and restored if the batch is not saved.
+            await state.finish()
+            try:
+                settings = await get_settings(user_id)
+                position = settings["total_expenses"]
+                changes = await summary.plan_changes(
+                    user_id, settings, "expense", summary.get_amounts(entries, datetime.date.today())
+                )
+                deltas = await run_blocking(
+                    add_transactions,
+                    "expense",
+                    entries,
+                    gsheet_id=settings["gsheet_id"],
+                    sheet_ids=settings["sheet_ids"],
+                    account_names=settings["account_names"],
+                    accounts=settings["accounts"],
+                    summary=changes,
+                )
+            except Exception:
+                await state.set_state(current_state)
+                await state.set_data(data)
+                raise
+
+            apply_transactions(user_id, "expense", len(entries), deltas)
+            await journal.record(user_id, "expense", position, entries, deltas)
+            await summary.save_changes(user_id, changes)
+
+    except Exception as exc:
+        logging.error("Exception during add_transactions executing!", exc_info=exc)
+        bot.enqueue(
+            user_id,
+            "*Ошибка!*\n\nНа моей стороне произошла ошибка, пакет не сохранен. Попробуй сохранить его еще раз, "
+            f"а если не получится, напиши моему создателю: {CREATOR}.",
+            parse_mode="Markdown",
+        )
+        return
+
+    await update_message(call_query, f"Пакет сохранен ✅\n\n{format_entries(entries)}")
+    bot.enqueue(user_id, "Теперь ты можешь продолжать вести учет расходов! 💵", reply_markup=main_keyboard())
+
+
+@rate_limit("cached")
+async def cancel_callback(call_query: types.CallbackQuery, state: FSMContext):
+    """Drops the session."""
+    await state.finish()
+    await update_message(call_query, "*Отмена*\n\nПакет расходов не сохранен.", parse_mode="Markdown")
+    bot.enqueue(
+        call_query.from_user.id,
+        "Теперь ты можешь продолжать вести учет расходов! 💵",
+        reply_markup=main_keyboard(),
+    )
+
+
+def register_batch_handlers(dp: Dispatcher):
+    """Registers handlers of batch session."""
+    dp.register_message_handler(batch_cmd, commands=["batch"], state="*")
+    dp.register_message_handler(get_amount_handler, state=BatchExpenses.amount)
+    dp.register_message_handler(get_category_handler, state=BatchExpenses.category)
+    dp.register_message_handler(get_account_handler, state=BatchExpenses.account)
+    dp.register_callback_query_handler(commit_callback, text="batch_commit", state=BatchExpenses)
+    dp.register_callback_query_handler(cancel_callback, text="batch_cancel", state=BatchExpenses)
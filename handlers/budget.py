@@ -0,0 +1,126 @@
+"""
+Monthly budgets of expense categories (/budget).
+"""
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+import budgets
+from keyboards import main_keyboard, settings_keyboard
+from settings_cache import prefetch_settings, get_settings
+from throttling import rate_limit
+from utils import auth, answer_keyboard_page, reply
+
+
+class SetBudget(StatesGroup):
+    category = State()
+    amount = State()
+
+
+async def format_budgets(user_id: int, settings: dict) -> str:
+    """Returns budgets of the user with expenses of the current month."""
+    limits = await budgets.get_budgets(user_id)
+    if not limits:
+        return "У тебя пока нет ни одного бюджета."
+
+    names = {category.lower(): category for category in settings["categories"]["expense"]}
+    spent = await budgets.get_spent(user_id)
+    if spent is None:
+        return "\n".join(
+            f"«{names.get(category, category)}»: {budgets.format_amount(limit)}"
+            for category, limit in sorted(limits.items())
+        ) + "\n\nПотраченные суммы появятся, когда я подсчитаю расходы в таблице."
+
+    return "\n".join(
+        budgets.describe_budget(names.get(category, category), limit, spent.get(category, 0))
+        for category, limit in sorted(limits.items())
+    )
+
+
+@rate_limit("cached")
+@auth
+async def budget_cmd(message: types.Message, state: FSMContext):
+    """Shows budgets and asks category whose budget must be set."""
+    await state.finish()
+
+    settings = await get_settings(message.from_user.id)
+    if len(settings["categories"]["expense"]) == 0:
+        reply(
+            message,
+            "Похоже, что ты еще не добавил ни одной категории расходов.\n"
+            "Чтобы ее добавить, введи команду /add_category"
+        )
+        return
+
+    reply(
+        message,
+        f"Бюджеты на месяц\n\n{await format_budgets(message.from_user.id, settings)}\n\n"
+        "Выбери категорию, чтобы задать ее бюджет, или напиши «отмена».",
+        reply_markup=settings_keyboard(settings, "expense"),
+    )
+    await SetBudget.category.set()
+
+    await prefetch_settings(message.from_user.id)
+
+
+@rate_limit("cached")
+async def get_category_handler(message: types.Message, state: FSMContext):
+    """Gets category of the budget."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "expense"):
+        return
+
+    categories = {category.lower(): category for category in settings["categories"]["expense"]}
+    if message.text.lower() not in categories:
+        reply(
+            message,
+            "Я не знаю такой категории, попробуй ввести ее еще раз!",
+            reply_markup=settings_keyboard(settings, "expense"),
+        )
+        return
+
+    await state.update_data(category=categories[message.text.lower()])
+    reply(
+        message,
+        "Напиши, сколько ты готов тратить на эту категорию в месяц. Чтобы убрать бюджет, напиши 0.",
+        reply_markup=types.ReplyKeyboardRemove(),
+    )
+    await SetBudget.amount.set()
+
+
+@rate_limit("cached")
+async def get_amount_handler(message: types.Message, state: FSMContext):
+    """Gets limit of the category and saves the budget."""
+    try:
+        amount = float(message.text)
+    except ValueError:
+        reply(message, "Введи числовое значение!")
+        return
+
+    if amount < 0:
+        reply(message, "Бюджет не может быть отрицательным!")
+        return
+
+    user_id = message.from_user.id
+    category = (await state.get_data())["category"]
+    await state.finish()
+
+    if amount == 0:
+        await budgets.delete_budget(user_id, category)
+        reply(message, f"Бюджет категории «{category}» убран.", reply_markup=main_keyboard())
+        return
+
+    await budgets.set_budget(user_id, category, amount)
+    status = await budgets.get_budget_status(user_id, category)
+    if status is None:
+        # Spent amount is unknown until the summary is built.
+        status = f"«{category}»: {budgets.format_amount(amount)} в месяц"
+
+    reply(message, f"Бюджет сохранен ✅\n\n{status}", reply_markup=main_keyboard())
+
+
+def register_budget_handlers(dp: Dispatcher):
+    """Registers handlers of budgets."""
+    dp.register_message_handler(budget_cmd, commands=["budget"], state="*")
+    dp.register_message_handler(get_category_handler, state=SetBudget.category)
+    dp.register_message_handler(get_amount_handler, state=SetBudget.amount)
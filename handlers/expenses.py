@@ -1,6 +1,7 @@
 """
 File with expence control handlers.
 """
+import datetime
 from typing import Union
 
 from aiogram import Dispatcher, types
@@ -8,14 +9,17 @@ from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
 
+import budgets
+import journal
+import summary
+from background import run_blocking
 from server import bot
-from database import get_gsheet_id
-from keyboards import list_items_keyboard, main_keyboard
-from utils import auth
+from keyboards import main_keyboard, settings_keyboard
+from settings_cache import prefetch_settings, get_settings, apply_transactions, transaction_lock
+from utils import auth, answer_keyboard_page, reply
+from throttling import rate_limit
 
-from google_sheet.categories import get_categories, service_account
-from google_sheet.accounts import get_accounts
-from google_sheet.expenses import add_expense, get_total_expenses
+from google_sheet.transactions import add_transactions
 
 
 class AddsExpense(StatesGroup):
@@ -31,7 +35,7 @@ async def add_expense_handler_callback(message_or_call_query: Union[types.Messag
     """Launches adding expense."""
     user_id = message_or_call_query.from_user.id
 
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Добавление расхода*\n\nНапиши и отправь мне сумму, которую ты потратил\n\n"
         "Чтобы прервать добавление расходов напиши *отмена*.",
@@ -39,91 +43,98 @@ async def add_expense_handler_callback(message_or_call_query: Union[types.Messag
     )
     await AddsExpense.amount.set()
 
-    async with state.proxy() as data:
-        if data.get("gsheet_id") is None:
-            gsheet_id = get_gsheet_id(user_id)
-            sheet = service_account.open_by_key(gsheet_id)
-
-            settings_worksheet = sheet.worksheet("Настройки")
-            transactions_worksheet = sheet.worksheet("Транзакции")
-
-            data["gsheet_id"] = gsheet_id
-            data["categories"] = get_categories(settings_worksheet)["expense"]
-            data["account_names"], data["accounts"] = get_accounts(settings_worksheet)
-            data["total_expenses"] = get_total_expenses(transactions_worksheet)
+    # Settings are read from the sheet while user is typing the amount.
+    await prefetch_settings(user_id)
 
 
+@rate_limit("cached")
 async def get_amount_handler(message: types.Message, state: FSMContext):
     """Gets amount from user."""
     amount = message.text
     try:
         amount = float(amount)
     except ValueError:
-        await message.answer("Введи числовое значение!")
+        reply(message, "Введи числовое значение!")
     else:
         async with state.proxy() as data:
             data["amount"] = amount
-            categories = data["categories"]
+
+        settings = await get_settings(message.from_user.id)
+        categories = settings["categories"]["expense"]
 
         if len(categories) == 0:
-            await message.answer(
+            reply(
+                message,
                 "Похоже, что ты еще не добавил ни одной категории расходов.\n"
                 "Чтобы ее добавить, введи команду /add_category"
             )
             await state.finish()
 
         else:
-            await message.answer(
+            reply(
+                message,
                 "Теперь выбери категорию расходов из списка под твоей клавиатурой.\n\n",
-                reply_markup=list_items_keyboard(sorted(categories)),
+                reply_markup=settings_keyboard(settings, "expense"),
             )
             await AddsExpense.category.set()
 
 
+@rate_limit("cached")
 async def get_category_handler(message: types.Message, state: FSMContext):
     """Gets category type from user."""
     category = message.text
 
-    async with state.proxy() as data:
-        categories = data["categories"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "expense"):
+        return
+
+    categories = settings["categories"]["expense"]
 
     if category.lower() not in map(lambda word: word.lower(), categories):
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такой категории, попробуй ввести ее еще раз!",
-            reply_markup=list_items_keyboard(sorted(categories)),
+            reply_markup=settings_keyboard(settings, "expense"),
         )
 
     else:
         async with state.proxy() as data:
             data["category"] = category
-            account_names = data["account_names"]
+        account_names = settings["account_names"]
 
         if len(account_names) == 0:
-            await message.answer(
+            reply(
+                message,
                 "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account",
                 reply_markup=main_keyboard(),
             )
             await state.finish()
 
         else:
-            await message.answer(
+            reply(
+                message,
                 "Выбери из списка под клавиатурой счет, с которого была совершена покупка.",
-                reply_markup=list_items_keyboard(sorted(account_names))
+                reply_markup=settings_keyboard(settings, "accounts")
             )
             await AddsExpense.account.set()
 
 
+@rate_limit("cached")
 async def get_account_handler(message: types.Message, state: FSMContext):
     """Gets user's account name."""
     account = message.text
 
-    async with state.proxy() as data:
-        account_names = data["account_names"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    account_names = settings["account_names"]
 
     if account.lower() not in map(lambda word: word.lower(), account_names):
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такого счета, попробуй ввести его еще раз!",
-            reply_markup=list_items_keyboard(account_names)
+            reply_markup=settings_keyboard(settings, "accounts")
         )
 
     else:
@@ -135,7 +146,8 @@ async def get_account_handler(message: types.Message, state: FSMContext):
         markup = InlineKeyboardMarkup()
         markup.row(InlineKeyboardButton("Пропустить", callback_data="finish_expense"))
 
-        await message.answer(
+        reply(
+            message,
             "Ок! Также ты можешь добавить описание к своей покупке."
             "Для этого напиши его в поле ввода и отправь его мне. Если ты "
             "не хочешь его добавлять, то нажми на кнопку *Пропустить*.",
@@ -153,31 +165,52 @@ async def save_expense_to_sheet(user_id: int, state: FSMContext, comment: str =
     :param comment: Description to expense.
     """
     async with state.proxy() as data:
-        add_expense(
-            data["amount"],
-            data["category"],
-            data["account"],
-            comment,
-            total_expenses=data["total_expenses"],
-            gsheet_id=data["gsheet_id"],
+        amount = data["amount"]
+        category = data["category"]
+        account = data["account"]
+
+    entry = {"amount": amount, "category": category, "account": account, "comment": comment}
+
+    async with transaction_lock(user_id):
+        settings = await get_settings(user_id)
+        position = settings["total_expenses"]
+        changes = await summary.plan_changes(
+            user_id, settings, "expense", summary.get_amounts([entry], datetime.date.today())
+        )
+        deltas = await run_blocking(
+            add_transactions,
+            "expense",
+            [entry],
+            gsheet_id=settings["gsheet_id"],
+            sheet_ids=settings["sheet_ids"],
+            account_names=settings["account_names"],
+            accounts=settings["accounts"],
+            summary=changes,
         )
+        apply_transactions(user_id, "expense", 1, deltas)
+        await journal.record(user_id, "expense", position, [entry], deltas)
+        await summary.save_changes(user_id, changes)
 
     markup = InlineKeyboardMarkup()
     markup.add(InlineKeyboardButton("Прожолжить добавление 💸", callback_data="continue_expense"))
     markup.add(InlineKeyboardButton("Отмена ❌", callback_data="cancel_expense"))
 
-    await bot.send_message(
-        user_id,
-        "Запись успешно добавлена в Goolge таблицу!\nТакже ты можешь продолжить добавлять расходы.",
-        reply_markup=markup,
-    )
+    text = "Запись успешно добавлена в Goolge таблицу!\nТакже ты можешь продолжить добавлять расходы."
+    # Spent amount is known only from the summary updated by the write.
+    budget_status = await budgets.get_budget_status(user_id, category) if changes is not None else None
+    if budget_status is not None:
+        text += f"\n\n{budget_status}"
+
+    bot.enqueue(user_id, text, reply_markup=markup)
 
 
+@rate_limit("sheets_write")
 async def cancel_comment_callback(call_query: types.CallbackQuery, state: FSMContext):
     """Saves expense data to Google sheet."""
     await save_expense_to_sheet(call_query.from_user.id, state)
 
 
+@rate_limit("sheets_write")
 async def get_comment_handler(message: types.Message, state: FSMContext):
     """Gets user's comment and saves expense data to Google sheet."""
     await save_expense_to_sheet(message.from_user.id, state, message.text)
@@ -191,7 +224,7 @@ async def cancel_adding_expense(user_id: int, state: FSMContext):
     :param state: FSMContext object.
     """
     await state.finish()
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Отмена*\n\nТеперь ты можешь продолжать вести учет расходов! 💵",
         parse_mode="Markdown",
@@ -199,11 +232,13 @@ async def cancel_adding_expense(user_id: int, state: FSMContext):
     )
 
 
+@rate_limit("cached")
 async def cancel_adding_expense_handler(message: types.Message, state: FSMContext):
     """Breaks the adding expense process."""
     await cancel_adding_expense(message.from_user.id, state)
 
 
+@rate_limit("cached")
 async def cancel_adding_expense_callback(call_query: types.CallbackQuery, state: FSMContext):
     """Breaks the adding expense process."""
     await cancel_adding_expense(call_query.from_user.id, state)
@@ -245,16 +280,16 @@ def register_expences_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         cancel_comment_callback,
-        lambda cb: cb.data and cb.data == "finish_expense",
+        text="finish_expense",
         state=AddsExpense.comment,
     )
     dp.register_callback_query_handler(
         add_expense_handler_callback,
-        lambda cb: cb.data and cb.data == "continue_expense",
+        text="continue_expense",
         state="*",
     )
     dp.register_callback_query_handler(
         cancel_adding_expense_handler,
-        lambda cb: cb.data == "cancel_expense",
+        text="cancel_expense",
         state="*",
     )
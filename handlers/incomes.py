@@ -1,19 +1,23 @@
 """
 File with income control handlers.
 """
+import datetime
+
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
 
+import journal
+import summary
+from background import run_blocking
 from server import bot
-from database import get_gsheet_id
-from keyboards import list_items_keyboard, main_keyboard
-from utils import auth
+from keyboards import main_keyboard, settings_keyboard
+from settings_cache import prefetch_settings, get_settings, apply_transactions, transaction_lock
+from utils import auth, answer_keyboard_page, reply
+from throttling import rate_limit
 
-from google_sheet.categories import get_categories, service_account
-from google_sheet.accounts import get_accounts
-from google_sheet.incomes import get_total_incomes, add_income
+from google_sheet.transactions import add_transactions
 
 
 class AddsIncome(StatesGroup):
@@ -26,94 +30,102 @@ class AddsIncome(StatesGroup):
 @auth
 async def add_income_handler(message: types.Message, state: FSMContext):
     """Adds income to user's Google sheet."""
-    await message.answer(
+    reply(
+        message,
         "*Добавление дохода*\n\nНапиши и отправь мне сумму, которую ты получил\n\n"
         "Чтобы прервать добавление доходов напиши *отмена*.",
         parse_mode="Markdown",
     )
     await AddsIncome.amount.set()
 
-    gsheet_id = get_gsheet_id(message.from_user.id)
-    sheet = service_account.open_by_key(gsheet_id)
-
-    settings_worksheet = sheet.worksheet("Настройки")
-    transactions_worksheet = sheet.worksheet("Транзакции")
-
-    async with state.proxy() as data:
-        data["gsheet_id"] = gsheet_id
-        data["categories"] = get_categories(worksheet=settings_worksheet)["income"]
-        data["account_names"], data["accounts"] = get_accounts(worksheet=settings_worksheet)
-        data["total_incomes"] = get_total_incomes(transactions_worksheet)
+    # Settings are read from the sheet while user is typing the amount.
+    await prefetch_settings(message.from_user.id)
 
 
+@rate_limit("cached")
 async def get_amount_handler(message: types.Message, state: FSMContext):
     """Gets amount from user."""
     amount = message.text
     try:
         amount = float(amount)
     except ValueError:
-        await message.answer("Введи числовое значение!")
+        reply(message, "Введи числовое значение!")
     else:
         async with state.proxy() as data:
             data["amount"] = amount
-            categories = data["categories"]
+
+        settings = await get_settings(message.from_user.id)
+        categories = settings["categories"]["income"]
 
         if len(categories) == 0:
-            await message.answer(
+            reply(
+                message,
                 "Похоже, что ты еще не добавил ни одной категории доходов.\n"
                 "Чтобы ее добавить, введи команду /add_category"
             )
             await state.finish()
 
         else:
-            await message.answer(
+            reply(
+                message,
                 "Теперь выбери категорию доходов из списка под твоей клавиатурой.\n\n",
-                reply_markup=list_items_keyboard(sorted(categories)),
+                reply_markup=settings_keyboard(settings, "income"),
             )
             await AddsIncome.category.set()
 
 
+@rate_limit("cached")
 async def get_category_handler(message: types.Message, state: FSMContext):
     """Gets category type from user."""
     category = message.text
 
-    async with state.proxy() as data:
-        categories = data["categories"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "income"):
+        return
+
+    categories = settings["categories"]["income"]
 
     if category.lower() not in map(lambda word: word.lower(), categories):
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такой категории, попробуй ввести ее еще раз!",
-            reply_markup=list_items_keyboard(sorted(categories)),
+            reply_markup=settings_keyboard(settings, "income"),
         )
 
     else:
         async with state.proxy() as data:
             data["category"] = category
-            account_names = data["account_names"]
+        account_names = settings["account_names"]
 
         if len(account_names) == 0:
-            await message.answer("Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account")
+            reply(message, "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account")
             await state.finish()
 
         else:
-            await message.answer(
+            reply(
+                message,
                 "Выбери из списка под клавиатурой счет, на который пришли деньги.",
-                reply_markup=list_items_keyboard(sorted(account_names))
+                reply_markup=settings_keyboard(settings, "accounts")
             )
             await AddsIncome.account.set()
 
 
+@rate_limit("cached")
 async def get_account_handler(message: types.Message, state: FSMContext):
     """Gets user's account name."""
     account = message.text
 
-    async with state.proxy() as data:
-        account_names = data["account_names"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    account_names = settings["account_names"]
 
     if account.lower() not in map(lambda word: word.lower(), account_names):
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такого счета, попробуй ввести его еще раз!",
-            reply_markup=list_items_keyboard(account_names)
+            reply_markup=settings_keyboard(settings, "accounts")
         )
 
     else:
@@ -125,7 +137,8 @@ async def get_account_handler(message: types.Message, state: FSMContext):
         markup = InlineKeyboardMarkup()
         markup.row(InlineKeyboardButton("Пропустить", callback_data="finish_income"))
 
-        await message.answer(
+        reply(
+            message,
             "Ок! Также ты можешь добавить описание доходу."
             "Для этого напиши его в поле ввода и отправь его мне. Если ты "
             "не хочешь его добавлять, то нажми на кнопку *Пропустить*.",
@@ -143,37 +156,58 @@ async def save_income_to_sheet(user_id: int, state: FSMContext, comment: str = "
     :param comment: Description to income.
     """
     async with state.proxy() as data:
-        add_income(
-            data["amount"],
-            data["category"],
-            data["account"],
-            comment,
-            total_incomes=data["total_incomes"],
-            gsheet_id=data["gsheet_id"],
+        amount = data["amount"]
+        category = data["category"]
+        account = data["account"]
+
+    entry = {"amount": amount, "category": category, "account": account, "comment": comment}
+
+    async with transaction_lock(user_id):
+        settings = await get_settings(user_id)
+        position = settings["total_incomes"]
+        changes = await summary.plan_changes(
+            user_id, settings, "income", summary.get_amounts([entry], datetime.date.today())
+        )
+        deltas = await run_blocking(
+            add_transactions,
+            "income",
+            [entry],
+            gsheet_id=settings["gsheet_id"],
+            sheet_ids=settings["sheet_ids"],
+            account_names=settings["account_names"],
+            accounts=settings["accounts"],
+            summary=changes,
         )
+        apply_transactions(user_id, "income", 1, deltas)
+        await journal.record(user_id, "income", position, [entry], deltas)
+        await summary.save_changes(user_id, changes)
 
     await state.finish()
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "Запись успешно добавлена в вашу Goolge таблицу!",
         reply_markup=main_keyboard(),
     )
 
 
+@rate_limit("sheets_write")
 async def cancel_comment_callback(call_query: types.CallbackQuery, state: FSMContext):
     """Saves income data to Google sheet."""
     await save_income_to_sheet(call_query.from_user.id, state)
 
 
+@rate_limit("sheets_write")
 async def get_comment_handler(message: types.Message, state: FSMContext):
     """Gets user's comment and saves income data to Google sheet."""
     await save_income_to_sheet(message.from_user.id, state, message.text)
 
 
+@rate_limit("cached")
 async def cancel_adding_income_handler(message: types.Message, state: FSMContext):
     """Breaks the adding income process."""
     await state.finish()
-    await message.answer(
+    reply(
+        message,
         "*Отмена*\n\nТеперь ты можешь продолжать вести учет расходов! 💵",
         parse_mode="Markdown",
         reply_markup=main_keyboard(),
@@ -216,6 +250,6 @@ def register_incomes_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         cancel_comment_callback,
-        lambda cb: cb.data and cb.data == "finish_income",
+        text="finish_income",
         state=AddsIncome.comment,
     )
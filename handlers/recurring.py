@@ -0,0 +1,230 @@
+"""
+Recurring transactions (/recurring): rent, subscriptions and salary posted by the bot every month.
+"""
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.callback_data import CallbackData
+
+import recurring
+from config import RECURRING_MAX_ITEMS
+from keyboards import main_keyboard, settings_keyboard
+from settings_cache import prefetch_settings, get_settings
+from throttling import rate_limit
+from utils import auth, answer_keyboard_page, reply, update_message
+
+
+delete_callback_data = CallbackData("recurring_delete", "item_id")
+kind_callback_data = CallbackData("recurring_kind", "kind")
+
+
+class AddRecurring(StatesGroup):
+    name = State()
+    kind = State()
+    amount = State()
+    category = State()
+    account = State()
+    day = State()
+
+
+def recurring_keyboard(items: list) -> InlineKeyboardMarkup:
+    """Keyboard with deleting of each recurring transaction and adding a new one."""
+    markup = InlineKeyboardMarkup()
+    for item in items:
+        markup.row(
+            InlineKeyboardButton(f"Удалить «{item.name}» ❌", callback_data=delete_callback_data.new(item.item_id))
+        )
+    if len(items) < RECURRING_MAX_ITEMS:
+        markup.row(InlineKeyboardButton("Добавить 🔁", callback_data="recurring_add"))
+
+    return markup
+
+
+def format_items(items: list) -> str:
+    """Returns list of recurring transactions of the user."""
+    if not items:
+        return "У тебя пока нет регулярных записей."
+
+    return "\n".join(
+        f"{item.day} числа: {'+' if item.kind == 'income' else '-'}{item.amount:g} — {item.name} "
+        f"({item.category}, {item.account}), следующая {item.next_run:%d.%m.%Y}"
+        for item in items
+    )
+
+
+@rate_limit("cached")
+@auth
+async def recurring_cmd(message: types.Message, state: FSMContext):
+    """Shows recurring transactions of the user."""
+    await state.finish()
+
+    items = await recurring.get_user_items(message.from_user.id)
+    reply(
+        message,
+        f"Регулярные записи\n\n{format_items(items)}\n\n"
+        "Я добавляю их в таблицу сам в указанный день каждого месяца.",
+        reply_markup=recurring_keyboard(items),
+    )
+
+
+@rate_limit("cached")
+async def delete_callback(call_query: types.CallbackQuery, callback_data: dict):
+    """Deletes recurring transaction."""
+    await recurring.delete(call_query.from_user.id, int(callback_data["item_id"]))
+
+    items = await recurring.get_user_items(call_query.from_user.id)
+    await update_message(
+        call_query,
+        f"Регулярная запись удалена ✅\n\n{format_items(items)}",
+        reply_markup=recurring_keyboard(items),
+    )
+
+
+@rate_limit("cached")
+async def add_callback(call_query: types.CallbackQuery):
+    """Starts adding recurring transaction."""
+    await AddRecurring.name.set()
+    await update_message(call_query, "Напиши название регулярной записи (например, Аренда или Зарплата).")
+
+    await prefetch_settings(call_query.from_user.id)
+
+
+@rate_limit("cached")
+async def get_name_handler(message: types.Message, state: FSMContext):
+    """Gets name of the recurring transaction."""
+    await state.update_data(name=message.text)
+
+    markup = InlineKeyboardMarkup()
+    markup.row(
+        InlineKeyboardButton("Расход 💸", callback_data=kind_callback_data.new("expense")),
+        InlineKeyboardButton("Доход 💰", callback_data=kind_callback_data.new("income")),
+    )
+    reply(message, "Это расход или доход?", reply_markup=markup)
+    await AddRecurring.kind.set()
+
+
+@rate_limit("cached")
+async def get_kind_callback(call_query: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    """Gets type of the recurring transaction."""
+    await state.update_data(kind=callback_data["kind"])
+    await update_message(call_query, "Напиши сумму.")
+    await AddRecurring.amount.set()
+
+
+@rate_limit("cached")
+async def get_amount_handler(message: types.Message, state: FSMContext):
+    """Gets amount of the recurring transaction."""
+    try:
+        amount = float(message.text)
+    except ValueError:
+        reply(message, "Введи числовое значение!")
+        return
+
+    if amount < 0:
+        reply(message, "Сумма не может быть отрицательной!")
+        return
+
+    await state.update_data(amount=amount)
+    kind = (await state.get_data())["kind"]
+
+    settings = await get_settings(message.from_user.id)
+    if len(settings["categories"][kind]) == 0:
+        reply(message, "Похоже, что у тебя нет подходящих категорий. Чтобы ее добавить, введи /add_category")
+        await state.finish()
+        return
+
+    reply(message, "Выбери категорию.", reply_markup=settings_keyboard(settings, kind))
+    await AddRecurring.category.set()
+
+
+@rate_limit("cached")
+async def get_category_handler(message: types.Message, state: FSMContext):
+    """Gets category of the recurring transaction."""
+    kind = (await state.get_data())["kind"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, kind):
+        return
+
+    categories = {category.lower(): category for category in settings["categories"][kind]}
+    if message.text.lower() not in categories:
+        reply(
+            message,
+            "Я не знаю такой категории, попробуй ввести ее еще раз!",
+            reply_markup=settings_keyboard(settings, kind),
+        )
+        return
+
+    await state.update_data(category=categories[message.text.lower()])
+
+    if len(settings["account_names"]) == 0:
+        reply(message, "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account")
+        await state.finish()
+        return
+
+    reply(message, "Выбери счет.", reply_markup=settings_keyboard(settings, "accounts"))
+    await AddRecurring.account.set()
+
+
+@rate_limit("cached")
+async def get_account_handler(message: types.Message, state: FSMContext):
+    """Gets account of the recurring transaction."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    account = settings["accounts"].get(message.text.lower())
+    if account is None:
+        reply(
+            message,
+            "Я не знаю такого счета, попробуй ввести его еще раз!",
+            reply_markup=settings_keyboard(settings, "accounts"),
+        )
+        return
+
+    await state.update_data(account=account["name"])
+    reply(
+        message,
+        "Напиши день месяца (от 1 до 31), в который нужно добавлять запись. "
+        "В коротких месяцах я добавлю ее в последний день.",
+        reply_markup=types.ReplyKeyboardRemove(),
+    )
+    await AddRecurring.day.set()
+
+
+@rate_limit("cached")
+async def get_day_handler(message: types.Message, state: FSMContext):
+    """Gets day of month and saves the recurring transaction."""
+    if not message.text.isdigit() or not 1 <= int(message.text) <= 31:
+        reply(message, "Введи число от 1 до 31!")
+        return
+
+    user_id = message.from_user.id
+    data = await state.get_data()
+    await state.finish()
+
+    await recurring.add(
+        user_id,
+        data["kind"],
+        data["name"],
+        data["amount"],
+        data["category"],
+        data["account"],
+        int(message.text),
+    )
+
+    items = await recurring.get_user_items(user_id)
+    reply(message, f"Регулярная запись сохранена ✅\n\n{format_items(items)}", reply_markup=main_keyboard())
+
+
+def register_recurring_handlers(dp: Dispatcher):
+    """Registers handlers of recurring transactions."""
+    dp.register_message_handler(recurring_cmd, commands=["recurring"], state="*")
+    dp.register_callback_query_handler(delete_callback, delete_callback_data.filter())
+    dp.register_callback_query_handler(add_callback, text="recurring_add")
+    dp.register_message_handler(get_name_handler, state=AddRecurring.name)
+    dp.register_callback_query_handler(get_kind_callback, kind_callback_data.filter(), state=AddRecurring.kind)
+    dp.register_message_handler(get_amount_handler, state=AddRecurring.amount)
+    dp.register_message_handler(get_category_handler, state=AddRecurring.category)
+    dp.register_message_handler(get_account_handler, state=AddRecurring.account)
+    dp.register_message_handler(get_day_handler, state=AddRecurring.day)
@@ -1,3 +1,5 @@
+from typing import Union
+
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
@@ -11,35 +13,39 @@ import gspread
 from gspread.utils import extract_id_from_url
 
 import database as db
+import journal
+import summary
 
-from server import bot
-from utils import delete_previous_message, is_gsheet_id_correct
+from background import run_blocking
+from settings_cache import invalidate_settings
+from utils import is_gsheet_id_correct, reply, update_message
 from keyboards import main_keyboard
 from config import LINK_TO_GOOGLE_SHEET, BOT_EMAIL
+from throttling import rate_limit
 
 
 class GetLinkToGoogleSheet(StatesGroup):
     waiting_for_gsheet_id = State()
 
 
-async def register(user_id: int):
+async def register(message_or_call_query: Union[types.Message, types.CallbackQuery]):
     """
     Registers new user or change old's user gsheet_id
     Helps new user to create Google account
 
-    :param user_id: telegram user ID
+    :param message_or_call_query: /register command or "Назад" button of the next step
     """
     ReplyKeyboardRemove()
 
-    user = db.get_or_add_user(user_id)
+    user = await db.get_or_add_user(message_or_call_query.from_user.id)
     if user.gsheet_id:
         markup = InlineKeyboardMarkup()
         markup.row(InlineKeyboardButton("Подключить к другой таблице 📃", callback_data="connect_to_other_table"))
         markup.row(InlineKeyboardButton("Удалить мои данные 🗑️", callback_data="delete_user_data"))
         markup.row(InlineKeyboardButton("Отмена ❌", callback_data="reg_cancel"))
 
-        await bot.send_message(
-            user_id,
+        await update_message(
+            message_or_call_query,
             "Я уже подключен к твоей Google таблице 🤔\n"
             "Может быть ты хочешь подключить меня к другой таблице "
             "или ты хочешь, чтобы я удалил данные о текущей (тогда "
@@ -52,8 +58,8 @@ async def register(user_id: int):
         markup.row(InlineKeyboardButton(">>> Готово! ✅", callback_data="google_drive_sign_in"))
         markup.row(InlineKeyboardButton("Отмена ❌", callback_data="reg_cancel"))
 
-        await bot.send_message(
-            user_id,
+        await update_message(
+            message_or_call_query,
             "*ШАГ 1*\n\n"
             "Для всей действий тебе понадобится "
             "Goolge аккаунт. Если у тебя его ещё нет, то, перейдя по "
@@ -69,19 +75,17 @@ async def register_cmd(message: types.Message):
     Registers new user or change old's user gsheet_id
     Helps new user to create Google account
     """
-    await register(message.from_user.id)
+    await register(message)
 
 
-@delete_previous_message
 async def register_callback(call_query: types.CallbackQuery):
     """
     Registers new user or change old's user gsheet_id
     Helps new user to create Google account
     """
-    await register(call_query.from_user.id)
+    await register(call_query)
 
 
-@delete_previous_message
 async def google_drive_sign_in_callback(call_query: types.CallbackQuery):
     """Helps new user to copy Goolge sheet to their own Google Drive"""
     markup = InlineKeyboardMarkup()
@@ -89,8 +93,8 @@ async def google_drive_sign_in_callback(call_query: types.CallbackQuery):
     markup.row(InlineKeyboardButton("<<< Назад ↩", callback_data="register"))
     markup.row(InlineKeyboardButton("Отмена ❌", callback_data="reg_cancel"))
 
-    await bot.send_message(
-        call_query.from_user.id,
+    await update_message(
+        call_query,
         "*ШАГ 2*\n\n"
         "Отлично!\nТеперь перейди по [уже другой ссылке]"
         f"({LINK_TO_GOOGLE_SHEET})"
@@ -103,7 +107,6 @@ async def google_drive_sign_in_callback(call_query: types.CallbackQuery):
     )
 
 
-@delete_previous_message
 async def share_google_sheet_to_bot_callback(call_query: types.CallbackQuery):
     """Asks the user to share their Google sheet with bot"""
     markup = InlineKeyboardMarkup()
@@ -111,8 +114,8 @@ async def share_google_sheet_to_bot_callback(call_query: types.CallbackQuery):
     markup.row(InlineKeyboardButton("<<< Назад ↩", callback_data="google_drive_sign_in"))
     markup.row(InlineKeyboardButton("Отмена ❌", callback_data="reg_cancel"))
 
-    await bot.send_message(
-        call_query.from_user.id,
+    await update_message(
+        call_query,
         "*ШАГ 3*\n\n"
         "Супер!\nТеперь нажми в правом верхнем углу на кнопку "
         "*\"Настройки доступа\"* и в поле ввода вставь мой email адрес: "
@@ -126,15 +129,14 @@ async def share_google_sheet_to_bot_callback(call_query: types.CallbackQuery):
     )
 
 
-@delete_previous_message
 async def get_user_google_sheet_id_callback(call_query: types.CallbackQuery):
     """Asks the user to send to bot their Google sheet url"""
     markup = InlineKeyboardMarkup()
     markup.row(InlineKeyboardButton("<<< Назад ↩", callback_data="share_google_sheet_to_bot"))
     markup.row(InlineKeyboardButton("Отмена ❌", callback_data="reg_cancel"))
 
-    await bot.send_message(
-        call_query.from_user.id,
+    await update_message(
+        call_query,
         "*ШАГ 4*\n\n"
         "Ок!\nТеперь в *Настройках доступа* нажми *Копировать ссылку*, "
         "она сохранится в буфер обмена.\n"
@@ -146,19 +148,21 @@ async def get_user_google_sheet_id_callback(call_query: types.CallbackQuery):
     await GetLinkToGoogleSheet.waiting_for_gsheet_id.set()
 
 
+@rate_limit("sheets_write")
 async def get_user_google_sheet_id(message: types.Message, state: FSMContext):
     """Gets user's Google sheet id and saves it to database"""
     try:
         gsheet_id = extract_id_from_url(message.text)
 
-        if not is_gsheet_id_correct(gsheet_id):
+        if not await run_blocking(is_gsheet_id_correct, gsheet_id):
             raise gspread.exceptions.NoValidUrlKeyFound
 
     except gspread.exceptions.NoValidUrlKeyFound:
         markup = InlineKeyboardMarkup()
         markup.row(InlineKeyboardButton("<<< Шаг 3", callback_data="share_google_sheet_to_bot"))
         markup.row(InlineKeyboardButton("<<< Шaг 4", callback_data="get_user_google_sheet_id"))
-        await message.answer(
+        reply(
+            message,
             "Упс! По этой ссылке я не могу подключиться к твоей "
             "Google таблице!\nПроверь, что ты правильно ее скопировал "
             " (шаг 4) и дал мне доступ к твоей Google таблице (шаг 3).\n"
@@ -169,8 +173,12 @@ async def get_user_google_sheet_id(message: types.Message, state: FSMContext):
 
     else:
         await state.update_data(google_sheet_id=gsheet_id)
-        db.update_gsheet_id(message.from_user.id, gsheet_id)
-        await message.answer(
+        await db.update_gsheet_id(message.from_user.id, gsheet_id)
+        invalidate_settings(message.from_user.id)
+        await journal.forget(message.from_user.id)
+        await summary.forget(message.from_user.id)
+        reply(
+            message,
             "Отлично! 🤩\n\n"
             "Теперь я подключен к твоей таблице и ты можешь "
             "начать вести учет своих финансов с помощью клавиатуры под "
@@ -182,16 +190,18 @@ async def get_user_google_sheet_id(message: types.Message, state: FSMContext):
         await state.finish()
 
 
-@delete_previous_message
 async def connect_to_other_table_callback(call_query: types.CallbackQuery):
     """Connects to the other Google table"""
-    user = db.update_gsheet_id(call_query.from_user.id, "")
+    user = await db.update_gsheet_id(call_query.from_user.id, "")
+    invalidate_settings(user.user_id)
+    await journal.forget(user.user_id)
+    await summary.forget(user.user_id)
 
     markup = InlineKeyboardMarkup()
     markup.row(InlineKeyboardButton("Пройти обучение 📚", callback_data="register"))
 
-    await bot.send_message(
-        user.user_id,
+    await update_message(
+        call_query,
         "*Данные успешно удалены*\n"
         "Отправь мне ссылку на новую Google таблицу, чтобы я мог к ней "
         "подключиться. Также, если ты забыл, где ее брать, ты можешь "
@@ -203,24 +213,26 @@ async def connect_to_other_table_callback(call_query: types.CallbackQuery):
     await GetLinkToGoogleSheet.waiting_for_gsheet_id.set()
 
 
-@delete_previous_message
 async def delete_user_data_callback(call_query: types.CallbackQuery):
     """Deletes user's data (gsheet_id) from database"""
-    user = db.update_gsheet_id(call_query.from_user.id, "")
-    await bot.send_message(
-        user.user_id,
+    user = await db.update_gsheet_id(call_query.from_user.id, "")
+    invalidate_settings(user.user_id)
+    await journal.forget(user.user_id)
+    await summary.forget(user.user_id)
+    await update_message(
+        call_query,
         "*Данные успешно удалены*\n\n"
         "Чтобы продолжить меня использовать, напиши /register",
         parse_mode="Markdown",
     )
 
 
-@delete_previous_message
+@rate_limit("cached")
 async def register_cancel_callback(call_query: types.CallbackQuery, state: FSMContext):
     """Returns to the standart usage mode (finance control)"""
     await state.finish()
-    await bot.send_message(
-        call_query.from_user.id,
+    await update_message(
+        call_query,
         "*Отмена*. Надеюсь, ты не на долго",
         parse_mode="Markdown",
         reply_markup=main_keyboard(),
@@ -232,23 +244,23 @@ def register_registration_handlers(dp: Dispatcher):
     dp.register_message_handler(register_cmd, commands=["register"])
     dp.register_callback_query_handler(
         register_callback,
-        lambda cb: cb.data and cb.data == "register",
+        text="register",
         state='*',
     )
 
     dp.register_callback_query_handler(
         google_drive_sign_in_callback,
-        lambda cb: cb.data and cb.data == "google_drive_sign_in",
+        text="google_drive_sign_in",
         state='*',
     )
     dp.register_callback_query_handler(
         share_google_sheet_to_bot_callback,
-        lambda cb: cb.data and cb.data == "share_google_sheet_to_bot",
+        text="share_google_sheet_to_bot",
         state='*',
     )
     dp.register_callback_query_handler(
         get_user_google_sheet_id_callback,
-        lambda cb: cb.data and cb.data == "get_user_google_sheet_id",
+        text="get_user_google_sheet_id",
         state='*',
     )
     dp.register_message_handler(
@@ -258,15 +270,15 @@ def register_registration_handlers(dp: Dispatcher):
 
     dp.register_callback_query_handler(
         connect_to_other_table_callback,
-        lambda cb: cb.data and cb.data == "connect_to_other_table",
+        text="connect_to_other_table",
     )
     dp.register_callback_query_handler(
         delete_user_data_callback,
-        lambda cb: cb.data and cb.data == "delete_user_data",
+        text="delete_user_data",
     )
 
     dp.register_callback_query_handler(
         register_cancel_callback,
-        lambda cb: cb.data and cb.data == "reg_cancel",
+        text="reg_cancel",
         state="*",
     )
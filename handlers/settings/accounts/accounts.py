@@ -6,11 +6,11 @@ from typing import Union
 from aiogram import Dispatcher, types
 from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
 
-from utils import delete_previous_message
-from server import bot
+from utils import update_message
+from throttling import rate_limit
 
 
-@delete_previous_message
+@rate_limit("cached")
 async def accounts_settings_handler_callback(message_or_call_query: Union[types.Message, types.CallbackQuery]):
     """Accounts settings."""
     markup = InlineKeyboardMarkup()
@@ -26,8 +26,8 @@ async def accounts_settings_handler_callback(message_or_call_query: Union[types.
         InlineKeyboardButton("Отмена", callback_data="settings_cancel")
     )
 
-    await bot.send_message(
-        message_or_call_query.from_user.id,
+    await update_message(
+        message_or_call_query,
         "*Настройки счетов*\n\nВыбери, что ты хочешь сделать, нажав на нужную кнопку под сообщением.",
         parse_mode="Markdown",
         reply_markup=markup,
@@ -43,7 +43,7 @@ def register_accounts_settings_handlers(dp: Dispatcher):
 
     dp.register_callback_query_handler(
         accounts_settings_handler_callback,
-        lambda cb: cb.data == "account_settings"
+        text="account_settings",
     )
 
     register_change_amount_handlers(dp)
@@ -9,11 +9,14 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-from database import get_gsheet_id
-from google_sheet.accounts import get_accounts, add_account
+from google_sheet.accounts import add_account
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from background import run_blocking
 from server import bot
 from keyboards import main_keyboard
 from config import CREATOR
+from throttling import rate_limit
+from utils import reply
 
 
 class AddingAccount(StatesGroup):
@@ -26,16 +29,8 @@ async def adding_account_callback_handler(message_or_callback: Union[types.Messa
                                           state: FSMContext):
     """Starts adding account process."""
     user_id = message_or_callback.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    account_names, accounts = get_accounts(gsheet_id=gsheet_id)
-
-    async with state.proxy() as data:
-        data["gsheet_id"] = gsheet_id
-        data["account_names"] = account_names
-        data["accounts"] = accounts
-
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Добавление счета*\n\nВведи название нового счета.",
         parse_mode="Markdown",
@@ -43,34 +38,38 @@ async def adding_account_callback_handler(message_or_callback: Union[types.Messa
     await AddingAccount.name.set()
 
 
+@rate_limit("cached")
 async def get_account_name_handler(message: types.Message, state: FSMContext):
     """Gets account name from user."""
     account_name = message.text
 
-    async with state.proxy() as data:
-        account_names = data["account_names"]
+    settings = await get_settings(message.from_user.id)
+    account_names = settings["account_names"]
 
     lowercase_account_names = list(map(lambda word: word.lower(), account_names))
     if account_name.lower() in lowercase_account_names:
-        await message.answer("Счет с таким названием уже существует! Придумай другое!")
+        reply(message, "Счет с таким названием уже существует! Придумай другое!")
     else:
         async with state.proxy() as data:
             data["account_name"] = account_name
 
-        await message.answer(
+        reply(
+            message,
             "*Добавление счета*\n\nВведи сумму, которая лежит на счету.",
             parse_mode="Markdown",
         )
         await AddingAccount.amount.set()
 
 
+@rate_limit("sheets_write")
 async def get_amount_handler(message: types.Message, state: FSMContext):
     """Gets amount from user."""
     amount = message.text.replace(",", ".")
 
     num_points = amount.count(".")
     if num_points > 1:
-        await message.answer(
+        reply(
+            message,
             f"Ты можешь использовать *максимум один* символ `.`, но не {num_points}!",
             parse_mode="Markdown",
         )
@@ -79,46 +78,50 @@ async def get_amount_handler(message: types.Message, state: FSMContext):
         try:
             amount = float(amount)
         except ValueError:
-            await message.answer("Введи, пожалуйста, *числовое* значение!", parse_mode="Markdown")
+            reply(message, "Введи, пожалуйста, *числовое* значение!", parse_mode="Markdown")
         else:
             async with state.proxy() as data:
                 account_name = data["account_name"]
-                accounts = data["accounts"]
-                account_names = data["account_names"]
-
-            try:
-                add_account(
-                    account_name,
-                    amount,
-                    accounts=accounts,
-                    account_names=account_names,
-                    gsheet_id=data["gsheet_id"],
-                )
-            except Exception as exc:
-                logging.error("Excpetion during add_account executing!", exc_info=exc)
-                await message.answer(
-                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                    f"напиши моему создателю: {CREATOR}. Он все починит)",
-                    parse_mode="Markdown",
-                    reply_markup=main_keyboard(),
-                )
-
-            else:
-                await message.answer(
-                    f"*Готово!*\n\nДобавлен новый аккаунт с именем: {account_name} "
-                    f"и балансом: {amount}.",
-                    parse_mode="Markdown",
-                    reply_markup=main_keyboard(),
-                )
-
-            await state.finish()
+
+            async with transaction_lock(message.from_user.id):
+                settings = await get_settings(message.from_user.id)
+                try:
+                    await run_blocking(
+                        add_account,
+                        account_name,
+                        amount,
+                        accounts=settings["accounts"],
+                        account_names=settings["account_names"],
+                        gsheet_id=settings["gsheet_id"],
+                    )
+                except Exception as exc:
+                    logging.error("Excpetion during add_account executing!", exc_info=exc)
+                    reply(
+                        message,
+                        "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                        f"напиши моему создателю: {CREATOR}. Он все починит)",
+                        parse_mode="Markdown",
+                        reply_markup=main_keyboard(),
+                    )
+
+                else:
+                    invalidate_settings(message.from_user.id)
+                    reply(
+                        message,
+                        f"*Готово!*\n\nДобавлен новый аккаунт с именем: {account_name} "
+                        f"и балансом: {amount}.",
+                        parse_mode="Markdown",
+                        reply_markup=main_keyboard(),
+                    )
+
+                await state.finish()
 
 
 def register_adding_account_handlers(dp: Dispatcher):
     """Register handlers for account adding."""
     dp.register_callback_query_handler(
         adding_account_callback_handler,
-        lambda cb: cb.data == "add_account",
+        text="add_account",
     )
     dp.register_message_handler(
         adding_account_callback_handler,
@@ -9,11 +9,14 @@ from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-from google_sheet.accounts import get_accounts, change_balance
-from database import get_gsheet_id
-from keyboards import list_items_keyboard, main_keyboard
+from google_sheet.accounts import change_balance
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from keyboards import main_keyboard, settings_keyboard
+from utils import answer_keyboard_page, reply
+from background import run_blocking
 from server import bot
 from config import CREATOR
+from throttling import rate_limit
 
 
 class ChangeAmount(StatesGroup):
@@ -26,39 +29,38 @@ async def change_amount_callback_handler(message_or_call_query: Union[types.Mess
                                          state: FSMContext):
     """Changes balance amount at account."""
     user_id = message_or_call_query.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    account_names, accounts = get_accounts(gsheet_id=gsheet_id)
+    settings = await get_settings(user_id)
+    account_names = settings["account_names"]
 
     if len(account_names) == 0:
-        await bot.send_message(
+        bot.enqueue(
             user_id,
             "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account",
             reply_markup=main_keyboard()
         )
 
     else:
-        async with state.proxy() as data:
-            data["gsheet_id"] = gsheet_id
-            data["account_names"] = account_names
-            data["accounts"] = accounts
-
-        await bot.send_message(
+        bot.enqueue(
             user_id,
             "*Изменение баланса*\n\nВыбери из списка ниже счет, баланс которого ты хочешь изменить.",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(sorted(account_names)),
+            reply_markup=settings_keyboard(settings, "accounts"),
         )
         await ChangeAmount.account_name.set()
 
 
+@rate_limit("cached")
 async def get_account_name_handler(message: types.Message, state: FSMContext):
     """Gets account name from user."""
     account_name = message.text.lower()
 
-    async with state.proxy() as data:
-        accounts = data["accounts"]
-        account_names = data["account_names"]
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    accounts = settings["accounts"]
+    account_names = settings["account_names"]
 
     lowercase_account_names = list(map(lambda word: word.lower(), account_names))
     if account_name in lowercase_account_names:
@@ -66,27 +68,31 @@ async def get_account_name_handler(message: types.Message, state: FSMContext):
             data["account_name"] = account_name
 
         current_amount = accounts[account_name]["amount"]
-        await message.answer(
+        reply(
+            message,
             f"*Изменение баланса*\n\nТекущая сумма на счету: {current_amount}\nВведи новую сумму.",
             parse_mode="Markdown",
         )
         await ChangeAmount.new_amount.set()
 
     else:
-        await message.answer(
+        reply(
+            message,
             "Упс!\nЯ такого счета не знаю! Похоже, что ты ошибся в названии. Попробуй еще раз!",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(sorted(account_names)),
+            reply_markup=settings_keyboard(settings, "accounts"),
         )
 
 
+@rate_limit("sheets_write")
 async def get_new_amount_handler(message: types.Message, state: FSMContext):
     """Gets new amount from user."""
     new_amount = message.text.replace(",", ".")
 
     num_points = new_amount.count(".")
     if num_points > 1:
-        await message.answer(
+        reply(
+            message,
             f"Ты можешь использовать *максимум один* символ `.`, но не {num_points}!",
             parse_mode="Markdown",
         )
@@ -94,46 +100,50 @@ async def get_new_amount_handler(message: types.Message, state: FSMContext):
         try:
             new_amount = float(new_amount)
         except ValueError:
-            await message.answer("Введи, пожалуйста, *числовое* значение!", parse_mode="Markdown")
+            reply(message, "Введи, пожалуйста, *числовое* значение!", parse_mode="Markdown")
         else:
             async with state.proxy() as data:
                 account_name = data["account_name"]
-                accounts = data["accounts"]
-                account_names = data["account_names"]
-
-            try:
-                change_balance(
-                    "set",
-                    account_name,
-                    new_amount,
-                    accounts=accounts,
-                    account_names=account_names,
-                    gsheet_id=data["gsheet_id"],
-                )
-            except Exception as exc:
-                logging.error("Excpetion during change_balance executing!", exc_info=exc)
-                await message.answer(
-                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                    f"напиши моему создателю: {CREATOR}. Он все починит)",
-                    parse_mode="Markdown",
-                    reply_markup=main_keyboard(),
-                )
-
-            else:
-                await message.answer(
-                    "*Готово!*\n\nБаланс счета успешно изменен!",
-                    parse_mode="Markdown",
-                    reply_markup=main_keyboard(),
-                )
-
-            await state.finish()
+
+            async with transaction_lock(message.from_user.id):
+                settings = await get_settings(message.from_user.id)
+                try:
+                    await run_blocking(
+                        change_balance,
+                        "set",
+                        account_name,
+                        new_amount,
+                        accounts=settings["accounts"],
+                        account_names=settings["account_names"],
+                        gsheet_id=settings["gsheet_id"],
+                    )
+                except Exception as exc:
+                    logging.error("Excpetion during change_balance executing!", exc_info=exc)
+                    reply(
+                        message,
+                        "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                        f"напиши моему создателю: {CREATOR}. Он все починит)",
+                        parse_mode="Markdown",
+                        reply_markup=main_keyboard(),
+                    )
+
+                else:
+                    invalidate_settings(message.from_user.id)
+                    reply(
+                        message,
+                        "*Готово!*\n\nБаланс счета успешно изменен!",
+                        parse_mode="Markdown",
+                        reply_markup=main_keyboard(),
+                    )
+
+                await state.finish()
 
 
 def register_change_amount_handlers(dp: Dispatcher):
     """Registers changing balance handlers."""
     dp.register_callback_query_handler(
         change_amount_callback_handler,
-        lambda cb: cb.data == "change_amount",
+        text="change_amount",
     )
     dp.register_message_handler(
         change_amount_callback_handler,
@@ -9,10 +9,13 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
+from background import run_blocking
 from server import bot
-from database import get_gsheet_id
-from google_sheet.accounts import get_accounts, delete_account
-from keyboards import main_keyboard, list_items_keyboard
+from throttling import rate_limit
+from google_sheet.accounts import delete_account
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from keyboards import main_keyboard, settings_keyboard
+from utils import answer_keyboard_page, reply
 from config import CREATOR
 
 
@@ -24,12 +27,12 @@ async def delete_account_callback_handler(message_or_call_query: Union[types.Mes
                                           state: FSMContext):
     """Starts deleting account process."""
     user_id = message_or_call_query.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    account_names, accounts = get_accounts(gsheet_id=gsheet_id)
+    settings = await get_settings(user_id)
+    account_names = settings["account_names"]
 
     if len(account_names) == 0:
-        await bot.send_message(
+        bot.enqueue(
             user_id,
             "*Удалять нечего!* Ты не создал еще ни одного счета! "
             "Чтобы его создать, введи /add_account",
@@ -37,53 +40,58 @@ async def delete_account_callback_handler(message_or_call_query: Union[types.Mes
         )
 
     else:
-        async with state.proxy() as data:
-            data["gsheet_id"] = gsheet_id
-            data["account_names"] = account_names
-
-        await bot.send_message(
+        bot.enqueue(
             user_id,
             "*Удаление счета*\n\nВыбери из списка ниже счет, который ты хочешь удалить.",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(sorted(account_names)),
+            reply_markup=settings_keyboard(settings, "accounts"),
         )
         await DeleteAccount.name.set()
 
 
+@rate_limit("sheets_write")
 async def get_account_name_handler(message: types.Message, state: FSMContext):
     """Gets and deletes account."""
     name = message.text
 
-    async with state.proxy() as data:
-        account_names = data["account_names"]
-        gsheet_id = data["gsheet_id"]
+    async with transaction_lock(message.from_user.id):
+        settings = await get_settings(message.from_user.id)
+        if await answer_keyboard_page(message, settings, "accounts"):
+            return
 
-    if name.lower() not in map(lambda word: word.lower(), account_names):
-        await message.answer(
-            "Упс!\nЯ такого счета не знаю! Похоже, что ты ошибся в названии. Попробуй еще раз!",
-            parse_mode="Markdown",
-            reply_markup=list_items_keyboard(sorted(account_names)),
-        )
+        account_names = settings["account_names"]
+        gsheet_id = settings["gsheet_id"]
 
-    else:
-        try:
-            delete_account(name, account_names=account_names, gsheet_id=gsheet_id)
-        except Exception as exc:
-            logging.error("Excpetion during delete_account executing!", exc_info=exc)
-            await message.answer(
-                "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                f"напиши моему создателю: {CREATOR}. Он все починит)",
+        if name.lower() not in map(lambda word: word.lower(), account_names):
+            reply(
+                message,
+                "Упс!\nЯ такого счета не знаю! Похоже, что ты ошибся в названии. Попробуй еще раз!",
                 parse_mode="Markdown",
-                reply_markup=main_keyboard(),
-            )
-        else:
-            await message.answer(
-                f"*Готово!*\n\nАккаунт с именем {name} успешно удален!",
-                parse_mode="Markdown",
-                reply_markup=main_keyboard(),
+                reply_markup=settings_keyboard(settings, "accounts"),
             )
 
-        await state.finish()
+        else:
+            try:
+                await run_blocking(delete_account, name, account_names=account_names, gsheet_id=gsheet_id)
+            except Exception as exc:
+                logging.error("Excpetion during delete_account executing!", exc_info=exc)
+                reply(
+                    message,
+                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                    f"напиши моему создателю: {CREATOR}. Он все починит)",
+                    parse_mode="Markdown",
+                    reply_markup=main_keyboard(),
+                )
+            else:
+                invalidate_settings(message.from_user.id)
+                reply(
+                    message,
+                    f"*Готово!*\n\nАккаунт с именем {name} успешно удален!",
+                    parse_mode="Markdown",
+                    reply_markup=main_keyboard(),
+                )
+
+            await state.finish()
 
 
 def register_delete_account_handlers(dp: Dispatcher):
@@ -94,7 +102,7 @@ def register_delete_account_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         delete_account_callback_handler,
-        lambda cb: cb.data == "delete_account",
+        text="delete_account",
     )
     dp.register_message_handler(
         get_account_name_handler,
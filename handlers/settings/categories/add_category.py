@@ -9,11 +9,14 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-from database import get_gsheet_id
-from google_sheet.categories import get_categories, add_category
+from google_sheet.categories import add_category
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from background import run_blocking
 from server import bot
 from keyboards import list_items_keyboard, main_keyboard
 from config import CREATOR
+from throttling import rate_limit
+from utils import reply
 
 
 class AddCategory(StatesGroup):
@@ -25,9 +28,8 @@ async def add_category_handler_callback(message_or_call_query: Union[types.Messa
                                         state: FSMContext):
     """Starts adding category."""
     user_id = message_or_call_query.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Добавление категории*\n\nКатегорию какого типа ты хочешь добавить? Выбери из списка под клавиатурой.",
         parse_mode="Markdown",
@@ -35,11 +37,8 @@ async def add_category_handler_callback(message_or_call_query: Union[types.Messa
     )
     await AddCategory.category_type.set()
 
-    async with state.proxy() as data:
-        data["gsheet_id"] = gsheet_id
-        data["categories"] = get_categories(gsheet_id=gsheet_id)
-
 
+@rate_limit("cached")
 async def get_category_type(message: types.Message, state: FSMContext):
     """Gets category type from user."""
     category_type = message.text.lower()
@@ -48,60 +47,71 @@ async def get_category_type(message: types.Message, state: FSMContext):
         async with state.proxy() as data:
             data["category_type"] = category_type
 
-        await message.answer(
+        reply(
+            message,
             "*Добавление категории*\n\nВведи название категории, которую ты хочешь добавить!",
             parse_mode="Markdown",
         )
         await AddCategory.category_name.set()
 
     else:
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такого типа категории! Попробуй еще раз!",
             reply_markup=list_items_keyboard(["Доходы", "Расходы"]),
         )
 
 
+@rate_limit("sheets_write")
 async def get_category_name_handler(message: types.Message, state: FSMContext):
     """Gets category name form user and adds it to user's Google sheet."""
     category_name = message.text
 
     async with state.proxy() as data:
-        categories = data["categories"]
         category_type = data["category_type"]
-        gsheet_id = data["gsheet_id"]
-
-    lowercase_categories = list(map(lambda word: word.lower(), categories[category_type]))
-    if category_name.lower() in lowercase_categories:
-        await message.answer(
-            f"Хм...  Категория {category_name} типа {category_type.lower()} уже "
-            f"существует! Придумай другое название!",
-            parse_mode="Markdown",
-        )
 
-    else:
-        try:
-            add_category(
-                category_name,
-                category_type,
-                categories=categories,
-                gsheet_id=gsheet_id,
-            )
-        except Exception as exc:
-            logging.error("Excpetion during add_category executing!", exc_info=exc)
-            await message.answer(
-                "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                f"напиши моему создателю: {CREATOR}. Он все починит)",
+    async with transaction_lock(message.from_user.id):
+        settings = await get_settings(message.from_user.id)
+        categories = settings["categories"]
+        gsheet_id = settings["gsheet_id"]
+
+        lowercase_categories = list(map(lambda word: word.lower(), categories[category_type]))
+        if category_name.lower() in lowercase_categories:
+            reply(
+                message,
+                f"Хм...  Категория {category_name} типа {category_type.lower()} уже "
+                f"существует! Придумай другое название!",
                 parse_mode="Markdown",
-                reply_markup=main_keyboard(),
             )
 
         else:
-            await message.answer(
-                f"Категория {category_name} успешно добавлена!",
-                reply_markup=main_keyboard(),
-            )
-
-        await state.finish()
+            try:
+                await run_blocking(
+                    add_category,
+                    category_name,
+                    category_type,
+                    categories=categories,
+                    gsheet_id=gsheet_id,
+                )
+            except Exception as exc:
+                logging.error("Excpetion during add_category executing!", exc_info=exc)
+                reply(
+                    message,
+                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                    f"напиши моему создателю: {CREATOR}. Он все починит)",
+                    parse_mode="Markdown",
+                    reply_markup=main_keyboard(),
+                )
+
+            else:
+                invalidate_settings(message.from_user.id)
+                reply(
+                    message,
+                    f"Категория {category_name} успешно добавлена!",
+                    reply_markup=main_keyboard(),
+                )
+
+            await state.finish()
 
 
 def register_add_category_handlers(dp: Dispatcher):
@@ -112,7 +122,7 @@ def register_add_category_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         add_category_handler_callback,
-        lambda cb: cb.data == "add_category",
+        text="add_category",
     )
 
     dp.register_message_handler(
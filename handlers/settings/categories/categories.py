@@ -6,13 +6,13 @@ from typing import Union
 from aiogram import types, Dispatcher
 from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
 
-from server import bot
+from utils import update_message
+from throttling import rate_limit
 
 
+@rate_limit("cached")
 async def categories_settings_callback_handler(message_or_call_query: Union[types.Message, types.CallbackQuery]):
     """Categories settings."""
-    user_id = message_or_call_query.from_user.id
-
     markup = InlineKeyboardMarkup()
     markup.row(
         InlineKeyboardButton("Удалить категорию", callback_data="delete_category"),
@@ -23,8 +23,8 @@ async def categories_settings_callback_handler(message_or_call_query: Union[type
         InlineKeyboardButton("Отмена", callback_data="settings_cancel"),
     )
 
-    await bot.send_message(
-        user_id,
+    await update_message(
+        message_or_call_query,
         "*Настройки категорий*\n\nВыбери, что ты хлчешь сделать, нажав на нужную кнопку под сообщением",
         parse_mode="Markdown",
         reply_markup=markup
@@ -39,7 +39,7 @@ def register_categories_settings_handlers(dp: Dispatcher):
 
     dp.register_callback_query_handler(
         categories_settings_callback_handler,
-        lambda cb: cb.data == "settings_categories",
+        text="settings_categories",
     )
 
     register_add_category_handlers(dp)
@@ -9,11 +9,14 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher import FSMContext
 
-from database import get_gsheet_id
-from google_sheet.categories import get_categories, delete_category
+from google_sheet.categories import delete_category
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from background import run_blocking
 from server import bot
-from keyboards import list_items_keyboard, main_keyboard
+from keyboards import list_items_keyboard, main_keyboard, settings_keyboard
+from utils import answer_keyboard_page, reply
 from config import CREATOR
+from throttling import rate_limit
 
 
 class DeleteCategory(StatesGroup):
@@ -25,12 +28,8 @@ async def delete_category_callback_handler(message_or_call_query: Union[types.Me
                                            state: FSMContext):
     """Starts delete category process."""
     user_id = message_or_call_query.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    async with state.proxy() as data:
-        data["gsheet_id"] = gsheet_id
-
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Удаление категории*\n\nВыбери тип категории под твоей клавиатурой.",
         parse_mode="Markdown",
@@ -39,26 +38,30 @@ async def delete_category_callback_handler(message_or_call_query: Union[types.Me
     await DeleteCategory.category_type.set()
 
 
+@rate_limit("cached")
 async def get_category_type_handler(message: types.Message, state: FSMContext):
     """Gets category type from user."""
     category_type = message.text.lower()
     if category_type in ["расходы", "доходы"]:
         category_type = category_type.replace("расходы", "expense").replace("доходы", "income")
         async with state.proxy() as data:
-            categories = get_categories(gsheet_id=data["gsheet_id"])
-            data["categories"] = categories
             data["category_type"] = category_type
 
-        await message.answer(
+        settings = await get_settings(message.from_user.id)
+        categories = settings["categories"]
+
+        reply(
+            message,
             "*Удаление категории*\n\nНапиши мне название категории, которую ты хочешь удалить. "
             "Под твоей клавиатурой есть список доступных к удалению категорий.",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(sorted(categories[category_type])),
+            reply_markup=settings_keyboard(settings, category_type),
         )
         await DeleteCategory.name.set()
 
     else:
-        await message.answer(
+        reply(
+            message,
             "Упс! Похоже ты ошибся, потому что тип категории может быть только "
             f"*расходы* или *доходы*, но никак не {category_type}!",
             parse_mode="Markdown",
@@ -66,46 +69,58 @@ async def get_category_type_handler(message: types.Message, state: FSMContext):
         )
 
 
+@rate_limit("sheets_write")
 async def get_category_name_handler(message: types.Message, state: FSMContext):
     """Gets category name from user."""
     category_name = message.text.lower()
 
     async with state.proxy() as data:
-        categories = data["categories"]
         category_type = data["category_type"]
-        gsheet_id = data["gsheet_id"]
 
-    lowercase_categories = list(map(lambda word: word.lower(), categories[category_type]))
-    if category_name not in lowercase_categories:
-        await message.answer(
-            "Я не знаю такой категории! Попробуй еще раз!",
-            reply_markup=list_items_keyboard(categories[category_type]),
-        )
+    async with transaction_lock(message.from_user.id):
+        settings = await get_settings(message.from_user.id)
+        if await answer_keyboard_page(message, settings, category_type):
+            return
 
-    else:
-        try:
-            delete_category(
-                category_name,
-                category_type,
-                categories=categories,
-                gsheet_id=gsheet_id
-            )
-        except Exception as exc:
-            logging.error("Excpetion during delete_category executing!", exc_info=exc)
-            await message.answer(
-                "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                f"напиши моему создателю: {CREATOR}. Он все починит)",
-                parse_mode="Markdown",
-                reply_markup=main_keyboard(),
-            )
+        categories = settings["categories"]
+        gsheet_id = settings["gsheet_id"]
 
-        else:
-            await message.answer(
-                f"Категория с именем {category_name} успешно удалена!",
-                reply_markup=main_keyboard(),
+        lowercase_categories = list(map(lambda word: word.lower(), categories[category_type]))
+        if category_name not in lowercase_categories:
+            reply(
+                message,
+                "Я не знаю такой категории! Попробуй еще раз!",
+                reply_markup=settings_keyboard(settings, category_type),
             )
 
-        await state.finish()
+        else:
+            try:
+                await run_blocking(
+                    delete_category,
+                    category_name,
+                    category_type,
+                    categories=categories,
+                    gsheet_id=gsheet_id
+                )
+            except Exception as exc:
+                logging.error("Excpetion during delete_category executing!", exc_info=exc)
+                reply(
+                    message,
+                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                    f"напиши моему создателю: {CREATOR}. Он все починит)",
+                    parse_mode="Markdown",
+                    reply_markup=main_keyboard(),
+                )
+
+            else:
+                invalidate_settings(message.from_user.id)
+                reply(
+                    message,
+                    f"Категория с именем {category_name} успешно удалена!",
+                    reply_markup=main_keyboard(),
+                )
+
+            await state.finish()
 
 
 def register_delete_category_handlers(dp: Dispatcher):
@@ -116,7 +131,7 @@ def register_delete_category_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         delete_category_callback_handler,
-        lambda cb: cb.data == "delete_category",
+        text="delete_category",
     )
 
     dp.register_message_handler(
@@ -9,11 +9,14 @@ from aiogram import types, Dispatcher
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 
-from database import get_gsheet_id
-from google_sheet.categories import get_categories, rename_category
+from google_sheet.categories import rename_category
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+from background import run_blocking
 from server import bot
-from keyboards import list_items_keyboard, main_keyboard
+from keyboards import list_items_keyboard, main_keyboard, settings_keyboard
+from utils import answer_keyboard_page, reply
 from config import CREATOR
+from throttling import rate_limit
 
 
 class RenameCategory(StatesGroup):
@@ -26,9 +29,8 @@ async def rename_category_handler_callback(message_or_call_query: Union[types.Me
                                            state: FSMContext):
     """Starts renaming a category."""
     user_id = message_or_call_query.from_user.id
-    gsheet_id = get_gsheet_id(user_id)
 
-    await bot.send_message(
+    bot.enqueue(
         user_id,
         "*Изменение категории*\n\nКатегорию какого типа ты хочешь переименовать? Выбери из списка под клавиатурой.",
         parse_mode="Markdown",
@@ -36,11 +38,8 @@ async def rename_category_handler_callback(message_or_call_query: Union[types.Me
     )
     await RenameCategory.category_type.set()
 
-    async with state.proxy() as data:
-        data["gsheet_id"] = gsheet_id
-        data["categories"] = get_categories(gsheet_id=gsheet_id)
-
 
+@rate_limit("cached")
 async def get_category_type(message: types.Message, state: FSMContext):
     """Gets category type from user."""
     category_type = message.text.lower()
@@ -48,42 +47,52 @@ async def get_category_type(message: types.Message, state: FSMContext):
         category_type = category_type.replace("расходы", "expense").replace("доходы", "income")
         async with state.proxy() as data:
             data["category_type"] = category_type
-            categories = data["categories"]
 
-        await message.answer(
+        settings = await get_settings(message.from_user.id)
+
+        reply(
+            message,
             "*Изменение категории*\n\nВыбери категорию, которую ты хочешь переименовать!",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(categories[category_type])
+            reply_markup=settings_keyboard(settings, category_type)
         )
         await RenameCategory.category_name.set()
 
     else:
-        await message.answer(
+        reply(
+            message,
             "Я не знаю такого типа категории! Попробуй еще раз!",
             reply_markup=list_items_keyboard(["Доходы", "Расходы"]),
         )
 
 
+@rate_limit("cached")
 async def get_category_name_handler(message: types.Message, state: FSMContext):
     """Gets category name form user."""
     category_name = message.text
 
     async with state.proxy() as data:
-        categories = data["categories"]
         category_type = data["category_type"]
-        # gsheet_id = data["gsheet_id"]
+
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, category_type):
+        return
+
+    categories = settings["categories"]
 
     lowercase_categories = list(map(lambda word: word.lower(), categories[category_type]))
     if category_name.lower() not in lowercase_categories:
-        await message.answer(
+        reply(
+            message,
             f"*Хм...* Категории {category_name} типа {category_type.lower()} не "
             f"существует! Попробуй еще раз!",
             parse_mode="Markdown",
-            reply_markup=list_items_keyboard(categories[category_type]),
+            reply_markup=settings_keyboard(settings, category_type),
         )
 
     else:
-        await message.answer(
+        reply(
+            message,
             f"*Изменение категории*\n\nВведи новое название для категории {category_name}.",
             parse_mode="Markdown",
         )
@@ -94,48 +103,57 @@ async def get_category_name_handler(message: types.Message, state: FSMContext):
         await RenameCategory.new_category_name.set()
 
 
+@rate_limit("sheets_write")
 async def get_new_category_name_handler(message: types.Message, state: FSMContext):
     """Gets new category name form user and adds it to user's Google sheet."""
     new_name = message.text
 
     async with state.proxy() as data:
-        categories = data["categories"]
         category_type = data["category_type"]
         category_name = data["category_name"]
-        gsheet_id = data["gsheet_id"]
 
-    if new_name.lower() in map(lambda word: word.lower(), categories[category_type]):
-        await message.answer(
-            f"*Опа!*\nКатегория с именем {new_name} типа {category_type} уже существует! "
-            "Ты не можешь переименовать категорию в уже существующую! Попробуй еще раз!",
-            parse_mode="Markdown",
-        )
+    async with transaction_lock(message.from_user.id):
+        settings = await get_settings(message.from_user.id)
+        categories = settings["categories"]
+        gsheet_id = settings["gsheet_id"]
 
-    else:
-        try:
-            rename_category(
-                category_name,
-                new_name,
-                category_type,
-                categories=categories,
-                gsheet_id=gsheet_id,
-            )
-        except Exception as exc:
-            logging.error("Excpetion during rename_category executing!", exc_info=exc)
-            await message.answer(
-                "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
-                f"напиши моему создателю: {CREATOR}. Он все починит)",
+        if new_name.lower() in map(lambda word: word.lower(), categories[category_type]):
+            reply(
+                message,
+                f"*Опа!*\nКатегория с именем {new_name} типа {category_type} уже существует! "
+                "Ты не можешь переименовать категорию в уже существующую! Попробуй еще раз!",
                 parse_mode="Markdown",
-                reply_markup=main_keyboard(),
             )
 
         else:
-            await message.answer(
-                f"Категория с именем {category_name} успешно переименована в {new_name}!",
-                reply_markup=main_keyboard(),
-            )
-
-        await state.finish()
+            try:
+                await run_blocking(
+                    rename_category,
+                    category_name,
+                    new_name,
+                    category_type,
+                    categories=categories,
+                    gsheet_id=gsheet_id,
+                )
+            except Exception as exc:
+                logging.error("Excpetion during rename_category executing!", exc_info=exc)
+                reply(
+                    message,
+                    "*Ошибка!*\n\nНа моей стороне произошла ошибка. Если ты это читаешь, то "
+                    f"напиши моему создателю: {CREATOR}. Он все починит)",
+                    parse_mode="Markdown",
+                    reply_markup=main_keyboard(),
+                )
+
+            else:
+                invalidate_settings(message.from_user.id)
+                reply(
+                    message,
+                    f"Категория с именем {category_name} успешно переименована в {new_name}!",
+                    reply_markup=main_keyboard(),
+                )
+
+            await state.finish()
 
 
 def register_rename_category_handlers(dp: Dispatcher):
@@ -146,7 +164,7 @@ def register_rename_category_handlers(dp: Dispatcher):
     )
     dp.register_callback_query_handler(
         rename_category_handler_callback,
-        lambda cb: cb.data == "rename_category",
+        text="rename_category",
     )
 
     dp.register_message_handler(
@@ -7,12 +7,14 @@ from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardBu
 
 from server import bot
 from keyboards import main_keyboard
-from utils import auth
+from utils import auth, reply
+from throttling import rate_limit
 
 
+@rate_limit("cached")
 async def settings_cancel(call_query: types.CallbackQuery):
     """Breaks account setting process."""
-    await bot.send_message(
+    bot.enqueue(
         call_query.from_user.id,
         "*Отмена*\n\nТеперь ты можешь продолжать вести учет расходов! 💵",
         parse_mode="Markdown",
@@ -20,6 +22,7 @@ async def settings_cancel(call_query: types.CallbackQuery):
     )
 
 
+@rate_limit("cached")
 @auth
 async def settings_handler(message: types.Message):
     """Go to settings."""
@@ -29,7 +32,8 @@ async def settings_handler(message: types.Message):
         InlineKeyboardButton("Категории", callback_data="settings_categories"),
     )
 
-    await message.answer(
+    reply(
+        message,
         "*Настройки*\n\nВ настройках ты можешь добавить новый счет или изменить старый, "
         "то же самое ты можешь сделать и с категориями.",
         parse_mode="Markdown",
@@ -47,7 +51,7 @@ def register_settings_handlers(dp: Dispatcher):
 
     dp.register_callback_query_handler(
         settings_cancel,
-        lambda cb: cb.data == "settings_cancel",
+        text="settings_cancel",
     )
 
     dp.register_message_handler(
@@ -0,0 +1,278 @@
+"""
+Split transaction: one receipt spread across several expense categories
+is written by one request with a single change of the account's balance.
+"""
+import datetime
+import logging
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
+
+import journal
+import summary
+from background import run_blocking
+from config import CREATOR
+from google_sheet.transactions import add_transactions
+from handlers.batch import format_entries
+from keyboards import main_keyboard, settings_keyboard
+from server import bot
+from settings_cache import prefetch_settings, get_settings, apply_transactions, transaction_lock
+from throttling import rate_limit
+from utils import auth, answer_keyboard_page, reply, update_message
+
+
+class SplitExpense(StatesGroup):
+    total = State()
+    account = State()
+    amount = State()
+    category = State()
+    review = State()
+
+
+def split_keyboard(complete: bool) -> InlineKeyboardMarkup:
+    """
+    Keyboard of the split: saving is possible when the whole receipt is distributed.
+
+    :param complete: The sum of the parts is equal to the receipt.
+    """
+    markup = InlineKeyboardMarkup()
+    if complete:
+        markup.row(InlineKeyboardButton("Сохранить ✅", callback_data="split_commit"))
+    markup.row(InlineKeyboardButton("Отмена ❌", callback_data="split_cancel"))
+
+    return markup
+
+
+def get_remainder(data: dict) -> float:
+    """Returns part of the receipt not distributed between categories yet."""
+    return round(data["total"] - sum(part["amount"] for part in data["parts"]), 2)
+
+
+@rate_limit("cached")
+@auth
+async def split_cmd(message: types.Message, state: FSMContext):
+    """Starts split transaction."""
+    await state.finish()
+    await SplitExpense.total.set()
+
+    reply(
+        message,
+        "*Разделение чека*\n\nНапиши сумму всего чека, а потом распредели ее между категориями.",
+        parse_mode="Markdown",
+    )
+
+    await prefetch_settings(message.from_user.id)
+
+
+@rate_limit("cached")
+async def get_total_handler(message: types.Message, state: FSMContext):
+    """Gets amount of the receipt."""
+    try:
+        total = float(message.text)
+    except ValueError:
+        reply(message, "Введи числовое значение!")
+        return
+
+    if total <= 0:
+        reply(message, "Сумма чека должна быть больше нуля!")
+        return
+
+    await state.update_data(total=total, parts=[])
+
+    settings = await get_settings(message.from_user.id)
+    if len(settings["categories"]["expense"]) == 0:
+        reply(
+            message,
+            "Похоже, что ты еще не добавил ни одной категории расходов.\n"
+            "Чтобы ее добавить, введи команду /add_category"
+        )
+        await state.finish()
+        return
+
+    if len(settings["account_names"]) == 0:
+        reply(message, "Ты не создал еще ни одного счета! Чтобы его создать, введи /add_account")
+        await state.finish()
+        return
+
+    reply(
+        message,
+        "Выбери счет, с которого был оплачен чек.",
+        reply_markup=settings_keyboard(settings, "accounts"),
+    )
+    await SplitExpense.account.set()
+
+
+@rate_limit("cached")
+async def get_account_handler(message: types.Message, state: FSMContext):
+    """Gets account of the receipt."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "accounts"):
+        return
+
+    account = settings["accounts"].get(message.text.lower())
+    if account is None:
+        reply(
+            message,
+            "Я не знаю такого счета, попробуй ввести его еще раз!",
+            reply_markup=settings_keyboard(settings, "accounts"),
+        )
+        return
+
+    await state.update_data(account=account["name"])
+    reply(message, "Напиши сумму первой части чека.", reply_markup=types.ReplyKeyboardRemove())
+    await SplitExpense.amount.set()
+
+
+@rate_limit("cached")
+async def get_amount_handler(message: types.Message, state: FSMContext):
+    """Gets amount of the next part."""
+    try:
+        amount = float(message.text)
+    except ValueError:
+        reply(message, "Введи числовое значение!")
+        return
+
+    async with state.proxy() as data:
+        remainder = get_remainder(data)
+        if amount <= 0 or amount > remainder:
+            reply(message, f"Сумма части должна быть больше нуля и не больше {remainder:g}!")
+            return
+
+        data["amount"] = amount
+
+    settings = await get_settings(message.from_user.id)
+    reply(message, "Выбери категорию этой части.", reply_markup=settings_keyboard(settings, "expense"))
+    await SplitExpense.category.set()
+
+
+@rate_limit("cached")
+async def get_category_handler(message: types.Message, state: FSMContext):
+    """Gets category of the part."""
+    settings = await get_settings(message.from_user.id)
+    if await answer_keyboard_page(message, settings, "expense"):
+        return
+
+    categories = {category.lower(): category for category in settings["categories"]["expense"]}
+    if message.text.lower() not in categories:
+        reply(
+            message,
+            "Я не знаю такой категории, попробуй ввести ее еще раз!",
+            reply_markup=settings_keyboard(settings, "expense"),
+        )
+        return
+
+    async with state.proxy() as data:
+        data["parts"].append({
+            "amount": data.pop("amount"),
+            "category": categories[message.text.lower()],
+            "account": data["account"],
+        })
+        parts = data["parts"]
+        remainder = get_remainder(data)
+
+    if remainder > 0:
+        await SplitExpense.amount.set()
+        reply(
+            message,
+            f"{format_entries(parts)}\n\nОсталось распределить: {remainder:g}. Напиши сумму следующей части.",
+            reply_markup=split_keyboard(complete=False),
+        )
+    else:
+        await SplitExpense.review.set()
+        reply(
+            message,
+            f"{format_entries(parts)}\n\nЧек распределен полностью.",
+            reply_markup=split_keyboard(complete=True),
+        )
+
+
+@rate_limit("cached")
+async def review_handler(message: types.Message):
+    """Reminds that the distributed receipt must be saved or cancelled."""
+    reply(message, "Чек уже распределен, сохрани его или отмени кнопкой под сообщением.")
+
+
+@rate_limit("sheets_write")
+async def commit_callback(call_query: types.CallbackQuery, state: FSMContext):
+    """Writes all parts of the receipt to Google sheet."""
+    user_id = call_query.from_user.id
+
+    try:
+        async with transaction_lock(user_id):
+            # A repeated tap waits for the lock while the receipt is written, so the flow is checked under it.
+            current_state = await state.get_state()
+            if current_state != SplitExpense.review.state:
+                await call_query.answer("Чек уже сохранен.")
+                return
+
+            data = await state.get_data()
+            parts = [
+                dict(part, comment=f"Чек {data['total']:g} ({i}/{len(data['parts'])})")
+                for i, part in enumerate(data["parts"], 1)
+            ]
+
+            # The flow is closed before writing and restored if the receipt is not saved.
+            await state.finish()
+            try:
+                settings = await get_settings(user_id)
+                position = settings["total_expenses"]
+                changes = await summary.plan_changes(
+                    user_id, settings, "expense", summary.get_amounts(parts, datetime.date.today())
+                )
+                deltas = await run_blocking(
+                    add_transactions,
+                    "expense",
+                    parts,
+                    gsheet_id=settings["gsheet_id"],
+                    sheet_ids=settings["sheet_ids"],
+                    account_names=settings["account_names"],
+                    accounts=settings["accounts"],
+                    summary=changes,
+                )
+            except Exception:
+                await state.set_state(current_state)
+                await state.set_data(data)
+                raise
+
+            apply_transactions(user_id, "expense", len(parts), deltas)
+            await journal.record(user_id, "expense", position, parts, deltas)
+            await summary.save_changes(user_id, changes)
+
+    except Exception as exc:
+        logging.error("Exception during add_transactions executing!", exc_info=exc)
+        bot.enqueue(
+            user_id,
+            "*Ошибка!*\n\nНа моей стороне произошла ошибка, чек не сохранен. Попробуй сохранить его еще раз, "
+            f"а если не получится, напиши моему создателю: {CREATOR}.",
+            parse_mode="Markdown",
+        )
+        return
+
+    await update_message(call_query, f"Чек сохранен ✅\n\n{format_entries(parts)}")
+    bot.enqueue(user_id, "Теперь ты можешь продолжать вести учет расходов! 💵", reply_markup=main_keyboard())
+
+
+@rate_limit("cached")
+async def cancel_callback(call_query: types.CallbackQuery, state: FSMContext):
+    """Drops the split."""
+    await state.finish()
+    await update_message(call_query, "*Отмена*\n\nЧек не сохранен.", parse_mode="Markdown")
+    bot.enqueue(
+        call_query.from_user.id,
+        "Теперь ты можешь продолжать вести учет расходов! 💵",
+        reply_markup=main_keyboard(),
+    )
+
+
+def register_split_handlers(dp: Dispatcher):
+    """Registers handlers of split transaction."""
+    dp.register_message_handler(split_cmd, commands=["split"], state="*")
+    dp.register_message_handler(get_total_handler, state=SplitExpense.total)
+    dp.register_message_handler(get_account_handler, state=SplitExpense.account)
+    dp.register_message_handler(get_amount_handler, state=SplitExpense.amount)
+    dp.register_message_handler(get_category_handler, state=SplitExpense.category)
+    dp.register_message_handler(review_handler, state=SplitExpense.review)
+    dp.register_callback_query_handler(commit_callback, text="split_commit", state=SplitExpense.review)
+    dp.register_callback_query_handler(cancel_callback, text="split_cancel", state=SplitExpense)
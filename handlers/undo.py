@@ -0,0 +1,319 @@
+"""
+Undoing and editing the last write of the bot (/undo and /edit_last).
+Rows of the write are found by the journal, so the change is one request
+with the rows and balances of the accounts, without reading the whole table.
+"""
+import datetime
+import logging
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher import FSMContext
+from aiogram.dispatcher.filters.state import State, StatesGroup
+from aiogram.types.inline_keyboard import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.callback_data import CallbackData
+
+import journal
+import summary
+from background import run_blocking
+from config import CREATOR
+from google_sheet.transactions import delete_transactions, update_transaction, get_balance_deltas
+from handlers.batch import format_entries
+from keyboards import main_keyboard, settings_keyboard
+from server import bot
+from settings_cache import prefetch_settings, get_settings, apply_transactions, transaction_lock
+from throttling import rate_limit
+from utils import auth, answer_keyboard_page, reply, update_message
+
+
+undo_callback_data = CallbackData("undo", "entry_id")
+edit_callback_data = CallbackData("edit_last", "entry_id", "field")
+
+KIND_NAMES = {"expense": "Расходы", "income": "Доходы"}
+FIELDS = {
+    "amount": "Сумма",
+    "category": "Категория",
+    "account": "Счет",
+    "comment": "Комментарий",
+}
+
+NOTHING_TO_CHANGE = "Я не помню твоих последних записей, их можно изменить только в Google таблице."
+CHANGED_BY_HAND = (
+    "Похоже, что записи были изменены в Google таблице вручную, поэтому я не буду их трогать. "
+    "Исправь их прямо в таблице."
+)
+ERROR_MESSAGE = (
+    "*Ошибка!*\n\nНа моей стороне произошла ошибка, таблица не изменена. Попробуй еще раз, "
+    f"а если не получится, напиши моему создателю: {CREATOR}."
+)
+
+
+class EditLastTransaction(StatesGroup):
+    value = State()
+
+
+def describe_entry(entry: dict) -> str:
+    """Returns description of the transaction with its comment."""
+    return (
+        f"{entry['amount']:g} — {entry['category']} ({entry['account']})\n"
+        f"Комментарий: {entry.get('comment') or '—'}"
+    )
+
+
+def accounts_exist(settings: dict, entries: list) -> bool:
+    """Checks that accounts of the entries were not deleted or renamed."""
+    return all(entry["account"].lower() in settings["accounts"] for entry in entries)
+
+
+@rate_limit("cached")
+@auth
+async def undo_cmd(message: types.Message, state: FSMContext):
+    """Shows the last write and asks to confirm undoing it."""
+    await state.finish()
+
+    entry = await journal.get_last(message.from_user.id)
+    if entry is None:
+        reply(message, NOTHING_TO_CHANGE)
+        return
+
+    markup = InlineKeyboardMarkup()
+    markup.row(InlineKeyboardButton("Отменить запись ↩️", callback_data=undo_callback_data.new(entry.entry_id)))
+    markup.row(InlineKeyboardButton("Оставить ❌", callback_data="undo_cancel"))
+
+    reply(
+        message,
+        f"Отменить последнюю запись?\n\n{KIND_NAMES[entry.kind]}:\n{format_entries(entry.entries)}",
+        reply_markup=markup,
+    )
+
+    await prefetch_settings(message.from_user.id)
+
+
+@rate_limit("sheets_write")
+async def undo_callback(call_query: types.CallbackQuery, callback_data: dict):
+    """Deletes rows of the last write and returns the money to the accounts."""
+    user_id = call_query.from_user.id
+
+    try:
+        async with transaction_lock(user_id):
+            entry = await journal.get_last(user_id)
+            settings = await get_settings(user_id)
+
+            if entry is None or entry.entry_id != int(callback_data["entry_id"]):
+                text = "Последняя запись уже изменилась, напиши /undo еще раз."
+            elif not accounts_exist(settings, entry.entries):
+                text = CHANGED_BY_HAND
+            else:
+                changes = await summary.plan_changes(
+                    user_id,
+                    settings,
+                    entry.kind,
+                    summary.get_amounts(entry.entries, datetime.date.fromtimestamp(entry.created_at), sign=-1),
+                )
+                deltas = await run_blocking(
+                    delete_transactions,
+                    entry.kind,
+                    entry.get_row(settings[f"total_{entry.kind}s"]),
+                    entry.entries,
+                    gsheet_id=settings["gsheet_id"],
+                    sheet_ids=settings["sheet_ids"],
+                    account_names=settings["account_names"],
+                    accounts=settings["accounts"],
+                    summary=changes,
+                )
+                if deltas is None:
+                    # Positions of the other writes can not be trusted too.
+                    await journal.forget(user_id)
+                    text = CHANGED_BY_HAND
+                else:
+                    apply_transactions(user_id, entry.kind, -len(entry.entries), deltas)
+                    await journal.delete(entry)
+                    await summary.save_changes(user_id, changes)
+                    text = f"Запись отменена ✅\n\n{KIND_NAMES[entry.kind]}:\n{format_entries(entry.entries)}"
+
+    except Exception as exc:
+        logging.error("Exception during delete_transactions executing!", exc_info=exc)
+        bot.enqueue(user_id, ERROR_MESSAGE, parse_mode="Markdown")
+        return
+
+    await update_message(call_query, text)
+
+
+@rate_limit("cached")
+async def undo_cancel_callback(call_query: types.CallbackQuery):
+    """Keeps the last write."""
+    await update_message(call_query, "Запись оставлена без изменений.")
+
+
+@rate_limit("cached")
+@auth
+async def edit_last_cmd(message: types.Message, state: FSMContext):
+    """Shows the last transaction and asks which field must be changed."""
+    await state.finish()
+
+    entry = await journal.get_last(message.from_user.id)
+    if entry is None:
+        reply(message, NOTHING_TO_CHANGE)
+        return
+
+    markup = InlineKeyboardMarkup()
+    for field, name in FIELDS.items():
+        markup.insert(InlineKeyboardButton(name, callback_data=edit_callback_data.new(entry.entry_id, field)))
+    markup.row(InlineKeyboardButton("Отмена ❌", callback_data="edit_last_cancel"))
+
+    reply(
+        message,
+        f"Последняя запись:\n\n{describe_entry(entry.entries[-1])}\n\nЧто нужно исправить?",
+        reply_markup=markup,
+    )
+
+    await prefetch_settings(message.from_user.id)
+
+
+@rate_limit("cached")
+async def edit_field_callback(call_query: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    """Asks new value of the field."""
+    entry = await journal.get_last(call_query.from_user.id)
+    if entry is None or entry.entry_id != int(callback_data["entry_id"]):
+        await update_message(call_query, "Последняя запись уже изменилась, напиши /edit_last еще раз.")
+        return
+
+    field = callback_data["field"]
+    await state.update_data(entry_id=entry.entry_id, kind=entry.kind, field=field)
+    await EditLastTransaction.value.set()
+
+    settings = await get_settings(call_query.from_user.id)
+    if field == "amount":
+        await update_message(call_query, "Напиши новую сумму.")
+    elif field == "category":
+        await update_message(
+            call_query,
+            "Выбери новую категорию.",
+            reply_markup=settings_keyboard(settings, entry.kind),
+        )
+    elif field == "account":
+        await update_message(call_query, "Выбери новый счет.", reply_markup=settings_keyboard(settings, "accounts"))
+    else:
+        await update_message(call_query, "Напиши новый комментарий.")
+
+
+@rate_limit("sheets_write")
+async def get_value_handler(message: types.Message, state: FSMContext):
+    """Gets new value of the field and rewrites the row of the transaction."""
+    user_id = message.from_user.id
+    data = await state.get_data()
+    field = data["field"]
+    settings = await get_settings(user_id)
+
+    if field == "amount":
+        try:
+            value = float(message.text)
+        except ValueError:
+            reply(message, "Введи числовое значение!")
+            return
+
+        if value < 0:
+            reply(message, "Сумма не может быть отрицательной!")
+            return
+
+    elif field == "category":
+        kind = data["kind"]
+        if await answer_keyboard_page(message, settings, kind):
+            return
+
+        categories = {category.lower(): category for category in settings["categories"][kind]}
+        if message.text.lower() not in categories:
+            reply(
+                message,
+                "Я не знаю такой категории, попробуй ввести ее еще раз!",
+                reply_markup=settings_keyboard(settings, kind),
+            )
+            return
+
+        value = categories[message.text.lower()]
+
+    elif field == "account":
+        if await answer_keyboard_page(message, settings, "accounts"):
+            return
+
+        account = settings["accounts"].get(message.text.lower())
+        if account is None:
+            reply(
+                message,
+                "Я не знаю такого счета, попробуй ввести его еще раз!",
+                reply_markup=settings_keyboard(settings, "accounts"),
+            )
+            return
+
+        value = account["name"]
+
+    else:
+        value = message.text
+
+    try:
+        async with transaction_lock(user_id):
+            entry = await journal.get_last(user_id)
+            settings = await get_settings(user_id)
+
+            if entry is None or entry.entry_id != data["entry_id"]:
+                text = "Последняя запись уже изменилась, напиши /edit_last еще раз."
+            else:
+                old_entry = entry.entries[-1]
+                new_entry = dict(old_entry, **{field: value})
+
+                if not accounts_exist(settings, [old_entry, new_entry]):
+                    text = CHANGED_BY_HAND
+                else:
+                    date = datetime.date.fromtimestamp(entry.created_at)
+                    amounts = summary.get_amounts([old_entry], date, sign=-1)
+                    for key, amount in summary.get_amounts([new_entry], date).items():
+                        amounts[key] = amounts.get(key, 0) + amount
+
+                    changes = await summary.plan_changes(user_id, settings, entry.kind, amounts)
+                    deltas = await run_blocking(
+                        update_transaction,
+                        entry.kind,
+                        entry.get_row(settings[f"total_{entry.kind}s"]),
+                        old_entry,
+                        new_entry,
+                        gsheet_id=settings["gsheet_id"],
+                        sheet_ids=settings["sheet_ids"],
+                        account_names=settings["account_names"],
+                        accounts=settings["accounts"],
+                        summary=changes,
+                    )
+                    if deltas is None:
+                        await journal.forget(user_id)
+                        text = CHANGED_BY_HAND
+                    else:
+                        apply_transactions(user_id, entry.kind, 0, deltas)
+                        entry.entries[-1] = new_entry
+                        entry.deltas = get_balance_deltas(entry.kind, entry.entries)
+                        await journal.update(entry)
+                        await summary.save_changes(user_id, changes)
+                        text = f"Запись исправлена ✅\n\n{describe_entry(new_entry)}"
+
+    except Exception as exc:
+        logging.error("Exception during update_transaction executing!", exc_info=exc)
+        reply(message, ERROR_MESSAGE, parse_mode="Markdown")
+        return
+
+    await state.finish()
+    reply(message, text, reply_markup=main_keyboard())
+
+
+@rate_limit("cached")
+async def edit_last_cancel_callback(call_query: types.CallbackQuery, state: FSMContext):
+    """Breaks editing of the last transaction."""
+    await state.finish()
+    await update_message(call_query, "Запись оставлена без изменений.")
+
+
+def register_undo_handlers(dp: Dispatcher):
+    """Registers handlers of undoing and editing the last write."""
+    dp.register_message_handler(undo_cmd, commands=["undo"], state="*")
+    dp.register_message_handler(edit_last_cmd, commands=["edit_last"], state="*")
+    dp.register_callback_query_handler(undo_callback, undo_callback_data.filter())
+    dp.register_callback_query_handler(undo_cancel_callback, text="undo_cancel")
+    dp.register_callback_query_handler(edit_field_callback, edit_callback_data.filter(field=list(FIELDS)), state="*")
+    dp.register_callback_query_handler(edit_last_cancel_callback, text="edit_last_cancel", state="*")
+    dp.register_message_handler(get_value_handler, state=EditLastTransaction.value)
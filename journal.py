@@ -0,0 +1,150 @@
+"""
+Journal of transactions written by the bot. Each commit (one transaction, a batch
+or a split receipt) remembers its position in the table and the change of balances,
+so /undo and /edit_last find its rows without reading the table.
+
+Tables are sorted from the newest transaction, so rows of a commit move down as new
+transactions are added. The journal keeps position counted from the bottom of the table
+(number of older transactions), which does not change when new ones are added.
+"""
+import json
+import time
+import typing
+
+from config import JOURNAL_SIZE
+from database import db
+from google_sheet.transactions import FIRST_ROW
+
+
+class JournalEntry:
+    """Commit of transactions of one kind."""
+
+    def __init__(self, entry_id: int, user_id: int, kind: str, position: int, entries: list, deltas: dict,
+                 created_at: float):
+        """
+        :param entry_id: ID of the journal entry.
+        :param user_id: Telegram ID of the user.
+        :param kind: Type of transactions (expense/income).
+        :param position: Number of older transactions in the table.
+        :param entries: Dicts with amount, category, account and comment in the order of adding.
+        :param deltas: Changes of balances by lowercase account name.
+        :param created_at: Unix time of the commit.
+        """
+        self.entry_id = entry_id
+        self.user_id = user_id
+        self.kind = kind
+        self.position = position
+        self.entries = entries
+        self.deltas = deltas
+        self.created_at = created_at
+
+    def get_row(self, total: int) -> int:
+        """
+        Returns index (0-based) of the top row of the commit, the row of its last entry.
+
+        :param total: Current number of transactions of the kind in the table.
+        """
+        return FIRST_ROW + total - self.position - len(self.entries)
+
+
+async def record(user_id: int, kind: str, position: int, entries: typing.List[dict], deltas: dict):
+    """
+    Records commit and forgets the oldest ones beyond JOURNAL_SIZE.
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transactions (expense/income).
+    :param position: Number of transactions of the kind in the table before the commit.
+    :param entries: Dicts with amount, category, account and comment in the order of adding.
+    :param deltas: Changes of balances by lowercase account name.
+    """
+    await db.execute(
+        "INSERT INTO journal (user_id, kind, position, entries, deltas, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        user_id,
+        kind,
+        position,
+        json.dumps(entries, ensure_ascii=False),
+        json.dumps(deltas, ensure_ascii=False),
+        time.time(),
+    )
+    await db.execute(
+        "DELETE FROM journal WHERE user_id = ? AND id NOT IN ("
+        "SELECT id FROM journal WHERE user_id = ? ORDER BY id DESC LIMIT ?)",
+        user_id,
+        user_id,
+        JOURNAL_SIZE,
+    )
+
+
+async def get_last(user_id: int) -> typing.Optional[JournalEntry]:
+    """
+    Returns the last commit of the user or None.
+
+    :param user_id: Telegram ID of the user.
+    """
+    row = await db.fetchone(
+        "SELECT id, kind, position, entries, deltas, created_at FROM journal "
+        "WHERE user_id = ? ORDER BY id DESC LIMIT 1",
+        user_id,
+    )
+    if row is None:
+        return None
+
+    entry_id, kind, position, entries, deltas, created_at = row
+    return JournalEntry(entry_id, user_id, kind, position, json.loads(entries), json.loads(deltas), created_at)
+
+
+async def update(entry: JournalEntry):
+    """
+    Saves changed entries and deltas of the commit.
+
+    :param entry: JournalEntry object.
+    """
+    await db.execute(
+        "UPDATE journal SET entries = ?, deltas = ? WHERE id = ?",
+        json.dumps(entry.entries, ensure_ascii=False),
+        json.dumps(entry.deltas, ensure_ascii=False),
+        entry.entry_id,
+    )
+
+
+async def delete(entry: JournalEntry):
+    """
+    Forgets undone commit. Newer commits of the kind move down by its rows.
+
+    :param entry: JournalEntry object.
+    """
+    await db.execute("DELETE FROM journal WHERE id = ?", entry.entry_id)
+    await db.execute(
+        "UPDATE journal SET position = position - ? WHERE user_id = ? AND kind = ? AND position > ?",
+        len(entry.entries),
+        entry.user_id,
+        entry.kind,
+        entry.position,
+    )
+
+
+async def forget(user_id: int):
+    """
+    Forgets all commits of the user (e.g. the bot is connected to another table).
+
+    :param user_id: Telegram ID of the user.
+    """
+    await db.execute("DELETE FROM journal WHERE user_id = ?", user_id)
+
+
+async def forget_archived(user_id: int, kind: str, count: int):
+    """
+    Shifts positions after the oldest transactions were moved to the archive.
+    Commits whose rows were moved can not be undone anymore.
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transactions (expense/income).
+    :param count: Number of moved transactions.
+    """
+    await db.execute("DELETE FROM journal WHERE user_id = ? AND kind = ? AND position < ?", user_id, kind, count)
+    await db.execute(
+        "UPDATE journal SET position = position - ? WHERE user_id = ? AND kind = ?",
+        count,
+        user_id,
+        kind,
+    )
@@ -1,10 +1,25 @@
 """
 File with reply keyboards for bot
 """
+import functools
+import re
+import typing
 
 from aiogram.types.reply_keyboard import ReplyKeyboardMarkup
+from cachetools import LRUCache
 
+from config import KEYBOARD_CACHE_SIZE, KEYBOARD_PAGE_SIZE
 
+
+PREVIOUS_PAGE = "⬅️ Стр. {}"
+NEXT_PAGE = "Стр. {} ➡️"
+PAGE_BUTTON = re.compile(r"^(?:⬅️ Стр\. (\d+)|Стр\. (\d+) ➡️)$")
+
+# Keyboards of settings snapshots by (items_version, items, page).
+_settings_keyboards = LRUCache(maxsize=KEYBOARD_CACHE_SIZE)
+
+
+@functools.lru_cache(maxsize=None)
 def register_keyboard() -> ReplyKeyboardMarkup:
     """
     Registration keyboard
@@ -16,6 +31,7 @@ def register_keyboard() -> ReplyKeyboardMarkup:
     return markup
 
 
+@functools.lru_cache(maxsize=None)
 def main_keyboard() -> ReplyKeyboardMarkup:
     """
     Keyboard with all functionality for money management
@@ -30,11 +46,13 @@ def main_keyboard() -> ReplyKeyboardMarkup:
     return markup
 
 
-def list_items_keyboard(items: list) -> ReplyKeyboardMarkup:
+def list_items_keyboard(items: typing.Sequence[str], page: int = 0) -> ReplyKeyboardMarkup:
     """
-    Keyboard with list items.
+    Keyboard with list items. If there are more than KEYBOARD_PAGE_SIZE items,
+    the keyboard shows the page of items with buttons of the previous and the next pages.
 
     :param items: List of items.
+    :param page: Index of the page (from 0).
 
     :raise AssertionError: If len(categories) less than 1.
 
@@ -42,11 +60,55 @@ def list_items_keyboard(items: list) -> ReplyKeyboardMarkup:
     """
     assert len(items) > 0
 
+    pages = (len(items) - 1) // KEYBOARD_PAGE_SIZE + 1
+    page = min(max(page, 0), pages - 1)
+    page_items = items[page * KEYBOARD_PAGE_SIZE:(page + 1) * KEYBOARD_PAGE_SIZE]
+
     markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    for i in range(0, len(items) - 1, 2):
-        markup.add(*items[i:i + 2])
+    for i in range(0, len(page_items) - 1, 2):
+        markup.add(*page_items[i:i + 2])
+
+    if len(page_items) % 2 == 1:
+        markup.add(page_items[-1])
 
-    if len(items) % 2 == 1:
-        markup.add(items[-1])
+    if pages > 1:
+        buttons = []
+        if page > 0:
+            buttons.append(PREVIOUS_PAGE.format(page))
+        if page < pages - 1:
+            buttons.append(NEXT_PAGE.format(page + 2))
+        markup.row(*buttons)
 
     return markup
+
+
+def settings_keyboard(settings: dict, items: str, page: int = 0) -> ReplyKeyboardMarkup:
+    """
+    Keyboard with sorted items of user's settings snapshot. Keyboards are cached
+    until the items change, so retries and the next flows do not build them again.
+
+    :param settings: Settings snapshot returned by settings_cache.get_settings.
+    :param items: Name of the list: expense, income (categories) or accounts.
+    :param page: Index of the page (from 0).
+
+    :return: ReplyKeyboardMarkup.
+    """
+    key = (settings["items_version"], items, page)
+    markup = _settings_keyboards.get(key)
+    if markup is None:
+        markup = _settings_keyboards[key] = list_items_keyboard(settings["items"][items], page)
+
+    return markup
+
+
+def get_page(text: typing.Optional[str]) -> typing.Optional[int]:
+    """
+    Returns index of the page (from 0) if the text is a page button of the keyboard.
+
+    :param text: Text of user's message.
+    """
+    match = PAGE_BUTTON.match(text or "")
+    if match is None:
+        return None
+
+    return int(match.group(1) or match.group(2)) - 1
@@ -0,0 +1,119 @@
+"""
+Logging setup. Records are put to a queue and written by a background thread,
+so logging never blocks the event loop, even if stderr is slow.
+"""
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from config import LOG_FORMAT, LOG_LEVEL, LOG_REDACT_USER_IDS, LOG_REDACT_SALT
+
+
+TEXT_FORMAT = "[%(asctime)s][%(name)s][%(levelname)s] %(message)s"
+DATE_FORMAT = "%d-%b-%y %H:%M:%S"
+
+# Attributes of every LogRecord, the others are passed to the log by extra argument.
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which does not format the message in the logging thread: %-arguments
+    are merged with the message by the listener thread. Arguments must not be changed
+    after logging (ids, strings and numbers are passed in the bot).
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def get_extra(record: logging.LogRecord) -> dict:
+    """Returns fields passed to the log by extra argument (user_id, handler...)."""
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+
+
+class TextFormatter(logging.Formatter):
+    """Formats record as text line followed by its extra fields."""
+
+    def __init__(self):
+        super(TextFormatter, self).__init__(TEXT_FORMAT, DATE_FORMAT)
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        line = super(TextFormatter, self).formatMessage(record)
+        extra = get_extra(record)
+        if extra:
+            line += " " + " ".join(f"{key}={value}" for key, value in extra.items())
+
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats record as one JSON line with its extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(get_extra(record))
+
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RedactingFilter(logging.Filter):
+    """Replaces user_id field of records with a pseudonym and drops user's names."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "user_id", None) is not None:
+            record.user_id = redact_user_id(record.user_id)
+
+        for field in ("username", "first_name"):
+            if hasattr(record, field):
+                delattr(record, field)
+
+        return True
+
+
+def redact_user_id(user_id: int) -> str:
+    """
+    Returns pseudonym of the user: the same user always gets the same one,
+    so user's records can be linked without revealing Telegram ID.
+
+    :param user_id: Telegram ID of the user.
+    """
+    return hashlib.sha256(f"{LOG_REDACT_SALT}:{user_id}".encode()).hexdigest()[:12]
+
+
+def setup_logging():
+    """Routes all records through a queue to the listener thread writing them to stderr."""
+    root = logging.getLogger()
+    if any(isinstance(handler, DeferredQueueHandler) for handler in root.handlers):
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter())
+
+    if LOG_REDACT_USER_IDS:
+        stream_handler.addFilter(RedactingFilter())
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+    listener.start()
+    # Writes the rest of records when the bot stops.
+    atexit.register(listener.stop)
+
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(DeferredQueueHandler(records))
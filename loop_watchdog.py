@@ -0,0 +1,100 @@
+"""
+Event loop watchdog. A task measures how late the loop wakes it up (loop lag), and a thread
+checks that the task keeps running. When the loop is stalled longer than LOOP_STALL_THRESHOLD,
+the thread captures the stack of the loop's thread while it is still blocked and logs the
+blocking frame of the bot's code (e.g. google_sheet/transactions.py:write_transactions).
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from background import spawn
+from metrics import Counter, Histogram
+
+
+logger = logging.getLogger("watchdog")
+
+PATH = os.path.abspath(__file__)
+ROOT = os.path.dirname(PATH)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+loop_lag_seconds = Histogram("loop_lag_seconds", "Delay of the event loop waking up the watchdog.", buckets=LAG_BUCKETS)
+loop_stalls = Counter("loop_stalls_total", "Event loop stalls by the blocking frame of the bot's code.", ["location"])
+
+
+def start_watchdog(interval: float, threshold: float) -> asyncio.Task:
+    """
+    Starts watching the running event loop.
+
+    :param interval: Seconds between the checks.
+    :param threshold: Loop blocked longer than threshold seconds is reported as stalled.
+    :return: Task measuring loop lag.
+    """
+    heartbeat = [time.monotonic()]
+
+    thread = threading.Thread(
+        target=_watch,
+        args=(threading.get_ident(), heartbeat, interval, threshold),
+        name="loop-watchdog",
+        daemon=True,
+    )
+    thread.start()
+
+    # spawn keeps the task referenced and logs why it died, otherwise the thread would report false stalls.
+    return spawn(_measure_lag(heartbeat, interval), name="loop_watchdog")
+
+
+async def _measure_lag(heartbeat: list, interval: float):
+    """Measures how late the loop wakes the task up and updates heartbeat for the watching thread."""
+    while True:
+        started_at = time.monotonic()
+        await asyncio.sleep(interval)
+
+        heartbeat[0] = time.monotonic()
+        loop_lag_seconds.observe(max(heartbeat[0] - started_at - interval, 0))
+
+
+def _watch(loop_thread_id: int, heartbeat: list, interval: float, threshold: float):
+    """Reports each stall of the loop once, while it is still blocked."""
+    reported = None
+    while True:
+        time.sleep(interval)
+
+        last_beat = heartbeat[0]
+        if time.monotonic() - last_beat < threshold + interval or reported == last_beat:
+            continue
+
+        frame = sys._current_frames().get(loop_thread_id)
+        if frame is None:
+            # The loop's thread has finished.
+            return
+
+        reported = last_beat
+        stack = traceback.extract_stack(frame)
+        location = get_blocking_location(stack)
+
+        loop_stalls.inc(location=location)
+        logger.warning(
+            "Event loop is blocked for %.2f s at %s:\n%s",
+            time.monotonic() - last_beat,
+            location,
+            "".join(traceback.format_list(stack)),
+        )
+
+
+def get_blocking_location(stack: traceback.StackSummary) -> str:
+    """
+    Returns the innermost frame of the bot's code (not of libraries) as path:function.
+
+    :param stack: Stack of the blocked thread, the innermost frame last.
+    """
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(ROOT + os.sep) and "site-packages" not in path and path != PATH:
+            return f"{os.path.relpath(path, ROOT).replace(os.sep, '/')}:{frame.name}"
+
+    return "unknown"
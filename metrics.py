@@ -0,0 +1,167 @@
+"""
+Bot's metrics in Prometheus text format (served at /metrics).
+
+Metrics are created at module level where they are measured, e.g.
+
+    sheets_requests = Counter("sheets_requests_total", "Requests to Google API.", ["method", "status"])
+    sheets_requests.inc(method="values.append", status="200")
+"""
+import bisect
+import threading
+import typing
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_registry = dict()
+
+
+class Metric:
+    """Base class of metrics. Values are kept per combination of label values."""
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = ()):
+        """
+        :param name: Name of the metric.
+        :param documentation: Description shown in HELP line.
+        :param labelnames: Names of labels.
+
+        :raise ValueError: If metric with the name already exists.
+        """
+        if name in _registry:
+            raise ValueError(f"Metric {name} already exists!")
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._values = dict()
+        # Metrics are updated from threads running Google API requests too.
+        self._lock = threading.Lock()
+
+        _registry[name] = self
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} has labels {self.labelnames} but not {tuple(labels)}!")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, tuple, float]]:
+        """Yields (name suffix, label values, value) of each sample."""
+        with self._lock:
+            values = list(self._values.items())
+
+        for key, value in values:
+            yield "", key, value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key)} {value}")
+
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Value which only grows (number of requests, seconds spent waiting)."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value which may go up and down. It may be computed by function when metrics are rendered."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 function: typing.Callable[[], float] = None):
+        """
+        :param function: Function returning value of the gauge (only for gauge without labels).
+        """
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, tuple, float]]:
+        if self.function is not None:
+            yield "", (), self.function()
+            return
+
+        yield from super(Gauge, self).samples()
+
+
+class Histogram(Metric):
+    """Distribution of values (durations) over buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: typing.Sequence[str] = (),
+                 buckets: typing.Sequence[float] = DEFAULT_BUCKETS):
+        """
+        :param buckets: Upper bounds of buckets.
+        """
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts of buckets (the last one is +Inf) and the sum of values.
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def samples(self) -> typing.Iterator[typing.Tuple[str, tuple, float]]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", key + (_format_value(bound),), cumulative
+
+            yield "_count", key, cumulative
+            yield "_sum", key, counts[-1]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, value in self.samples():
+            labelnames = self.labelnames + ("le",) if suffix == "_bucket" else self.labelnames
+            lines.append(f"{self.name}{suffix}{_format_labels(labelnames, key)} {value}")
+
+        return "\n".join(lines)
+
+
+def render() -> str:
+    """Returns all metrics in Prometheus text format."""
+    return "\n".join(metric.render() for metric in _registry.values()) + "\n"
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + labels + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else str(value)
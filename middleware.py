@@ -1,15 +1,286 @@
 import logging
+import math
+import random
+import time
 
+from aiogram.dispatcher.filters.builtin import StateFilter
+from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram import types
+from cachetools import TTLCache
+
+from config import (
+    LOG_MESSAGES_SAMPLE_RATE,
+    SESSION_TIMEOUT,
+    SETTINGS_CACHE_SIZE,
+    THROTTLING_CACHE_SIZE,
+    THROTTLING_LIMITS,
+)
+from database import get_user
+from keyboards import main_keyboard
+from metrics import Counter, Histogram
+from settings_cache import prefetch_settings
+from throttling import TokenBucket
+from tracing import finish_span, start_span
 
 
 class LoggingMiddleware(BaseMiddleware):
-    """Logs user's message as info."""
-    
+    """Logs LOG_MESSAGES_SAMPLE_RATE share of users' messages as info."""
+
+    logger = logging.getLogger("messages")
+
     def __init__(self) -> None:
         super(LoggingMiddleware, self).__init__()
 
     async def on_process_message(self, message: types.Message, data: dict) -> None:
-        logging.info(f"User ({message.from_user.id}, @{message.from_user.username}, "
-                     f"{message.from_user.first_name}) sent: {message.text}")
+        if random.random() >= LOG_MESSAGES_SAMPLE_RATE:
+            return
+
+        self.logger.info(
+            "User sent: %s",
+            message.text,
+            extra={
+                "user_id": message.from_user.id,
+                "username": message.from_user.username,
+                "first_name": message.from_user.first_name,
+            },
+        )
+
+
+update_seconds = Histogram("bot_update_seconds", "Time of handling updates.")
+handler_seconds = Histogram("bot_handler_seconds", "Latency of handlers by FSM state.", ["handler", "state"])
+throttled_requests = Counter("bot_throttled_requests_total", "Requests rejected by throttling.", ["handler"])
+
+
+def get_handler_name(handler) -> str:
+    """Returns short name of handler (e.g. expenses.get_amount_handler)."""
+    return f"{handler.__module__.rsplit('.', 1)[-1]}.{handler.__name__}"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Measures time of handling updates and latency of each handler."""
+
+    def __init__(self) -> None:
+        super(MetricsMiddleware, self).__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict) -> None:
+        data["update_started_at"] = time.monotonic()
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict) -> None:
+        update_seconds.observe(time.monotonic() - data.pop("update_started_at"))
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        self.start_handler(data)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict) -> None:
+        self.observe_handler(data)
+
+    async def on_process_callback_query(self, call_query: types.CallbackQuery, data: dict) -> None:
+        self.start_handler(data)
+
+    async def on_post_process_callback_query(self, call_query: types.CallbackQuery, results: list,
+                                             data: dict) -> None:
+        self.observe_handler(data)
+
+    @staticmethod
+    def start_handler(data: dict):
+        """Remembers the handler chosen for the update and user's state before it is changed by the handler."""
+        data["handler_metrics"] = (
+            time.monotonic(),
+            get_handler_name(current_handler.get()),
+            StateFilter.ctx_state.get(None) or "",
+        )
+
+    @staticmethod
+    def observe_handler(data: dict):
+        """Measures latency of the handler (no handler was found if there is nothing remembered)."""
+        if "handler_metrics" not in data:
+            return
+
+        started_at, handler, state = data.pop("handler_metrics")
+        handler_seconds.observe(time.monotonic() - started_at, handler=handler, state=state)
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Starts trace of each update and span of the handler chosen for it."""
+
+    def __init__(self) -> None:
+        super(TracingMiddleware, self).__init__()
+
+    async def on_pre_process_update(self, update: types.Update, data: dict) -> None:
+        event = update.message or update.callback_query or update.edited_message
+        data["update_span"] = start_span(
+            "update", update_id=update.update_id, user_id=event.from_user.id if event else None,
+        )
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict) -> None:
+        finish_span(*data.pop("update_span"))
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        self.start_handler(data)
+
+    async def on_post_process_message(self, message: types.Message, results: list, data: dict) -> None:
+        self.finish_handler(data)
+
+    async def on_process_callback_query(self, call_query: types.CallbackQuery, data: dict) -> None:
+        self.start_handler(data, callback_data=call_query.data)
+
+    async def on_post_process_callback_query(self, call_query: types.CallbackQuery, results: list,
+                                             data: dict) -> None:
+        self.finish_handler(data)
+
+    @staticmethod
+    def start_handler(data: dict, **attributes):
+        data["handler_span"] = start_span(
+            "handler",
+            handler=get_handler_name(current_handler.get()),
+            state=StateFilter.ctx_state.get(None),
+            **attributes,
+        )
+
+    @staticmethod
+    def finish_handler(data: dict):
+        if "handler_span" in data:
+            finish_span(*data.pop("handler_span"))
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Limits how often each user may call each handler (token bucket per user and handler).
+    The first rejected request gets a reply telling when to try again, the next ones are ignored.
+    """
+
+    def __init__(self) -> None:
+        super(ThrottlingMiddleware, self).__init__()
+
+        # Idle bucket is full again after a while, so it may be dropped and created anew.
+        self.buckets = TTLCache(maxsize=THROTTLING_CACHE_SIZE, ttl=SESSION_TIMEOUT)
+
+    async def on_process_message(self, message: types.Message, data: dict) -> None:
+        wait = self.throttle(message.from_user.id)
+        if not wait:
+            return
+
+        if wait > 0:
+            message.bot.enqueue(message.chat.id, f"🐢 Не так быстро! Попробуй снова через {math.ceil(wait)} сек.")
+        raise CancelHandler()
+
+    async def on_process_callback_query(self, call_query: types.CallbackQuery, data: dict) -> None:
+        wait = self.throttle(call_query.from_user.id)
+        if not wait:
+            return
+
+        # Callback query must be answered anyway, otherwise the button keeps loading.
+        await call_query.answer(f"🐢 Не так быстро! Попробуй снова через {math.ceil(abs(wait))} сек.")
+        raise CancelHandler()
+
+    def throttle(self, user_id: int) -> float:
+        """
+        Takes a token from user's bucket of the current handler.
+
+        :param user_id: Telegram ID of the user.
+        :return: 0 if the request is allowed, otherwise seconds until the next allowed request
+            (negative if user has already been told about it).
+        """
+        handler = current_handler.get()
+        limit = THROTTLING_LIMITS[getattr(handler, "rate_limit", "default")]
+        if limit is None:
+            return 0
+
+        key = (user_id, f"{handler.__module__}.{handler.__qualname__}")
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*limit)
+
+        wait = bucket.consume()
+        if wait:
+            throttled_requests.inc(handler=get_handler_name(handler))
+
+        if wait and bucket.warned:
+            return -wait
+
+        bucket.warned = bool(wait)
+        return wait
+
+
+class FlowExpiryMiddleware(BaseMiddleware):
+    """Drops expired flow of the user and tells the user about it."""
+
+    def __init__(self) -> None:
+        super(FlowExpiryMiddleware, self).__init__()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict) -> None:
+        await self.check_flow(message.chat.id, message.from_user.id)
+
+    async def on_pre_process_callback_query(self, call_query: types.CallbackQuery, data: dict) -> None:
+        chat_id = call_query.message.chat.id if call_query.message else None
+        await self.check_flow(chat_id, call_query.from_user.id)
+
+    async def check_flow(self, chat_id: int, user_id: int):
+        """
+        Reads user's state once for the whole update and handles expired flow.
+
+        :param chat_id: Telegram ID of the chat (None means the private chat with the user).
+        :param user_id: Telegram ID of the user.
+        """
+        state, expired = await self.manager.dispatcher.storage.get_flow(chat=chat_id, user=user_id)
+
+        # State filters of handlers take the state from here instead of reading the storage again.
+        StateFilter.ctx_state.set(state)
+
+        if expired:
+            self.manager.bot.enqueue(
+                chat_id or user_id,
+                "⌛ Ты долго не отвечал, поэтому я отменил незаконченное действие. Начни заново 🙂",
+                reply_markup=main_keyboard(),
+            )
+
+
+class PrefetchMiddleware(BaseMiddleware):
+    """Starts prefetching user's settings when user starts a flow or a new session."""
+
+    entry_texts = ("расход", "доход", "настройки")
+    entry_commands = {
+        "add_expense", "add_income", "add_account", "change_amount",
+        "delete_account", "add_category", "delete_category", "rename_category",
+    }
+    entry_callbacks = {
+        "continue_expense", "account_settings", "settings_categories", "add_account", "change_amount",
+        "rename_account", "delete_account", "add_category", "delete_category", "rename_category",
+    }
+
+    def __init__(self) -> None:
+        super(PrefetchMiddleware, self).__init__()
+
+        # Users who sent something during the last SESSION_TIMEOUT seconds.
+        self.active_users = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SESSION_TIMEOUT)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict) -> None:
+        text = (message.text or "").lower()
+        is_entry = text.startswith(self.entry_texts) or message.get_command(pure=True) in self.entry_commands
+
+        await self.prefetch(message.from_user.id, is_entry)
+
+    async def on_pre_process_callback_query(self, call_query: types.CallbackQuery, data: dict) -> None:
+        await self.prefetch(call_query.from_user.id, call_query.data in self.entry_callbacks)
+
+    async def prefetch(self, user_id: int, is_entry: bool):
+        """
+        Starts prefetching settings of registered user if it is needed.
+
+        :param user_id: Telegram ID of the user.
+        :param is_entry: Whether the update starts a flow.
+        """
+        is_new_session = user_id not in self.active_users
+        self.active_users[user_id] = True
+
+        if not (is_entry or is_new_session):
+            return
+
+        try:
+            user = await get_user(user_id)
+        except ValueError:
+            return
+
+        if user.gsheet_id:
+            await prefetch_settings(user_id, user.gsheet_id)
@@ -0,0 +1,327 @@
+"""
+Recurring transactions (rent, subscriptions, salary) posted by the bot on a day of each month.
+
+Due transactions of all users of a spreadsheet are written by one request, expenses and incomes
+together. Each spreadsheet has a fixed offset from midnight within RECURRING_WINDOW, so transactions
+due on the same day (e.g. the 1st) are spread over the window instead of hitting Google API at once.
+"""
+import asyncio
+import calendar
+import contextlib
+import datetime
+import logging
+import typing
+import zlib
+
+from sender import ScheduledBot
+
+import journal
+import summary
+from background import run_blocking
+from database import db
+from google_sheet.transactions import get_balance_deltas, write_transactions
+from metrics import Counter
+from settings_cache import get_settings, apply_transactions, invalidate_settings, transaction_lock
+
+
+posted_transactions = Counter(
+    "recurring_transactions_total", "Recurring transactions posted by the bot by type.", ["kind"]
+)
+
+# Transactions missed while the bot was stopped are posted, but not more than this number of each.
+MAX_MISSED = 12
+COLUMNS = "id, user_id, kind, name, amount, category, account, day, next_run"
+# Transactions of users who disconnected the bot from their tables are not posted.
+DUE_QUERY = (
+    "SELECT {}, u.google_sheet_id FROM recurring r JOIN \"user\" u ON u.id = r.user_id "
+    "WHERE r.next_run <= ? AND u.google_sheet_id <> ?"
+).format(", ".join(f"r.{column}" for column in COLUMNS.split(", ")))
+
+
+class RecurringTransaction:
+    """Transaction posted on a day of each month."""
+
+    def __init__(self, item_id: int, user_id: int, kind: str, name: str, amount: float, category: str,
+                 account: str, day: int, next_run: datetime.date):
+        """
+        :param item_id: ID of the recurring transaction.
+        :param user_id: Telegram ID of the user.
+        :param kind: Type of transaction (expense/income).
+        :param name: Name written as the comment (e.g. Аренда).
+        :param amount: Amount of the transaction.
+        :param category: Category of the transaction.
+        :param account: Name of account.
+        :param day: Day of month (the last day of shorter months).
+        :param next_run: Date of the next posting.
+        """
+        self.item_id = item_id
+        self.user_id = user_id
+        self.kind = kind
+        self.name = name
+        self.amount = amount
+        self.category = category
+        self.account = account
+        self.day = day
+        self.next_run = next_run
+
+    def to_entry(self, date: datetime.date) -> dict:
+        """
+        Returns entry written to the transactions table.
+
+        :param date: Scheduled date of the posting (a missed posting keeps its date).
+        """
+        return {
+            "amount": self.amount,
+            "category": self.category,
+            "account": self.account,
+            "comment": self.name,
+            "date": date.isoformat(),
+        }
+
+
+def get_date(year: int, month: int, day: int) -> datetime.date:
+    """Returns the day of the month or the last day of the month if it is shorter."""
+    return datetime.date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def get_next_date(date: datetime.date, day: int) -> datetime.date:
+    """
+    Returns the day in the month after the date.
+
+    :param date: Date of the last posting.
+    :param day: Day of month.
+    """
+    if date.month == 12:
+        return get_date(date.year + 1, 1, day)
+
+    return get_date(date.year, date.month + 1, day)
+
+
+def get_first_date(day: int, today: datetime.date) -> datetime.date:
+    """Returns the first posting date of the new recurring transaction (today or later)."""
+    date = get_date(today.year, today.month, day)
+    return date if date >= today else get_next_date(date, day)
+
+
+def get_offset(gsheet_id: str, window: float) -> float:
+    """
+    Returns seconds after midnight when transactions of the spreadsheet are posted.
+    The offset does not change between restarts.
+
+    :param gsheet_id: ID of Google sheet.
+    :param window: Seconds after midnight over which spreadsheets are spread.
+    """
+    return zlib.crc32(gsheet_id.encode()) % max(int(window), 1)
+
+
+def _from_row(row: tuple) -> RecurringTransaction:
+    item_id, user_id, kind, name, amount, category, account, day, next_run = row
+    return RecurringTransaction(
+        item_id, user_id, kind, name, amount, category, account, day, datetime.date.fromisoformat(next_run)
+    )
+
+
+async def add(user_id: int, kind: str, name: str, amount: float, category: str, account: str, day: int):
+    """
+    Adds recurring transaction. It is posted first on the nearest day (today or later).
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transaction (expense/income).
+    :param name: Name written as the comment.
+    :param amount: Amount of the transaction.
+    :param category: Category of the transaction.
+    :param account: Name of account.
+    :param day: Day of month.
+    """
+    await db.execute(
+        "INSERT INTO recurring (user_id, kind, name, amount, category, account, day, next_run) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        user_id,
+        kind,
+        name,
+        amount,
+        category,
+        account,
+        day,
+        get_first_date(day, datetime.date.today()).isoformat(),
+    )
+
+
+async def get_user_items(user_id: int) -> typing.List[RecurringTransaction]:
+    """
+    Returns recurring transactions of the user.
+
+    :param user_id: Telegram ID of the user.
+    """
+    rows = await db.fetchall(f"SELECT {COLUMNS} FROM recurring WHERE user_id = ? ORDER BY day, id", user_id)
+    return [_from_row(row) for row in rows]
+
+
+async def delete(user_id: int, item_id: int):
+    """
+    Deletes recurring transaction of the user.
+
+    :param user_id: Telegram ID of the user.
+    :param item_id: ID of the recurring transaction.
+    """
+    await db.execute("DELETE FROM recurring WHERE user_id = ? AND id = ?", user_id, item_id)
+
+
+async def post_due(gsheet_id: str, items_by_user: typing.Dict[int, typing.List[RecurringTransaction]],
+                   today: datetime.date) -> typing.Dict[int, tuple]:
+    """
+    Writes due transactions of all users of the spreadsheet by one request.
+    The request is made with the settings snapshot of the first user, snapshots of the others
+    are refetched and their summaries rebuilt, because the rows and balances have changed.
+
+    :param gsheet_id: ID of Google sheet.
+    :param items_by_user: Due recurring transactions by Telegram ID of the user.
+    :param today: Current date.
+    :return: Tuples (posted, skipped) by Telegram ID of the user: posted transactions (once per posting)
+        and skipped ones (their account was deleted).
+    """
+    users = sorted(items_by_user)
+    async with contextlib.AsyncExitStack() as stack:
+        # Locks are taken in the same order by every caller.
+        for user_id in users:
+            await stack.enter_async_context(transaction_lock(user_id))
+
+        owner = users[0]
+        settings = await get_settings(owner)
+        if settings["gsheet_id"] != gsheet_id:
+            # The user connected another table meanwhile, the items are posted by the next run.
+            invalidate_settings(owner)
+            return dict()
+
+        results = dict()
+        next_runs = dict()
+        # Entries of the same user and type are adjacent, so each user's part is one commit in the journal.
+        slices = []  # (user_id, kind, entries)
+        for user_id in users:
+            posted, skipped = [], []
+            entries_by_kind = dict()
+            for item in items_by_user[user_id]:
+                next_run = item.next_run
+                postings = 0
+                while next_run <= today:
+                    if postings < MAX_MISSED:
+                        if item.account.lower() in settings["accounts"]:
+                            entries_by_kind.setdefault(item.kind, []).append(item.to_entry(next_run))
+                            posted.append(item)
+                        else:
+                            skipped.append(item)
+                        postings += 1
+                    next_run = get_next_date(next_run, item.day)
+                next_runs[item.item_id] = next_run
+
+            results[user_id] = (posted, skipped)
+            slices.extend((user_id, kind, entries) for kind, entries in entries_by_kind.items())
+
+        entries_by_kind = dict()
+        for _, kind, entries in slices:
+            entries_by_kind.setdefault(kind, []).extend(entries)
+
+        if entries_by_kind:
+            changes = None
+            for kind, entries in entries_by_kind.items():
+                changes = await summary.plan_changes(
+                    owner, settings, kind, summary.get_amounts(entries, today), changes
+                )
+
+            deltas_by_kind = await run_blocking(
+                write_transactions,
+                entries_by_kind,
+                gsheet_id=settings["gsheet_id"],
+                sheet_ids=settings["sheet_ids"],
+                account_names=settings["account_names"],
+                accounts=settings["accounts"],
+                summary=changes,
+            )
+
+            positions = {kind: settings[f"total_{kind}s"] for kind in entries_by_kind}
+            for kind, deltas in deltas_by_kind.items():
+                apply_transactions(owner, kind, len(entries_by_kind[kind]), deltas)
+                posted_transactions.inc(len(entries_by_kind[kind]), kind=kind)
+            await summary.save_changes(owner, changes)
+
+            for user_id, kind, entries in slices:
+                await journal.record(user_id, kind, positions[kind], entries, get_balance_deltas(kind, entries))
+                positions[kind] += len(entries)
+
+            for user_id in users[1:]:
+                invalidate_settings(user_id)
+                await summary.forget(user_id)
+
+        for item_id, next_run in next_runs.items():
+            await db.execute("UPDATE recurring SET next_run = ? WHERE id = ?", next_run.isoformat(), item_id)
+
+    return results
+
+
+def format_notification(posted: typing.List[RecurringTransaction],
+                        skipped: typing.List[RecurringTransaction]) -> str:
+    """Returns message about posted recurring transactions."""
+    lines = []
+    if posted:
+        lines.append("Добавлены регулярные записи 🔁\n")
+        lines.extend(
+            f"{'+' if item.kind == 'income' else '-'}{item.amount:g} — {item.name} ({item.category}, {item.account})"
+            for item in posted
+        )
+    if skipped:
+        if lines:
+            lines.append("")
+        lines.append("Не добавлены, потому что счета больше нет:")
+        lines.extend(f"{item.name} ({item.account})" for item in skipped)
+
+    return "\n".join(lines)
+
+
+async def post_recurring_periodically(bot: ScheduledBot, interval: float, window: float,
+                                      owns: typing.Callable[[int], bool] = None):
+    """
+    Periodically posts due recurring transactions.
+
+    :param bot: Bot object (users are notified about posted transactions).
+    :param interval: Seconds between checks.
+    :param window: Seconds after midnight over which spreadsheets are spread.
+    :param owns: Returns True for users handled by this process (all users if None).
+        A spreadsheet is handled by the process of its first user.
+    """
+    while True:
+        await asyncio.sleep(interval)
+
+        now = datetime.datetime.now()
+        today = now.date()
+        seconds = (now - datetime.datetime.combine(today, datetime.time())).total_seconds()
+
+        try:
+            rows = await db.fetchall(DUE_QUERY, today.isoformat(), "")
+        except Exception as exc:
+            logging.error("Exception during reading recurring transactions!", exc_info=exc)
+            continue
+
+        items_by_sheet = dict()
+        for row in rows:
+            item = _from_row(row[:-1])
+            items_by_sheet.setdefault(row[-1], dict()).setdefault(item.user_id, []).append(item)
+
+        for gsheet_id, items_by_user in items_by_sheet.items():
+            if owns is not None and not owns(min(items_by_user)):
+                continue
+            # Transactions of today wait for the spreadsheet's turn in the window.
+            if seconds < get_offset(gsheet_id, window) and all(
+                item.next_run == today for items in items_by_user.values() for item in items
+            ):
+                continue
+
+            try:
+                results = await post_due(gsheet_id, items_by_user, today)
+            except Exception as exc:
+                logging.error("Exception during posting recurring transactions!", exc_info=exc)
+                continue
+
+            for user_id, (posted, skipped) in results.items():
+                if posted or skipped:
+                    # Sent through the chat's queue like any other reply, errors are logged by the bot.
+                    bot.enqueue(user_id, format_notification(posted, skipped))
@@ -0,0 +1,207 @@
+"""
+Outbound requests to Telegram. Telegram allows about 30 messages per second in total
+and about one message per second to a chat, exceeding the limits ends with 429 errors.
+
+ScheduledBot puts every request addressed to a chat (sending, editing, deleting messages)
+to the queue of the chat. Queues are drained in order by background tasks which pace
+requests by a global and a per-chat token bucket and wait when Telegram asks to retry
+later, so handlers never get flood control errors. All bots of the process share one
+scheduler, so requests to a chat keep their order whichever bot object sends them.
+
+Handlers which do not need the sent message queue it by ScheduledBot.enqueue and go on
+without waiting for pacing and retries.
+"""
+import asyncio
+import collections
+import logging
+import typing
+
+from aiogram import Bot
+from aiogram.bot import api
+from aiogram.utils.payload import generate_payload, prepare_arg
+from aiogram.utils.exceptions import RetryAfter
+from cachetools import TTLCache
+
+from background import spawn
+from config import (
+    SEND_GLOBAL_RATE,
+    SEND_GLOBAL_BURST,
+    SEND_CHAT_RATE,
+    SEND_CHAT_BURST,
+    SEND_CHAT_BUCKETS,
+    SEND_MAX_RETRIES,
+    WORKERS,
+)
+from metrics import Counter, Gauge
+from throttling import TokenBucket
+
+
+telegram_requests = Counter("telegram_requests_total", "Requests to chats sent to Telegram API by method.", ["method"])
+telegram_retries = Counter(
+    "telegram_retries_total", "Requests to Telegram API repeated after flood control error.", ["method"]
+)
+
+
+class Job:
+    """Request waiting in the queue of the chat."""
+
+    def __init__(self, method: str, send: typing.Callable[[], typing.Awaitable], future: asyncio.Future):
+        self.method = method
+        self.send = send
+        self.future = future
+        self.attempts = 0
+
+
+class MessageScheduler:
+    """Per-chat FIFO queues of requests drained with global and per-chat rate limits."""
+
+    def __init__(self, rate: float, burst: float, chat_rate: float, chat_burst: float):
+        """
+        :param rate: Requests per second to all chats.
+        :param burst: Max burst of requests to all chats.
+        :param chat_rate: Requests per second to one chat.
+        :param chat_burst: Max burst of requests to one chat.
+        """
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+
+        self._bucket = TokenBucket(rate, burst)
+        self._queues: typing.Dict[int, typing.Deque[Job]] = dict()
+        # Bucket of a chat idle for chat_burst / chat_rate seconds is full again, so it is not kept longer.
+        self._chat_buckets = TTLCache(maxsize=SEND_CHAT_BUCKETS, ttl=chat_burst / chat_rate + 1)
+
+    def queued(self) -> int:
+        """Returns number of requests waiting in the queues."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    def enqueue(self, chat_id: int, method: str, send: typing.Callable[[], typing.Awaitable]) -> Job:
+        """
+        Puts request to the queue of the chat without waiting until it is sent.
+
+        :param chat_id: ID of the chat.
+        :param method: Name of API method (for metrics).
+        :param send: Function which makes the request.
+        :return: Job whose future gets result of the request.
+        """
+        job = Job(method, send, asyncio.get_running_loop().create_future())
+
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = collections.deque()
+            spawn(self._drain(chat_id, queue), name="send", user_id=chat_id)
+        queue.append(job)
+
+        return job
+
+    async def submit(self, chat_id: int, method: str, send: typing.Callable[[], typing.Awaitable]):
+        """
+        Puts request to the queue of the chat and waits until it is sent.
+
+        :param chat_id: ID of the chat.
+        :param method: Name of API method (for metrics).
+        :param send: Function which makes the request.
+        :return: Result of the request.
+        """
+        job = self.enqueue(chat_id, method, send)
+
+        # The request is sent even if the handler is cancelled, so the order of messages is kept.
+        return await asyncio.shield(job.future)
+
+    async def _drain(self, chat_id: int, queue: typing.Deque[Job]):
+        """Sends requests of the chat one by one until the queue is empty."""
+        chat_bucket = self._chat_buckets.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+
+        try:
+            while queue:
+                job = queue[0]
+                await _take(chat_bucket)
+                await _take(self._bucket)
+
+                job.attempts += 1
+                telegram_requests.inc(method=job.method)
+                try:
+                    result = await job.send()
+                except RetryAfter as exc:
+                    if job.attempts <= SEND_MAX_RETRIES:
+                        telegram_retries.inc(method=job.method)
+                        logging.warning("Flood control of chat, retry in %s s", exc.timeout, extra={"user_id": chat_id})
+                        await asyncio.sleep(exc.timeout)
+                        continue
+
+                    job.future.set_exception(exc)
+                except Exception as exc:
+                    job.future.set_exception(exc)
+                else:
+                    job.future.set_result(result)
+
+                queue.popleft()
+
+        finally:
+            del self._queues[chat_id]
+            self._chat_buckets[chat_id] = chat_bucket
+
+            for job in queue:
+                if not job.future.done():
+                    job.future.cancel()
+
+
+async def _take(bucket: TokenBucket):
+    """Waits until the bucket has a token and takes it."""
+    wait = bucket.consume()
+    while wait:
+        await asyncio.sleep(wait)
+        wait = bucket.consume()
+
+
+def _log_failure(future: asyncio.Future):
+    """Logs error of the queued request which nobody waits for."""
+    if not future.cancelled() and future.exception() is not None:
+        logging.error("Exception during sending queued message!", exc_info=future.exception())
+
+
+# Each worker process sends its share of the global limit.
+_workers = max(WORKERS, 1)
+scheduler = MessageScheduler(
+    SEND_GLOBAL_RATE / _workers, max(SEND_GLOBAL_BURST / _workers, 1), SEND_CHAT_RATE, SEND_CHAT_BURST
+)
+Gauge("telegram_queued_requests", "Requests waiting in chats' queues.", function=scheduler.queued)
+
+
+class ScheduledBot(Bot):
+    """Bot which sends requests addressed to chats through the scheduler of the process."""
+
+    def enqueue(self, chat_id: int, text: str, parse_mode: str = None, reply_markup=None) -> Job:
+        """
+        Queues message to the chat and returns at once, errors of sending are logged.
+        Used instead of send_message when the sent message is not needed.
+
+        :param chat_id: ID of the chat.
+        :param text: Text of the message.
+        :param parse_mode: Parse mode of the text.
+        :param reply_markup: Keyboard of the message.
+        :return: Job whose future gets the sent message as dict.
+        """
+        payload = generate_payload(
+            chat_id=chat_id, text=text, parse_mode=parse_mode, reply_markup=prepare_arg(reply_markup)
+        )
+        if self.parse_mode:
+            payload.setdefault("parse_mode", self.parse_mode)
+
+        async def send():
+            return await super(ScheduledBot, self).request(api.Methods.SEND_MESSAGE, payload)
+
+        job = scheduler.enqueue(chat_id, api.Methods.SEND_MESSAGE, send)
+        job.future.add_done_callback(_log_failure)
+        return job
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        chat_id = (data or {}).get("chat_id")
+        if chat_id is None:
+            return await super(ScheduledBot, self).request(method, data, files, **kwargs)
+
+        async def send():
+            return await super(ScheduledBot, self).request(method, data, files, **kwargs)
+
+        return await scheduler.submit(chat_id, method, send)
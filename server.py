@@ -1,29 +1,72 @@
+import asyncio
 import logging
+import signal
 
 from random import choice
 
-from aiogram import Dispatcher, executor, Bot, types
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-
-from config import TELEGRAM_TOKEN
+from aiogram import Dispatcher, executor, types
+
+from archiver import archive_periodically
+from background import spawn
+from callbacks import RoutingDispatcher
+from config import (
+    TELEGRAM_TOKEN,
+    FSM_STORAGE,
+    FSM_MAX_FLOWS,
+    FSM_SWEEP_INTERVAL,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_KEEP_YEARS,
+    RECURRING_INTERVAL,
+    RECURRING_WINDOW,
+    BOT_MODE,
+    SKIP_UPDATES,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    WEBAPP_HOST,
+    WEBAPP_PORT,
+    WEBHOOK_CONCURRENCY,
+    WORKERS,
+    SHARD_VNODES,
+    METRICS_PORT,
+    LOOP_WATCHDOG_INTERVAL,
+    LOOP_STALL_THRESHOLD,
+)
+from database import db
+from logs import setup_logging
+from loop_watchdog import start_watchdog
+from fsm_storage import DatabaseStorage, MemoryFlowStorage, sweep_flows
 from keyboards import register_keyboard
-from middleware import LoggingMiddleware
-
+from middleware import (
+    FlowExpiryMiddleware,
+    LoggingMiddleware,
+    MetricsMiddleware,
+    PrefetchMiddleware,
+    ThrottlingMiddleware,
+    TracingMiddleware,
+)
+from recurring import post_recurring_periodically
+from sender import ScheduledBot
+from sharding import HashRing, ShardingDispatcher, consume_updates, start_workers
+from storage.migrations import migrate
+from webapp import WebhookHandler, create_app, start_service_server
 
-bot = Bot(TELEGRAM_TOKEN)
-dp = Dispatcher(bot, storage=MemoryStorage())
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(asctime)s][%(name)s][%(levelname)s] %(message)s",
-    datefmt="%d-%b-%y %H:%M:%S",
+bot = ScheduledBot(TELEGRAM_TOKEN)
+dp = RoutingDispatcher(
+    bot,
+    storage=DatabaseStorage(db, FSM_MAX_FLOWS) if FSM_STORAGE == "database" else MemoryFlowStorage(FSM_MAX_FLOWS),
 )
 
+setup_logging()
+
 
 @dp.message_handler(commands=['start'])
 async def start_cmd(message: types.Message):
     """Handler called when user send /start"""
-    await message.answer(
+    bot.enqueue(
+        message.chat.id,
         "Привет! 🤠\n"
         "Я бот для учета расходов/доходов💰\n"
         "Я помогу тебе вести учет финансов в Google таблицах, "
@@ -36,27 +79,163 @@ async def start_cmd(message: types.Message):
     )
 
 
+async def on_startup(dispatcher: Dispatcher):
+    """Prepares the database before the bot starts receiving updates."""
+    if LOOP_WATCHDOG_INTERVAL:
+        start_watchdog(LOOP_WATCHDOG_INTERVAL, LOOP_STALL_THRESHOLD)
+
+    await migrate(db)
+
+    # In multi-process mode flows are kept and swept by workers.
+    if not isinstance(dispatcher, ShardingDispatcher):
+        spawn(sweep_flows(dispatcher.storage, FSM_SWEEP_INTERVAL), name="sweep_flows")
+        if ARCHIVE_INTERVAL:
+            spawn(archive_periodically(ARCHIVE_INTERVAL, ARCHIVE_KEEP_YEARS), name="archive")
+        if RECURRING_INTERVAL:
+            spawn(
+                post_recurring_periodically(dispatcher.bot, RECURRING_INTERVAL, RECURRING_WINDOW),
+                name="recurring",
+            )
+
+    if BOT_MODE == "webhook":
+        # Webhook is not deleted on shutdown, so Telegram keeps updates sent during restart.
+        await dispatcher.bot.set_webhook(
+            WEBHOOK_HOST + WEBHOOK_PATH,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            drop_pending_updates=SKIP_UPDATES,
+            secret_token=WEBHOOK_SECRET or None,
+        )
+    elif METRICS_PORT:
+        dispatcher["service_runner"] = await start_service_server(WEBAPP_HOST, METRICS_PORT)
+
+
+async def on_shutdown(dispatcher: Dispatcher):
+    """Stops service endpoints and closes connections to the database."""
+    if "service_runner" in dispatcher:
+        await dispatcher["service_runner"].cleanup()
+
+    await db.close()
+
+
 async def autoresponder_handler(message: types.Message):
     """Send response to any message not covered by other handlers."""
     gnomes = ['Фили', 'Кили', 'Оин', 'Глоин', 'Двалин', 'Балин', 'Бифур',
               'Бофур', 'Бомбур', 'Дори', 'Нори', 'Ори', 'Торин']
-    await message.answer(f"{choice(gnomes).title()} к вашим услугам!")
+    bot.enqueue(message.chat.id, f"{choice(gnomes).title()} к вашим услугам!")
 
 
-if __name__ == '__main__':
+def setup_dispatcher(dispatcher: Dispatcher):
+    """Sets up middlewares and handlers of the dispatcher which handles updates."""
+    from handlers.admin import register_admin_handlers
     from handlers.registration import register_registration_handlers
     from handlers.expenses import register_expences_handlers
     from handlers.incomes import register_incomes_handlers
+    from handlers.batch import register_batch_handlers
+    from handlers.split import register_split_handlers
+    from handlers.undo import register_undo_handlers
+    from handlers.budget import register_budget_handlers
+    from handlers.recurring import register_recurring_handlers
     from handlers.settings.settings import register_settings_handlers
 
-    dp.middleware.setup(LoggingMiddleware())
-
-    register_registration_handlers(dp)
-    register_settings_handlers(dp)
-    register_expences_handlers(dp)
-    register_incomes_handlers(dp)
+    dispatcher.middleware.setup(TracingMiddleware())
+    dispatcher.middleware.setup(MetricsMiddleware())
+    dispatcher.middleware.setup(LoggingMiddleware())
+    dispatcher.middleware.setup(FlowExpiryMiddleware())
+    dispatcher.middleware.setup(PrefetchMiddleware())
+    dispatcher.middleware.setup(ThrottlingMiddleware())
+
+    register_admin_handlers(dispatcher)
+    register_registration_handlers(dispatcher)
+    register_settings_handlers(dispatcher)
+    register_expences_handlers(dispatcher)
+    register_incomes_handlers(dispatcher)
+    register_batch_handlers(dispatcher)
+    register_split_handlers(dispatcher)
+    register_undo_handlers(dispatcher)
+    register_budget_handlers(dispatcher)
+    register_recurring_handlers(dispatcher)
+
+    dispatcher.register_message_handler(autoresponder_handler)
+
+
+def run_worker(index: int, queue):
+    """
+    Runs worker process which handles updates sent by the ingress process.
+
+    :param index: Index of the worker.
+    :param queue: Queue of updates of the worker.
+    """
+    # Ctrl+C stops the ingress, which then tells workers to stop after handling sent updates.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    logging.info("Worker %s started", index)
+    setup_dispatcher(dp)
+
+    async def work():
+        spawn(sweep_flows(dp.storage, FSM_SWEEP_INTERVAL), name="sweep_flows")
+        # Each worker archives and posts recurring transactions of the users whose writes it handles.
+        ring = HashRing(range(WORKERS), SHARD_VNODES)
+
+        def owns(user_id: int) -> bool:
+            return ring.get_node(user_id) == index
+
+        if ARCHIVE_INTERVAL:
+            spawn(archive_periodically(ARCHIVE_INTERVAL, ARCHIVE_KEEP_YEARS, owns), name="archive")
+        if RECURRING_INTERVAL:
+            spawn(
+                post_recurring_periodically(dp.bot, RECURRING_INTERVAL, RECURRING_WINDOW, owns),
+                name="recurring",
+            )
+        if LOOP_WATCHDOG_INTERVAL:
+            start_watchdog(LOOP_WATCHDOG_INTERVAL, LOOP_STALL_THRESHOLD)
+        if METRICS_PORT:
+            dp["service_runner"] = await start_service_server(WEBAPP_HOST, METRICS_PORT + index + 1)
+
+        try:
+            await consume_updates(dp, queue, WEBHOOK_CONCURRENCY)
+        finally:
+            await on_shutdown(dp)
+            await dp.storage.close()
+            await (await bot.get_session()).close()
+
+    asyncio.run(work())
+    logging.info("Worker %s stopped", index)
+
+
+def run(dispatcher: Dispatcher):
+    """
+    Receives updates in BOT_MODE until the bot is stopped.
+
+    :param dispatcher: Dispatcher which handles updates (or sends them to workers).
+    """
+    if BOT_MODE == "webhook":
+        bot_executor = executor.Executor(dispatcher)
+        bot_executor.on_startup(on_startup)
+        bot_executor.on_shutdown(on_shutdown)
+        bot_executor.set_webhook(WEBHOOK_PATH, request_handler=WebhookHandler, web_app=create_app())
+        bot_executor.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
+    elif BOT_MODE == "polling":
+        executor.start_polling(dispatcher, skip_updates=SKIP_UPDATES, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        raise ValueError(f"BOT_MODE must be polling or webhook but not {BOT_MODE}!")
+
+
+def main():
+    """Starts the bot in one process or, if WORKERS > 1, with worker processes."""
+    if WORKERS <= 1:
+        setup_dispatcher(dp)
+        run(dp)
+        return
+
+    processes, queues = start_workers(run_worker, WORKERS)
+    ingress = ShardingDispatcher(bot, queues, vnodes=SHARD_VNODES)
+    try:
+        run(ingress)
+    finally:
+        ingress.stop_workers()
+        for process in processes:
+            process.join()
 
-    dp.register_message_handler(autoresponder_handler)
-
-    executor.start_polling(dp, skip_updates=True)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+Cache of users' settings snapshots (categories, accounts, number of transactions).
+
+Snapshot is prefetched in background as soon as user starts a flow, so by the time
+the user answers the first question it is usually already in the cache.
+"""
+import asyncio
+import itertools
+import time
+import weakref
+
+from cachetools import TTLCache
+
+import database
+from background import run_blocking, spawn
+from config import SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SETTINGS_MAX_AGE
+from google_sheet.settings import fetch_settings
+from metrics import Counter, Gauge
+
+
+_snapshots = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+_fetching = dict()
+_versions = itertools.count(1)
+_transaction_locks = weakref.WeakValueDictionary()
+
+# hit: snapshot was in the cache, wait: it was being prefetched, miss: it had to be fetched.
+settings_cache_lookups = Counter(
+    "settings_cache_lookups_total", "Lookups of users' settings snapshots by result.", ["result"]
+)
+Gauge("settings_cache_size", "Number of users' settings snapshots in the cache.", function=lambda: len(_snapshots))
+
+
+async def prefetch_settings(user_id: int, gsheet_id: str = None, max_age: float = SETTINGS_MAX_AGE):
+    """
+    Starts fetching user's settings in background if there is no fresh snapshot in the cache.
+
+    :param user_id: Telegram ID of the user.
+    :param gsheet_id: ID of user's Google sheet (taken from the database if not passed).
+    :param max_age: Snapshot older than max_age seconds is fetched again.
+    """
+    if user_id in _fetching:
+        return
+
+    snapshot = _snapshots.get(user_id)
+    if snapshot is not None and time.monotonic() - snapshot["fetched_at"] < max_age:
+        return
+
+    if gsheet_id is None:
+        gsheet_id = await database.get_gsheet_id(user_id)
+
+    _start_fetching(user_id, gsheet_id)
+
+
+async def get_settings(user_id: int) -> dict:
+    """
+    Returns user's settings snapshot. Waits for prefetching if it is still running.
+
+    :param user_id: Telegram ID of the user.
+    :return: Dict with gsheet_id, categories, account_names, accounts, total_expenses, total_incomes
+        and sorted items for keyboards (see keyboards.settings_keyboard).
+    """
+    task = _fetching.get(user_id)
+    if task is None:
+        snapshot = _snapshots.get(user_id)
+        if snapshot is not None:
+            settings_cache_lookups.inc(result="hit")
+            return snapshot
+
+        settings_cache_lookups.inc(result="miss")
+        gsheet_id = await database.get_gsheet_id(user_id)
+        task = _fetching.get(user_id) or _start_fetching(user_id, gsheet_id)
+    else:
+        settings_cache_lookups.inc(result="wait")
+
+    # Other handlers may wait for the same task, so it must not be cancelled with this one.
+    return await asyncio.shield(task)
+
+
+def apply_transaction(user_id: int, kind: str, account: str, amount: float):
+    """
+    Updates cached snapshot after the bot added a transaction to user's Google sheet,
+    so the next transaction does not need to read the sheet again.
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transaction (expense/income).
+    :param account: Name of account.
+    :param amount: Amount of transaction.
+
+    :raise ValueError: If kind is not expense or income.
+    """
+    apply_transactions(user_id, kind, 1, {account.lower(): amount if kind == "income" else -amount})
+
+
+def apply_transactions(user_id: int, kind: str, count: int, deltas: dict):
+    """
+    Updates cached snapshot after the bot added several transactions by one request.
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transactions (expense/income).
+    :param count: Number of added transactions.
+    :param deltas: Changes of balances by lowercase account name.
+
+    :raise ValueError: If kind is not expense or income.
+    """
+    if kind not in ["expense", "income"]:
+        raise ValueError(f"kind must be expense or income but not {kind}!")
+
+    # Fetching started before the transaction would put an outdated snapshot to the cache.
+    _fetching.pop(user_id, None)
+
+    snapshot = _snapshots.get(user_id)
+    if snapshot is None:
+        return
+
+    if any(account not in snapshot["accounts"] for account in deltas):
+        invalidate_settings(user_id)
+        return
+
+    snapshot[f"total_{kind}s"] += count
+    for account, delta in deltas.items():
+        snapshot["accounts"][account]["amount"] += delta
+    snapshot["version"] = next(_versions)
+
+
+def transaction_lock(user_id: int) -> asyncio.Lock:
+    """
+    Returns lock which must be held while a transaction is written to user's Google sheet
+    and applied to the snapshot: the row of the transaction is computed from the snapshot.
+
+    :param user_id: Telegram ID of the user.
+    """
+    lock = _transaction_locks.get(user_id)
+    if lock is None:
+        lock = _transaction_locks[user_id] = asyncio.Lock()
+
+    return lock
+
+
+def invalidate_settings(user_id: int):
+    """
+    Drops user's snapshot from the cache. Must be called after changing user's settings.
+
+    :param user_id: Telegram ID of the user.
+    """
+    _fetching.pop(user_id, None)
+    _snapshots.pop(user_id, None)
+
+
+def _start_fetching(user_id: int, gsheet_id: str) -> asyncio.Task:
+    """Starts background task fetching user's settings."""
+    task = spawn(_fetch(user_id, gsheet_id), name="fetch_settings", user_id=user_id)
+    _fetching[user_id] = task
+
+    return task
+
+
+async def _fetch(user_id: int, gsheet_id: str) -> dict:
+    """Fetches user's settings from Google sheet and puts them to the cache."""
+    task = asyncio.current_task()
+    try:
+        snapshot = await run_blocking(fetch_settings, gsheet_id)
+        snapshot["fetched_at"] = time.monotonic()
+        snapshot["version"] = next(_versions)
+        # Sorted lists for keyboards. Transactions do not change them, so they keep items_version.
+        snapshot["items"] = {
+            "expense": tuple(sorted(snapshot["categories"]["expense"])),
+            "income": tuple(sorted(snapshot["categories"]["income"])),
+            "accounts": tuple(sorted(snapshot["account_names"])),
+        }
+        snapshot["items_version"] = snapshot["version"]
+
+        # The snapshot was invalidated while it was being fetched.
+        if _fetching.get(user_id) is task:
+            _snapshots[user_id] = snapshot
+
+        return snapshot
+
+    finally:
+        if _fetching.get(user_id) is task:
+            del _fetching[user_id]
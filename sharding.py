@@ -0,0 +1,142 @@
+"""
+Multi-process mode. One ingress process receives updates (polling or webhook) and routes
+each of them to one of WORKERS worker processes chosen by consistent hashing of the user's ID.
+So all updates of a user are handled by the same worker: user's flow and the order of writes
+to user's Google sheet stay within one process, and adding a worker moves only a small part of users.
+"""
+import asyncio
+import bisect
+import hashlib
+import multiprocessing
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import Bot, Dispatcher, types
+
+from background import spawn
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes."""
+
+    def __init__(self, nodes: typing.Sequence[int], vnodes: int = 100):
+        """
+        :param nodes: Nodes (indexes of workers).
+        :param vnodes: Number of points of each node on the ring, more points spread keys more evenly.
+        """
+        points = sorted((self._hash(f"{node}:{vnode}"), node) for node in nodes for vnode in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get_node(self, key: int) -> int:
+        """
+        Returns node which the key belongs to.
+
+        :param key: Key (e.g. Telegram ID of the user).
+        """
+        index = bisect.bisect(self._hashes, self._hash(str(key))) % len(self._hashes)
+        return self._nodes[index]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+def get_user_id(update: dict) -> int:
+    """
+    Returns ID of the user who sent the update (0 if the update has no user, e.g. channel post).
+
+    :param update: Update as it is received from Telegram.
+    """
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get("from") or value.get("user")
+            if user:
+                return user["id"]
+
+    return 0
+
+
+class ShardingDispatcher(Dispatcher):
+    """Dispatcher of the ingress process which sends updates to workers instead of handling them."""
+
+    def __init__(self, bot: Bot, queues: typing.Sequence[multiprocessing.Queue], vnodes: int = 100, **kwargs):
+        """
+        :param bot: Bot object.
+        :param queues: Queues of updates of workers.
+        :param vnodes: Number of points of each worker on the hash ring.
+        """
+        super(ShardingDispatcher, self).__init__(bot, **kwargs)
+        self.queues = queues
+        self.ring = HashRing(range(len(queues)), vnodes)
+
+    async def process_update(self, update: types.Update):
+        raw_update = update.to_python()
+        worker = self.ring.get_node(get_user_id(raw_update))
+        self.queues[worker].put(raw_update)
+
+    def stop_workers(self):
+        """Tells workers to stop after handling updates which are already sent to them."""
+        for queue in self.queues:
+            queue.put(None)
+
+
+def start_workers(target: typing.Callable, count: int) -> typing.Tuple[list, list]:
+    """
+    Starts worker processes.
+
+    :param target: Function run by worker, it gets index of the worker and its queue of updates.
+    :param count: Number of workers.
+    :return: Processes and their queues.
+    """
+    # Worker is started from scratch, it does not inherit threads and connections of the ingress.
+    context = multiprocessing.get_context("spawn")
+
+    processes, queues = [], []
+    for index in range(count):
+        queue = context.Queue()
+        process = context.Process(target=target, args=(index, queue), name=f"worker-{index}", daemon=True)
+        process.start()
+
+        processes.append(process)
+        queues.append(queue)
+
+    return processes, queues
+
+
+async def consume_updates(dispatcher: Dispatcher, queue: multiprocessing.Queue, concurrency: int):
+    """
+    Handles updates sent to the worker until the ingress tells it to stop.
+
+    :param dispatcher: Dispatcher of the worker.
+    :param queue: Queue of updates of the worker.
+    :param concurrency: Max number of updates handled at once.
+    """
+    Dispatcher.set_current(dispatcher)
+    Bot.set_current(dispatcher.bot)
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    # queue.get blocks, so it is called in a separate thread.
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="updates") as reader:
+        while True:
+            raw_update = await loop.run_in_executor(reader, queue.get)
+            if raw_update is None:
+                break
+
+            await semaphore.acquire()
+            spawn(_handle_update(dispatcher, types.Update(**raw_update), semaphore))
+
+    # Waits for updates being handled.
+    for _ in range(concurrency):
+        await semaphore.acquire()
+
+
+async def _handle_update(dispatcher: Dispatcher, update: types.Update, semaphore: asyncio.Semaphore):
+    """Handles update and frees the slot taken for it."""
+    try:
+        await dispatcher.updates_handler.notify(update)
+    finally:
+        semaphore.release()
@@ -0,0 +1,42 @@
+"""
+Interface of the database used by the bot.
+"""
+
+
+class Storage:
+    """
+    Database with async access. Queries use ? placeholders, backends
+    convert them to their own parameter style.
+    """
+    dialect = None
+
+    async def execute(self, query: str, *params):
+        """
+        Executes query which does not return rows (INSERT, UPDATE, DELETE).
+
+        :param query: SQL query with ? placeholders.
+        :param params: Values of the placeholders.
+        """
+        raise NotImplementedError
+
+    async def fetchone(self, query: str, *params) -> tuple:
+        """
+        Executes query and returns its first row or None.
+
+        :param query: SQL query with ? placeholders.
+        :param params: Values of the placeholders.
+        """
+        raise NotImplementedError
+
+    async def fetchall(self, query: str, *params) -> list:
+        """
+        Executes query and returns all its rows.
+
+        :param query: SQL query with ? placeholders.
+        :param params: Values of the placeholders.
+        """
+        raise NotImplementedError
+
+    async def close(self):
+        """Closes all connections."""
+        raise NotImplementedError
@@ -0,0 +1,91 @@
+"""
+Versioned schema migrations. They are applied at startup, so adding a table
+or an index does not need manual changes of the database on production hosts.
+
+Every statement must be idempotent (IF NOT EXISTS): a migration interrupted
+in the middle is applied again on the next start. A statement is either
+a string or a dict with separate variants for sqlite and postgres.
+"""
+import datetime
+import logging
+
+from storage.base import Storage
+
+
+MIGRATIONS = [
+    (1, "user table", [
+        {
+            "sqlite": 'CREATE TABLE IF NOT EXISTS "user" (id integer primary key, google_sheet_id text)',
+            "postgres": 'CREATE TABLE IF NOT EXISTS "user" (id bigint primary key, google_sheet_id text)',
+        },
+    ]),
+    (2, "index of users by Google sheet", [
+        'CREATE INDEX IF NOT EXISTS user_google_sheet_id_idx ON "user" (google_sheet_id)',
+    ]),
+    (3, "FSM states", [
+        "CREATE TABLE IF NOT EXISTS fsm_state ("
+        "chat_id bigint, user_id bigint, state text, data text, updated_at double precision, "
+        "PRIMARY KEY (chat_id, user_id))",
+    ]),
+    (4, "index of FSM states by update time", [
+        "CREATE INDEX IF NOT EXISTS fsm_state_updated_at_idx ON fsm_state (updated_at)",
+    ]),
+    (5, "journal of transactions written by the bot", [
+        {
+            "sqlite": "CREATE TABLE IF NOT EXISTS journal (id integer primary key, user_id bigint, kind text, "
+                      "position integer, entries text, deltas text, created_at double precision)",
+            "postgres": "CREATE TABLE IF NOT EXISTS journal (id bigserial primary key, user_id bigint, kind text, "
+                        "position integer, entries text, deltas text, created_at double precision)",
+        },
+        "CREATE INDEX IF NOT EXISTS journal_user_id_idx ON journal (user_id, id)",
+    ]),
+    (6, "totals of transactions by month and category", [
+        "CREATE TABLE IF NOT EXISTS summary ("
+        "user_id bigint, kind text, month text, category text, total double precision, sheet_row integer, "
+        "PRIMARY KEY (user_id, kind, month, category))",
+        "CREATE TABLE IF NOT EXISTS summary_sheet (user_id bigint primary key, sheet_id bigint, row_count integer)",
+    ]),
+    (7, "monthly budgets of expense categories", [
+        "CREATE TABLE IF NOT EXISTS budget ("
+        "user_id bigint, category text, amount double precision, PRIMARY KEY (user_id, category))",
+    ]),
+    (8, "recurring transactions", [
+        {
+            "sqlite": "CREATE TABLE IF NOT EXISTS recurring (id integer primary key, user_id bigint, kind text, "
+                      "name text, amount double precision, category text, account text, day integer, next_run text)",
+            "postgres": "CREATE TABLE IF NOT EXISTS recurring (id bigserial primary key, user_id bigint, kind text, "
+                        "name text, amount double precision, category text, account text, day integer, next_run text)",
+        },
+        "CREATE INDEX IF NOT EXISTS recurring_next_run_idx ON recurring (next_run)",
+    ]),
+]
+
+
+async def migrate(db: Storage):
+    """
+    Applies migrations which were not applied to the database yet.
+
+    :param db: Storage object.
+    """
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version integer primary key, description text, applied_at text)"
+    )
+    applied = {version for version, in await db.fetchall("SELECT version FROM schema_version")}
+
+    for version, description, statements in MIGRATIONS:
+        if version in applied:
+            continue
+
+        logging.info("Applying migration %s: %s", version, description)
+        for statement in statements:
+            if isinstance(statement, dict):
+                statement = statement[db.dialect]
+            await db.execute(statement)
+
+        await db.execute(
+            "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (version) DO NOTHING",
+            version,
+            description,
+            datetime.datetime.now().isoformat(timespec="seconds"),
+        )
@@ -0,0 +1,75 @@
+"""
+SQLite storage. Connections live in their own threads, so queries never block the event loop.
+"""
+import asyncio
+import sqlite3
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from storage.base import Storage
+from tracing import span
+
+
+class SQLiteStorage(Storage):
+    """SQLite database in WAL mode with a pool of connection threads."""
+    dialect = "sqlite"
+
+    def __init__(self, path: str, pool_size: int = 1):
+        """
+        :param path: Path to the database file.
+        :param pool_size: Number of threads (each one has its own connection).
+        """
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="sqlite")
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+
+    async def execute(self, query: str, *params):
+        await self._run(query, params, None)
+
+    async def fetchone(self, query: str, *params) -> tuple:
+        return await self._run(query, params, "one")
+
+    async def fetchall(self, query: str, *params) -> list:
+        return await self._run(query, params, "all")
+
+    async def close(self):
+        self._executor.shutdown()
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+    async def _run(self, query: str, params: tuple, fetch: str = None):
+        """Executes query in one of the connection threads."""
+        loop = asyncio.get_running_loop()
+        with span("db", query=query):
+            return await loop.run_in_executor(self._executor, self._execute, query, params, fetch)
+
+    def _execute(self, query: str, params: tuple, fetch: str = None):
+        """Executes query with the connection of the current thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+
+        # sqlite3 keeps compiled statements in its cache, so the same
+        # parameterized query is prepared only once.
+        cursor = connection.execute(query, params)
+        if fetch == "one":
+            return cursor.fetchone()
+        if fetch == "all":
+            return cursor.fetchall()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Opens connection in autocommit mode with write-ahead log enabled."""
+        # Connections are closed from the event loop thread on shutdown.
+        connection = sqlite3.connect(self.path, isolation_level=None, timeout=10, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._connections_lock:
+            self._connections.append(connection)
+
+        return connection
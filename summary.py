@@ -0,0 +1,189 @@
+"""
+Local copy of "Сводка" worksheet (see google_sheet.summary): totals of transactions
+by month, type and category together with their rows in the worksheet. Writes of
+transactions change only the totals of their categories, so reports and new totals
+are computed without reading the table.
+"""
+import datetime
+import typing
+
+from background import run_blocking, spawn
+from database import db
+from google_sheet.summary import SummaryChanges, build_summary, get_month
+from settings_cache import get_settings, invalidate_settings, transaction_lock
+
+
+_building = set()
+
+
+def get_amounts(entries: typing.List[dict], date: datetime.date, sign: int = 1) -> typing.Dict[tuple, float]:
+    """
+    Returns changes of totals made by the transactions.
+
+    :param entries: Dicts with amount, category and optional date (ISO format).
+    :param date: Date of the transactions without date.
+    :param sign: -1 if the transactions are deleted.
+    :return: Changes of totals by (month, category), categories differing only in case are merged.
+    """
+    amounts = dict()
+    names = dict()
+    for entry in entries:
+        entry_date = datetime.date.fromisoformat(entry["date"]) if "date" in entry else date
+        key = (get_month(entry_date), names.setdefault(entry["category"].lower(), entry["category"]))
+        amounts[key] = amounts.get(key, 0) + sign * entry["amount"]
+
+    return amounts
+
+
+async def get_totals(user_id: int, kind: str, month: str) -> typing.Dict[str, float]:
+    """
+    Returns totals of the month by category.
+
+    :param user_id: Telegram ID of the user.
+    :param kind: Type of transactions (expense/income).
+    :param month: Month (e.g. 2024-05, see google_sheet.summary.get_month).
+    """
+    rows = await db.fetchall(
+        "SELECT category, total FROM summary WHERE user_id = ? AND kind = ? AND month = ?",
+        user_id,
+        kind,
+        month,
+    )
+    return {category: total for category, total in rows}
+
+
+async def is_built(user_id: int) -> bool:
+    """
+    Checks that the summary of the user is built, so its totals include all transactions.
+
+    :param user_id: Telegram ID of the user.
+    """
+    return await db.fetchone("SELECT sheet_id FROM summary_sheet WHERE user_id = ?", user_id) is not None
+
+
+async def plan_changes(user_id: int, settings: dict, kind: str, amounts: typing.Dict[tuple, float],
+                       changes: SummaryChanges = None) -> typing.Optional[SummaryChanges]:
+    """
+    Returns new totals which must be written together with the transactions.
+    Must be called under transaction_lock of the user.
+
+    :param user_id: Telegram ID of the user.
+    :param settings: User's settings snapshot.
+    :param kind: Type of transactions (expense/income).
+    :param amounts: Changes of totals by (month, category).
+    :param changes: SummaryChanges of the same write to add the totals to (e.g. of the other type).
+    :return: SummaryChanges or None if the summary is not built yet (building is started then).
+    """
+    sheet = await db.fetchone("SELECT sheet_id, row_count FROM summary_sheet WHERE user_id = ?", user_id)
+    # The worksheet was deleted or the summary of the table was never built.
+    if sheet is None or sheet[0] != settings["sheet_ids"].get("summary"):
+        schedule_build(user_id)
+        return None
+
+    if changes is None:
+        changes = SummaryChanges(*sheet)
+    rows_by_month = dict()
+    for (month, category), amount in amounts.items():
+        if month not in rows_by_month:
+            rows_by_month[month] = await db.fetchall(
+                "SELECT category, total, sheet_row FROM summary WHERE user_id = ? AND kind = ? AND month = ?",
+                user_id,
+                kind,
+                month,
+            )
+
+        # Categories are typed by users, so the row of the category is found regardless of case.
+        current = next((row for row in rows_by_month[month] if row[0].lower() == category.lower()), None)
+        if current is None:
+            changes.set_total((kind, month, category), amount)
+        else:
+            changes.set_total((kind, month, current[0]), current[1] + amount, current[2])
+
+    return changes
+
+
+async def save_changes(user_id: int, changes: typing.Optional[SummaryChanges]):
+    """
+    Saves totals written to the worksheet.
+
+    :param user_id: Telegram ID of the user.
+    :param changes: SummaryChanges returned by plan_changes.
+    """
+    if changes is None:
+        return
+
+    for (kind, month, category), (row, total) in changes.totals.items():
+        await db.execute(
+            "INSERT INTO summary (user_id, kind, month, category, total, sheet_row) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, kind, month, category) DO UPDATE SET total = excluded.total",
+            user_id,
+            kind,
+            month,
+            category,
+            total,
+            row,
+        )
+
+    await db.execute(
+        "UPDATE summary_sheet SET row_count = ? WHERE user_id = ?",
+        changes.next_row + changes.new_rows,
+        user_id,
+    )
+
+
+def schedule_build(user_id: int):
+    """Starts building the summary in background unless it is already being built."""
+    if user_id in _building:
+        return
+
+    _building.add(user_id)
+    spawn(build(user_id), name="build_summary", user_id=user_id)
+
+
+async def build(user_id: int):
+    """
+    Rebuilds "Сводка" worksheet and its local copy from the transactions table.
+
+    :param user_id: Telegram ID of the user.
+    """
+    try:
+        # Transactions written during building would be lost in the summary.
+        async with transaction_lock(user_id):
+            settings = await get_settings(user_id)
+            sheet_id, totals = await run_blocking(build_summary, settings["gsheet_id"])
+
+            await db.execute("DELETE FROM summary WHERE user_id = ?", user_id)
+            for row, (kind, month, category, total) in enumerate(totals, 1):
+                await db.execute(
+                    "INSERT INTO summary (user_id, kind, month, category, total, sheet_row) VALUES (?, ?, ?, ?, ?, ?)",
+                    user_id,
+                    kind,
+                    month,
+                    category,
+                    total,
+                    row,
+                )
+
+            await db.execute(
+                "INSERT INTO summary_sheet (user_id, sheet_id, row_count) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET sheet_id = excluded.sheet_id, row_count = excluded.row_count",
+                user_id,
+                sheet_id,
+                len(totals) + 1,
+            )
+
+            # The snapshot must know ID of the new worksheet.
+            invalidate_settings(user_id)
+
+    finally:
+        _building.discard(user_id)
+
+
+async def forget(user_id: int):
+    """
+    Forgets the summary of the user (e.g. the bot is connected to another table).
+
+    :param user_id: Telegram ID of the user.
+    """
+    await db.execute("DELETE FROM summary WHERE user_id = ?", user_id)
+    await db.execute("DELETE FROM summary_sheet WHERE user_id = ?", user_id)
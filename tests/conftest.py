@@ -0,0 +1,20 @@
+"""
+Common setup of tests. Modules of the bot import config.py, which is not kept in the repository,
+so template_config.py is used when config.py is not created. The same way, the Sheets client is
+created without credentials when google_token.json is missing (tests make no requests).
+"""
+import importlib
+import os
+import sys
+
+import gspread
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    sys.modules["config"] = importlib.import_module("template_config")
+
+if not os.path.exists("google_token.json"):
+    gspread.service_account = lambda filename, client_factory=gspread.Client, **kwargs: client_factory(auth=None)
@@ -0,0 +1,45 @@
+"""
+Tests of finding the transactions of closed years at the bottom of the tables.
+"""
+import datetime
+
+from google_sheet.archive import SERIAL_DATE_EPOCH, get_closed_blocks, get_year
+
+
+def serial(year, month=1, day=1):
+    """Returns unformatted value of the date cell."""
+    return (datetime.date(year, month, day) - SERIAL_DATE_EPOCH).days
+
+
+def test_get_year():
+    assert get_year(serial(2024, 12, 31)) == 2024
+    assert get_year(serial(2025) + 0.5) == 2025
+    assert get_year("01.01.2024") is None
+    assert get_year("") is None
+    assert get_year(None) is None
+
+
+def test_blocks_of_several_years():
+    dates = [serial(2025, 3), serial(2025, 1), serial(2024, 12), serial(2024, 2), serial(2023, 7)]
+
+    assert get_closed_blocks(dates, 2025) == [(2023, 4, 1), (2024, 2, 2)]
+
+
+def test_non_date_cell_stops_the_block():
+    dates = [serial(2025), serial(2024, 5), "не дата", serial(2023, 6), serial(2023, 1)]
+
+    assert get_closed_blocks(dates, 2025) == [(2023, 3, 2)]
+
+
+def test_empty_column():
+    assert get_closed_blocks([], 2025) == []
+
+
+def test_nothing_closed():
+    assert get_closed_blocks([serial(2025, 2), serial(2025, 1)], 2025) == []
+
+
+def test_all_closed():
+    dates = [serial(2024, 3), serial(2024, 1), serial(2022, 5)]
+
+    assert get_closed_blocks(dates, 2025) == [(2022, 2, 1), (2024, 0, 2)]
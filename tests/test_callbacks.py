@@ -0,0 +1,80 @@
+"""
+Tests of routing callback queries by prefix of callback data.
+"""
+import asyncio
+
+import pytest
+from aiogram import Bot, types
+from aiogram.utils.callback_data import CallbackData
+
+from callbacks import RoutingDispatcher, get_route
+
+
+delete_callback_data = CallbackData("delete", "item_id")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def press(dispatcher, data):
+    """Handles callback query with the data as the dispatcher does with an update."""
+    call_query = types.CallbackQuery(id="1", data=data, **{"from": {"id": 1, "is_bot": False, "first_name": "User"}})
+    types.User.set_current(call_query.from_user)
+    await dispatcher.callback_query_handlers.notify(call_query)
+
+
+@pytest.fixture
+def dispatcher():
+    dp = RoutingDispatcher(Bot("123456:TEST-TOKEN-FOR-TESTS-ONLY"))
+    calls = []
+
+    async def cancel(call_query):
+        calls.append(("cancel", call_query.data))
+
+    async def delete(call_query, callback_data):
+        calls.append(("delete", callback_data["item_id"]))
+
+    async def any_query(call_query):
+        calls.append(("any", call_query.data))
+
+    async def later(call_query):
+        calls.append(("later", call_query.data))
+
+    dp.register_callback_query_handler(cancel, text="cancel", state="*")
+    dp.register_callback_query_handler(delete, delete_callback_data.filter(), state="*")
+    dp.register_callback_query_handler(any_query, lambda call_query: call_query.data.startswith("any"), state="*")
+    dp.register_callback_query_handler(later, text="later", state="*")
+
+    dp.calls = calls
+    return dp
+
+
+def test_get_route():
+    assert get_route("delete:5") == "delete"
+    assert get_route("cancel") == "cancel"
+    assert get_route(None) == ""
+
+
+def test_candidates_keep_order_of_registration(dispatcher):
+    router = dispatcher.callback_query_handlers
+
+    def names(data):
+        return [handler_obj.handler.__name__ for handler_obj in router.get_candidates(data)]
+
+    assert names("cancel") == ["cancel", "any_query"]
+    assert names("delete:5") == ["delete", "any_query"]
+    assert names("later") == ["any_query", "later"]
+    assert names("unknown") == ["any_query"]
+
+
+def test_query_goes_to_handler_of_its_prefix(dispatcher):
+    async def scenario():
+        await press(dispatcher, "delete:5")
+        await press(dispatcher, "cancel")
+        await press(dispatcher, "any_thing")
+        await press(dispatcher, "later")
+        await press(dispatcher, "unknown")
+
+    run(scenario())
+    assert dispatcher.calls == [("delete", "5"), ("cancel", "cancel"), ("any", "any_thing"), ("later", "later")]
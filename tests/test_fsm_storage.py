@@ -0,0 +1,169 @@
+"""
+Tests of FSM storages. DatabaseStorage uses a temporary SQLite database.
+"""
+import asyncio
+
+import pytest
+
+import fsm_storage
+from fsm_storage import DatabaseStorage, MemoryFlowStorage
+from storage.migrations import migrate
+from storage.sqlite import SQLiteStorage
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+HOUR = 60 * 60
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Current time of the storages, can be moved forward by tests."""
+    now = [1_000_000.0]
+    monkeypatch.setattr(fsm_storage.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def db(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "finance.db"))
+    run(migrate(storage))
+    yield storage
+    run(storage.close())
+
+
+def test_database_storage_keeps_flow_after_restart(db):
+    async def scenario():
+        storage = DatabaseStorage(db, max_flows=10)
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+        await storage.update_data(chat=1, user=1, category="Еда")
+
+        restarted = DatabaseStorage(db, max_flows=10)
+        assert await restarted.get_state(chat=1, user=1) == "AddsExpense:amount"
+        assert await restarted.get_data(chat=1, user=1) == {"category": "Еда"}
+        assert await db.fetchone("SELECT data FROM fsm_state") == ('{"category":"Еда"}',)
+
+    run(scenario())
+
+
+def test_database_storage_forgets_finished_flow(db):
+    async def scenario():
+        storage = DatabaseStorage(db, max_flows=10)
+        assert await storage.get_state(chat=1, user=1) is None
+        assert await db.fetchone("SELECT count(*) FROM fsm_state") == (0,)
+
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+        await storage.update_data(chat=1, user=1, amount=10)
+        await storage.finish(chat=1, user=1)
+
+        assert await db.fetchone("SELECT count(*) FROM fsm_state") == (0,)
+
+    run(scenario())
+
+
+def test_memory_storage_reading_creates_nothing():
+    async def scenario():
+        storage = MemoryFlowStorage(max_flows=10)
+        assert await storage.get_state(chat=1, user=1) is None
+        assert await storage.get_data(chat=1, user=1) == {}
+        assert storage.data == {}
+
+    run(scenario())
+
+
+def test_database_sweep_expires_abandoned_flows(db, clock):
+    async def scenario():
+        storage = DatabaseStorage(db, max_flows=10)
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+        await storage.set_state(chat=2, user=2, state="Unknown:state")
+
+        # AddsExpense expires after an hour, other states after FSM_DEFAULT_TTL (2 hours).
+        clock[0] += 1.5 * HOUR
+        await storage.sweep()
+
+        assert await storage.get_flow(chat=1, user=1) == (None, True)
+        assert await storage.get_flow(chat=1, user=1) == (None, False)
+        assert await storage.get_flow(chat=2, user=2) == ("Unknown:state", False)
+
+    run(scenario())
+
+
+def test_database_flow_expires_on_reading(db, clock):
+    async def scenario():
+        storage = DatabaseStorage(db, max_flows=10)
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+
+        clock[0] += 2 * HOUR
+        assert await storage.get_flow(chat=1, user=1) == (None, True)
+        assert await storage.get_state(chat=1, user=1) is None
+
+    run(scenario())
+
+
+def test_database_sweep_keeps_max_flows(db, clock):
+    async def scenario():
+        storage = DatabaseStorage(db, max_flows=2)
+        for user in range(3):
+            clock[0] += 1
+            await storage.set_state(chat=user, user=user, state="AddsExpense:amount")
+
+        await storage.sweep()
+
+        assert await storage.get_flow(chat=0, user=0) == (None, True)
+        assert await storage.get_flow(chat=1, user=1) == ("AddsExpense:amount", False)
+        assert await storage.get_flow(chat=2, user=2) == ("AddsExpense:amount", False)
+
+    run(scenario())
+
+
+def test_memory_sweep_expires_abandoned_flows(clock):
+    async def scenario():
+        storage = MemoryFlowStorage(max_flows=10)
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+        await storage.set_state(chat=2, user=2, state="Unknown:state")
+
+        clock[0] += 1.5 * HOUR
+        await storage.sweep()
+
+        assert await storage.get_flow(chat=1, user=1) == (None, True)
+        assert await storage.get_flow(chat=1, user=1) == (None, False)
+        assert await storage.get_flow(chat=2, user=2) == ("Unknown:state", False)
+        assert "1" not in storage.data
+
+    run(scenario())
+
+
+def test_memory_sweep_keeps_max_flows(clock):
+    async def scenario():
+        storage = MemoryFlowStorage(max_flows=2)
+        for user in range(3):
+            clock[0] += 1
+            await storage.set_state(chat=user, user=user, state="AddsExpense:amount")
+        # Changing the flow makes it the most recently updated one.
+        clock[0] += 1
+        await storage.update_data(chat=0, user=0, amount=10)
+
+        await storage.sweep()
+
+        assert await storage.get_flow(chat=1, user=1) == (None, True)
+        assert await storage.get_flow(chat=0, user=0) == ("AddsExpense:amount", False)
+        assert await storage.get_flow(chat=2, user=2) == ("AddsExpense:amount", False)
+
+    run(scenario())
+
+
+def test_memory_tombstones_are_forgotten(clock):
+    async def scenario():
+        storage = MemoryFlowStorage(max_flows=10)
+        await storage.set_state(chat=1, user=1, state="AddsExpense:amount")
+
+        clock[0] += 2 * HOUR
+        await storage.sweep()
+        clock[0] += fsm_storage.FSM_TOMBSTONE_TTL + 1
+        await storage.sweep()
+
+        assert await storage.get_flow(chat=1, user=1) == (None, False)
+
+    run(scenario())
@@ -0,0 +1,91 @@
+"""
+Tests of positions of commits in the journal. The journal uses a temporary SQLite database.
+"""
+import asyncio
+
+import pytest
+
+import journal
+from google_sheet.transactions import FIRST_ROW
+from storage.migrations import migrate
+from storage.sqlite import SQLiteStorage
+
+
+USER_ID = 1
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def entries(count):
+    return [{"amount": 10, "category": "Еда", "account": "Карта", "comment": ""} for _ in range(count)]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / "finance.db"))
+    run(migrate(storage))
+    monkeypatch.setattr(journal, "db", storage)
+    yield storage
+    run(storage.close())
+
+
+async def get_positions(db, kind):
+    rows = await db.fetchall("SELECT position FROM journal WHERE user_id = ? AND kind = ? ORDER BY id", USER_ID, kind)
+    return [position for position, in rows]
+
+
+def test_row_moves_down_after_new_writes():
+    entry = journal.JournalEntry(1, USER_ID, "expense", 3, entries(2), {}, 0)
+
+    assert entry.get_row(5) == FIRST_ROW
+    assert entry.get_row(7) == FIRST_ROW + 2
+
+
+def test_last_commit_is_found_at_the_top(db):
+    async def scenario():
+        await journal.record(USER_ID, "expense", 0, entries(1), {"карта": -10})
+        await journal.record(USER_ID, "expense", 1, entries(2), {"карта": -20})
+
+        entry = await journal.get_last(USER_ID)
+        assert entry.position == 1
+        assert entry.deltas == {"карта": -20}
+        assert entry.get_row(3) == FIRST_ROW
+
+    run(scenario())
+
+
+def test_undo_shifts_newer_commits(db):
+    async def scenario():
+        await journal.record(USER_ID, "expense", 0, entries(1), {})
+        await journal.record(USER_ID, "expense", 1, entries(2), {})
+        await journal.record(USER_ID, "expense", 3, entries(1), {})
+
+        rows = await db.fetchall("SELECT id FROM journal ORDER BY id")
+        await journal.delete(journal.JournalEntry(rows[1][0], USER_ID, "expense", 1, entries(2), {}, 0))
+
+        assert await get_positions(db, "expense") == [0, 1]
+        last = await journal.get_last(USER_ID)
+        assert last.get_row(2) == FIRST_ROW
+
+    run(scenario())
+
+
+def test_forget_archived(db):
+    async def scenario():
+        await journal.record(USER_ID, "expense", 0, entries(1), {})
+        await journal.record(USER_ID, "expense", 1, entries(2), {})
+        await journal.record(USER_ID, "expense", 3, entries(1), {})
+        await journal.record(USER_ID, "income", 0, entries(1), {})
+
+        await journal.forget_archived(USER_ID, "expense", 2)
+
+        assert await get_positions(db, "expense") == [1]
+        assert await get_positions(db, "income") == [0]
+
+        # 4 transactions were in the table, 2 of them were archived.
+        entry = journal.JournalEntry(0, USER_ID, "expense", 1, entries(1), {}, 0)
+        assert entry.get_row(2) == FIRST_ROW
+
+    run(scenario())
@@ -0,0 +1,60 @@
+"""
+Tests of paged keyboards of users' settings.
+"""
+from keyboards import KEYBOARD_PAGE_SIZE, get_page, list_items_keyboard, settings_keyboard
+
+
+ITEMS = [f"Категория {i}" for i in range(2 * KEYBOARD_PAGE_SIZE + 1)]
+
+
+def buttons(markup):
+    """Returns texts of buttons by rows (aiogram keeps text buttons as strings)."""
+    return [[getattr(button, "text", button) for button in row] for row in markup.keyboard]
+
+
+def test_short_list_has_no_page_buttons():
+    assert buttons(list_items_keyboard(["Еда", "Кафе", "Такси"])) == [["Еда", "Кафе"], ["Такси"]]
+
+
+def test_pages_of_long_list():
+    first = buttons(list_items_keyboard(ITEMS))
+    assert sum(first, [])[:-1] == ITEMS[:KEYBOARD_PAGE_SIZE]
+    assert first[-1] == ["Стр. 2 ➡️"]
+
+    middle = buttons(list_items_keyboard(ITEMS, 1))
+    assert sum(middle[:-1], []) == ITEMS[KEYBOARD_PAGE_SIZE:2 * KEYBOARD_PAGE_SIZE]
+    assert middle[-1] == ["⬅️ Стр. 1", "Стр. 3 ➡️"]
+
+    last = buttons(list_items_keyboard(ITEMS, 2))
+    assert last == [[ITEMS[-1]], ["⬅️ Стр. 2"]]
+
+
+def test_page_out_of_range_is_clamped():
+    assert buttons(list_items_keyboard(ITEMS, 10)) == buttons(list_items_keyboard(ITEMS, 2))
+    assert buttons(list_items_keyboard(ITEMS, -1)) == buttons(list_items_keyboard(ITEMS, 0))
+
+
+def test_get_page():
+    assert get_page("Стр. 2 ➡️") == 1
+    assert get_page("⬅️ Стр. 1") == 0
+    assert get_page("Стр. 12 ➡️") == 11
+    assert get_page("Еда") is None
+    assert get_page("Стр. 2") is None
+    assert get_page(None) is None
+
+
+def test_page_buttons_lead_to_their_pages():
+    for page in range(3):
+        for button in buttons(list_items_keyboard(ITEMS, page))[-1]:
+            target = get_page(button)
+            assert target in (page - 1, page + 1)
+
+
+def test_settings_keyboard_is_built_once_per_version():
+    settings = {"items_version": 1, "items": {"expense": ["Еда", "Кафе"]}}
+    markup = settings_keyboard(settings, "expense")
+
+    assert settings_keyboard(dict(settings), "expense") is markup
+
+    changed = {"items_version": 2, "items": {"expense": ["Еда", "Кафе", "Такси"]}}
+    assert buttons(settings_keyboard(changed, "expense")) == [["Еда", "Кафе"], ["Такси"]]
@@ -0,0 +1,57 @@
+"""
+Tests of posting dates of recurring transactions.
+"""
+import datetime
+
+from recurring import get_date, get_first_date, get_next_date, get_offset
+
+
+def test_get_date_in_short_month():
+    assert get_date(2024, 2, 31) == datetime.date(2024, 2, 29)
+    assert get_date(2023, 2, 30) == datetime.date(2023, 2, 28)
+    assert get_date(2024, 4, 31) == datetime.date(2024, 4, 30)
+    assert get_date(2024, 5, 15) == datetime.date(2024, 5, 15)
+
+
+def test_next_date_returns_to_the_day_after_short_month():
+    date = datetime.date(2024, 1, 31)
+    dates = []
+    for _ in range(4):
+        date = get_next_date(date, 31)
+        dates.append(date)
+
+    assert dates == [
+        datetime.date(2024, 2, 29),
+        datetime.date(2024, 3, 31),
+        datetime.date(2024, 4, 30),
+        datetime.date(2024, 5, 31),
+    ]
+
+
+def test_next_date_after_december():
+    assert get_next_date(datetime.date(2024, 12, 5), 5) == datetime.date(2025, 1, 5)
+    assert get_next_date(datetime.date(2024, 12, 31), 31) == datetime.date(2025, 1, 31)
+
+
+def test_first_date():
+    today = datetime.date(2024, 2, 10)
+
+    assert get_first_date(10, today) == today
+    assert get_first_date(31, today) == datetime.date(2024, 2, 29)
+    assert get_first_date(5, today) == datetime.date(2024, 3, 5)
+
+
+def test_first_date_on_the_last_day_of_short_month():
+    today = datetime.date(2023, 2, 28)
+
+    assert get_first_date(31, today) == today
+    assert get_first_date(27, today) == datetime.date(2023, 3, 27)
+
+
+def test_offset_is_stable_and_within_window():
+    offsets = [get_offset(f"sheet-{i}", 3600) for i in range(100)]
+
+    assert offsets == [get_offset(f"sheet-{i}", 3600) for i in range(100)]
+    assert all(0 <= offset < 3600 for offset in offsets)
+    assert len(set(offsets)) > 50
+    assert get_offset("sheet-1", 0) == 0
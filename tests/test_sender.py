@@ -0,0 +1,100 @@
+"""
+Tests of pacing of outbound requests by the scheduler. Rates are high, so tests take a fraction of second.
+"""
+import asyncio
+import time
+
+import pytest
+from aiogram.utils.exceptions import RetryAfter
+
+from sender import MessageScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def recorder(sent, chat_id, index):
+    """Returns function which remembers time of sending the request."""
+    async def send():
+        sent.append((chat_id, index, time.monotonic()))
+        return index
+
+    return send
+
+
+def test_requests_to_chat_are_paced_in_order():
+    async def scenario():
+        scheduler = MessageScheduler(rate=1000, burst=1000, chat_rate=20, chat_burst=1)
+        sent = []
+
+        results = await asyncio.gather(*(scheduler.submit(1, "sendMessage", recorder(sent, 1, i)) for i in range(5)))
+
+        assert results == [0, 1, 2, 3, 4]
+        assert [index for _, index, _ in sent] == [0, 1, 2, 3, 4]
+        gaps = [b - a for (_, _, a), (_, _, b) in zip(sent, sent[1:])]
+        assert min(gaps) >= 0.04
+        assert scheduler.queued() == 0
+
+    run(scenario())
+
+
+def test_global_rate_is_shared_by_chats():
+    async def scenario():
+        scheduler = MessageScheduler(rate=20, burst=1, chat_rate=1000, chat_burst=1000)
+        sent = []
+
+        started = time.monotonic()
+        await asyncio.gather(*(scheduler.submit(chat_id, "sendMessage", recorder(sent, chat_id, 0))
+                               for chat_id in range(5)))
+
+        assert sorted(chat_id for chat_id, _, _ in sent) == [0, 1, 2, 3, 4]
+        assert time.monotonic() - started >= 0.19
+
+    run(scenario())
+
+
+def test_burst_is_sent_at_once():
+    async def scenario():
+        scheduler = MessageScheduler(rate=1000, burst=1000, chat_rate=1, chat_burst=3)
+        sent = []
+
+        started = time.monotonic()
+        await asyncio.gather(*(scheduler.submit(1, "sendMessage", recorder(sent, 1, i)) for i in range(3)))
+
+        assert time.monotonic() - started < 0.5
+
+    run(scenario())
+
+
+def test_flood_control_error_is_retried():
+    async def scenario():
+        scheduler = MessageScheduler(rate=1000, burst=1000, chat_rate=1000, chat_burst=1000)
+        attempts = []
+
+        async def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0)
+            return "sent"
+
+        assert await scheduler.submit(1, "sendMessage", send) == "sent"
+        assert len(attempts) == 2
+
+    run(scenario())
+
+
+def test_error_does_not_stop_the_queue():
+    async def scenario():
+        scheduler = MessageScheduler(rate=1000, burst=1000, chat_rate=1000, chat_burst=1000)
+
+        async def fail():
+            raise ValueError("chat not found")
+
+        failed = scheduler.enqueue(1, "sendMessage", fail)
+        assert await scheduler.submit(1, "sendMessage", recorder([], 1, 1)) == 1
+
+        with pytest.raises(ValueError):
+            failed.future.result()
+
+    run(scenario())
@@ -0,0 +1,50 @@
+"""
+Tests of routing users to worker processes.
+"""
+import collections
+
+from sharding import HashRing, get_user_id
+
+
+USERS = range(100_000, 120_000)
+
+
+def test_users_are_spread_evenly():
+    ring = HashRing(range(4))
+    counts = collections.Counter(ring.get_node(user) for user in USERS)
+
+    assert set(counts) == {0, 1, 2, 3}
+    for count in counts.values():
+        assert 0.15 * len(USERS) < count < 0.35 * len(USERS)
+
+
+def test_user_always_goes_to_the_same_worker():
+    assert [HashRing(range(4)).get_node(user) for user in USERS[:100]] == \
+        [HashRing(range(4)).get_node(user) for user in USERS[:100]]
+
+
+def test_added_worker_takes_only_its_share():
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+
+    moved = [user for user in USERS if before.get_node(user) != after.get_node(user)]
+
+    assert all(after.get_node(user) == 4 for user in moved)
+    assert 0.1 * len(USERS) < len(moved) < 0.3 * len(USERS)
+
+
+def test_removed_worker_gives_away_only_its_users():
+    before = HashRing(range(5))
+    after = HashRing([0, 1, 2, 3])
+
+    moved = [user for user in USERS if before.get_node(user) != after.get_node(user)]
+
+    assert moved
+    assert all(before.get_node(user) == 4 for user in moved)
+
+
+def test_get_user_id():
+    assert get_user_id({"update_id": 1, "message": {"from": {"id": 42}, "text": "/start"}}) == 42
+    assert get_user_id({"update_id": 2, "callback_query": {"from": {"id": 7}}}) == 7
+    assert get_user_id({"update_id": 3, "my_chat_member": {"from": {"id": 9}}}) == 9
+    assert get_user_id({"update_id": 4, "channel_post": {"chat": {"id": -100}}}) == 0
@@ -0,0 +1,203 @@
+"""
+Tests of the database storages. SQLite tests use a temporary file. PostgresStorage is tested
+with a fake asyncpg pool; set FINANCE_TEST_POSTGRES_DSN to run the tests against a real server.
+"""
+import asyncio
+import os
+import sys
+import types
+
+import pytest
+
+from storage.migrations import MIGRATIONS, migrate
+from storage.postgres import PostgresStorage, _to_numeric_placeholders
+from storage.sqlite import SQLiteStorage
+
+
+POSTGRES_DSN = os.environ.get("FINANCE_TEST_POSTGRES_DSN")
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "finance.db")
+
+
+def test_sqlite_execute_and_fetch(sqlite_path):
+    async def scenario():
+        db = SQLiteStorage(sqlite_path)
+        try:
+            await db.execute("CREATE TABLE item (id integer primary key, name text)")
+            await db.execute("INSERT INTO item (id, name) VALUES (?, ?)", 1, "first")
+            await db.execute("INSERT INTO item (id, name) VALUES (?, ?)", 2, "second")
+
+            assert await db.fetchone("SELECT name FROM item WHERE id = ?", 2) == ("second",)
+            assert await db.fetchone("SELECT name FROM item WHERE id = ?", 3) is None
+            assert await db.fetchall("SELECT id, name FROM item ORDER BY id") == [(1, "first"), (2, "second")]
+        finally:
+            await db.close()
+
+    run(scenario())
+
+
+def test_sqlite_autocommit_is_seen_by_other_connections(sqlite_path):
+    async def scenario():
+        writer = SQLiteStorage(sqlite_path)
+        reader = SQLiteStorage(sqlite_path)
+        try:
+            await writer.execute("CREATE TABLE item (id integer primary key)")
+            await writer.execute("INSERT INTO item (id) VALUES (?)", 1)
+
+            assert await reader.fetchall("SELECT id FROM item") == [(1,)]
+        finally:
+            await writer.close()
+            await reader.close()
+
+    run(scenario())
+
+
+def test_sqlite_pool_runs_concurrent_queries(sqlite_path):
+    async def scenario():
+        db = SQLiteStorage(sqlite_path, pool_size=4)
+        try:
+            await db.execute("CREATE TABLE item (id integer primary key)")
+            await asyncio.gather(*(db.execute("INSERT INTO item (id) VALUES (?)", i) for i in range(50)))
+
+            assert await db.fetchone("SELECT count(*) FROM item") == (50,)
+        finally:
+            await db.close()
+
+    run(scenario())
+
+
+def test_sqlite_migrations(sqlite_path):
+    async def scenario():
+        db = SQLiteStorage(sqlite_path)
+        try:
+            await migrate(db)
+            versions = [version for version, in await db.fetchall("SELECT version FROM schema_version ORDER BY 1")]
+            assert versions == [version for version, _, _ in MIGRATIONS]
+
+            # Applying migrations again changes nothing.
+            await migrate(db)
+            assert await db.fetchone("SELECT count(*) FROM schema_version") == (len(MIGRATIONS),)
+
+            await db.execute('INSERT INTO "user" (id, google_sheet_id) VALUES (?, ?)', 1, "sheet")
+            assert await db.fetchone('SELECT google_sheet_id FROM "user" WHERE id = ?', 1) == ("sheet",)
+        finally:
+            await db.close()
+
+    run(scenario())
+
+
+def test_migration_versions_are_unique_and_ordered():
+    versions = [version for version, _, _ in MIGRATIONS]
+    assert versions == sorted(set(versions))
+
+    for _, _, statements in MIGRATIONS:
+        for statement in statements:
+            if isinstance(statement, dict):
+                assert set(statement) == {"sqlite", "postgres"}
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT 1", "SELECT 1"),
+    ("SELECT * FROM t WHERE a = ? AND b = ?", "SELECT * FROM t WHERE a = $1 AND b = $2"),
+    ("INSERT INTO t (a, b, c) VALUES (?, ?, ?)", "INSERT INTO t (a, b, c) VALUES ($1, $2, $3)"),
+    ("SELECT * FROM t WHERE a = 'what?' AND b = ?", "SELECT * FROM t WHERE a = 'what?' AND b = $1"),
+    ("SELECT * FROM t WHERE a = 'it''s ?' AND b = ?", "SELECT * FROM t WHERE a = 'it''s ?' AND b = $1"),
+    ('SELECT "odd?column" FROM t WHERE a = ?', 'SELECT "odd?column" FROM t WHERE a = $1'),
+])
+def test_postgres_placeholders(query, expected):
+    assert _to_numeric_placeholders(query) == expected
+
+
+class FakePool:
+    """Pool of asyncpg which records queries."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+        self.closed = False
+
+    async def execute(self, query, *params):
+        self.queries.append((query, params))
+
+    async def fetchrow(self, query, *params):
+        self.queries.append((query, params))
+        return self.rows[0] if self.rows else None
+
+    async def fetch(self, query, *params):
+        self.queries.append((query, params))
+        return self.rows
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_asyncpg(monkeypatch):
+    pool = FakePool([(1, "first")])
+    created = []
+
+    async def create_pool(dsn, min_size, max_size):
+        created.append((dsn, max_size))
+        return pool
+
+    monkeypatch.setitem(sys.modules, "asyncpg", types.SimpleNamespace(create_pool=create_pool))
+    return pool, created
+
+
+def test_postgres_storage_rewrites_queries(fake_asyncpg):
+    pool, created = fake_asyncpg
+
+    async def scenario():
+        db = PostgresStorage("postgresql://localhost/finance", pool_size=2)
+        await db.execute("UPDATE t SET name = ? WHERE id = ?", "x", 1)
+        assert await db.fetchone("SELECT id, name FROM t WHERE id = ?", 1) == (1, "first")
+        assert await db.fetchall("SELECT id, name FROM t") == [(1, "first")]
+        await db.close()
+
+    run(scenario())
+
+    # The pool is created once, on the first query.
+    assert created == [("postgresql://localhost/finance", 2)]
+    assert pool.queries == [
+        ("UPDATE t SET name = $1 WHERE id = $2", ("x", 1)),
+        ("SELECT id, name FROM t WHERE id = $1", (1,)),
+        ("SELECT id, name FROM t", ()),
+    ]
+    assert pool.closed
+
+
+def test_postgres_storage_requires_asyncpg(monkeypatch):
+    monkeypatch.setitem(sys.modules, "asyncpg", None)
+    with pytest.raises(RuntimeError):
+        PostgresStorage("postgresql://localhost/finance")
+
+
+@pytest.mark.skipif(POSTGRES_DSN is None, reason="FINANCE_TEST_POSTGRES_DSN is not set")
+def test_postgres_migrations():
+    async def scenario():
+        db = PostgresStorage(POSTGRES_DSN)
+        try:
+            await migrate(db)
+            await migrate(db)
+            assert await db.fetchone("SELECT count(*) FROM schema_version") == (len(MIGRATIONS),)
+
+            await db.execute(
+                "INSERT INTO budget (user_id, category, amount) VALUES (?, ?, ?) "
+                "ON CONFLICT (user_id, category) DO UPDATE SET amount = excluded.amount",
+                -1,
+                "test?",
+                10,
+            )
+            assert await db.fetchone("SELECT amount FROM budget WHERE user_id = ? AND category = 'test?'", -1) == (10,)
+            await db.execute("DELETE FROM budget WHERE user_id = ?", -1)
+        finally:
+            await db.close()
+
+    run(scenario())
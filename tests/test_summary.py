@@ -0,0 +1,106 @@
+"""
+Tests of the totals of "Сводка" worksheet kept by the bot. The local copy uses a temporary SQLite database.
+"""
+import asyncio
+import datetime
+
+import pytest
+
+import summary
+from google_sheet.batch import BatchUpdate
+from google_sheet.summary import SummaryChanges
+from storage.migrations import migrate
+from storage.sqlite import SQLiteStorage
+
+
+USER_ID = 1
+SHEET_ID = 5
+SETTINGS = {"sheet_ids": {"summary": SHEET_ID}}
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    storage = SQLiteStorage(str(tmp_path / "finance.db"))
+    run(migrate(storage))
+    monkeypatch.setattr(summary, "db", storage)
+    yield storage
+    run(storage.close())
+
+
+def test_new_keys_get_rows_at_the_end():
+    changes = SummaryChanges(SHEET_ID, 10)
+    changes.set_total(("expense", "2024-05", "Еда"), 100, 4)
+    changes.set_total(("expense", "2024-05", "Кафе"), 50)
+    changes.set_total(("income", "2024-05", "ЗП"), 900)
+    changes.set_total(("expense", "2024-05", "Кафе"), 70)
+
+    assert changes.totals == {
+        ("expense", "2024-05", "Еда"): (4, 100),
+        ("expense", "2024-05", "Кафе"): (10, 70),
+        ("income", "2024-05", "ЗП"): (11, 900),
+    }
+    assert changes.new_rows == 2
+
+
+def test_totals_are_written_at_their_rows():
+    changes = SummaryChanges(SHEET_ID, 10)
+    changes.set_total(("expense", "2024-05", "Кафе"), 50)
+    changes.set_total(("expense", "2024-05", "Еда"), 100, 4)
+
+    batch = BatchUpdate("gsheet")
+    changes.add_to_batch(batch)
+
+    assert batch.requests[0] == {"appendDimension": {"sheetId": SHEET_ID, "dimension": "ROWS", "length": 1}}
+    assert [request["updateCells"]["start"]["rowIndex"] for request in batch.requests[1:]] == [4, 10]
+
+
+def test_get_amounts():
+    entries = [
+        {"amount": 10, "category": "Еда"},
+        {"amount": 5, "category": "еда"},
+        {"amount": 7, "category": "Кафе", "date": "2024-04-30"},
+    ]
+
+    assert summary.get_amounts(entries, datetime.date(2024, 5, 2)) == {("2024-05", "Еда"): 15, ("2024-04", "Кафе"): 7}
+    assert summary.get_amounts(entries[:1], datetime.date(2024, 5, 2), -1) == {("2024-05", "Еда"): -10}
+
+
+def test_existing_and_new_totals_are_incremented(db):
+    async def scenario():
+        await db.execute(
+            "INSERT INTO summary_sheet (user_id, sheet_id, row_count) VALUES (?, ?, ?)", USER_ID, SHEET_ID, 3
+        )
+        await db.execute(
+            "INSERT INTO summary (user_id, kind, month, category, total, sheet_row) VALUES (?, ?, ?, ?, ?, ?)",
+            USER_ID, "expense", "2024-05", "Еда", 100, 1,
+        )
+
+        changes = await summary.plan_changes(
+            USER_ID, SETTINGS, "expense", {("2024-05", "еда"): 20, ("2024-05", "Кафе"): 30}
+        )
+        assert changes.totals == {("expense", "2024-05", "Еда"): (1, 120), ("expense", "2024-05", "Кафе"): (3, 30)}
+        await summary.save_changes(USER_ID, changes)
+
+        changes = await summary.plan_changes(USER_ID, SETTINGS, "expense", {("2024-05", "Кафе"): 5})
+        assert changes.totals == {("expense", "2024-05", "Кафе"): (3, 35)}
+        assert changes.next_row == 4
+
+    run(scenario())
+
+
+def test_changes_of_both_kinds_are_planned_together(db):
+    async def scenario():
+        await db.execute(
+            "INSERT INTO summary_sheet (user_id, sheet_id, row_count) VALUES (?, ?, ?)", USER_ID, SHEET_ID, 1
+        )
+
+        changes = await summary.plan_changes(USER_ID, SETTINGS, "expense", {("2024-05", "Еда"): 20})
+        changes = await summary.plan_changes(USER_ID, SETTINGS, "income", {("2024-05", "ЗП"): 900}, changes)
+
+        assert changes.totals == {("expense", "2024-05", "Еда"): (1, 20), ("income", "2024-05", "ЗП"): (2, 900)}
+
+    run(scenario())
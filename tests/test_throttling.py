@@ -0,0 +1,62 @@
+"""
+Tests of the token bucket limiting users' requests.
+"""
+import pytest
+
+import throttling
+from throttling import TokenBucket, rate_limit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Monotonic time of the buckets, can be moved forward by tests."""
+    now = [100.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_up_to_capacity(clock):
+    bucket = TokenBucket(rate=0.5, capacity=3)
+
+    assert [bucket.consume() for _ in range(3)] == [0, 0, 0]
+    assert bucket.consume() == pytest.approx(2)
+
+
+def test_tokens_are_refilled(clock):
+    bucket = TokenBucket(rate=0.5, capacity=3)
+    for _ in range(3):
+        bucket.consume()
+
+    clock[0] += 1
+    assert bucket.consume() == pytest.approx(1)
+
+    clock[0] += 1
+    assert bucket.consume() == 0
+    assert bucket.consume() == pytest.approx(2)
+
+
+def test_refill_is_capped_by_capacity(clock):
+    bucket = TokenBucket(rate=0.5, capacity=3)
+    bucket.consume()
+
+    clock[0] += 60
+    assert [bucket.consume() for _ in range(3)] == [0, 0, 0]
+    assert bucket.consume() > 0
+
+
+def test_allowed_request_resets_warning(clock):
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.consume()
+    bucket.warned = True
+
+    clock[0] += 1
+    assert bucket.consume() == 0
+    assert not bucket.warned
+
+
+def test_rate_limit_marks_handler():
+    @rate_limit("sheets_write")
+    async def handler(message):
+        pass
+
+    assert handler.rate_limit == "sheets_write"
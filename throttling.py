@@ -0,0 +1,53 @@
+"""
+Rate limiting of users' requests, so one user cannot burn through the Google quota shared by everyone.
+"""
+import time
+
+
+class TokenBucket:
+    """Token bucket: requests take tokens which are refilled with constant rate."""
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Max number of tokens (max burst of requests).
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+        # User was told to slow down and no request was allowed since then.
+        self.warned = False
+
+    def consume(self) -> float:
+        """
+        Takes a token if there is one.
+
+        :return: 0 if the token is taken, otherwise seconds until a token appears.
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.warned = False
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+def rate_limit(limit: str):
+    """
+    Sets limit of handler from THROTTLING_LIMITS in config (e.g. sheets_write for handlers
+    writing to Google sheet or cached for cheap handlers which are not limited).
+    Handlers without the decorator get the default limit.
+
+    :param limit: Name of the limit.
+    """
+    def decorator(func):
+        func.rate_limit = limit
+        return func
+
+    return decorator
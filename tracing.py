@@ -0,0 +1,152 @@
+"""
+Tracing of updates. Each update gets a trace: a tree of spans (handler, Google API requests,
+database queries) with their durations, so a slow update can be broken down afterwards.
+
+Finished traces are kept in a ring buffer (shown to admins by /trace command) and appended
+to TRACE_FILE as JSON lines. Spans started in threads by background.run_blocking belong
+to the trace of the update, because the thread runs in a copy of the update's context.
+"""
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import secrets
+import threading
+import time
+import typing
+
+from concurrent.futures import ThreadPoolExecutor
+
+from config import TRACE_BUFFER_SIZE, TRACE_FILE, TRACE_MIN_SECONDS
+
+
+class Span:
+    """Timed operation within a trace."""
+
+    def __init__(self, name: str, trace: "Trace", parent: typing.Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace = trace
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+
+        self.started_at = time.time()
+        self._started = time.monotonic()
+        self.duration = None
+        self.error = None
+
+    def finish(self, error: BaseException = None):
+        self.duration = time.monotonic() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+
+        self.trace.spans.append(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """Finished spans of one update."""
+
+    def __init__(self):
+        self.trace_id = secrets.token_hex(8)
+        self.spans = []
+
+    @property
+    def root(self) -> Span:
+        return next(span for span in self.spans if span.parent_id is None)
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "spans": [span.to_dict() for span in self.spans]}
+
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+traces = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_traces_lock = threading.Lock()
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="traces")
+
+
+def start_span(name: str, **attributes) -> typing.Tuple[Span, contextvars.Token]:
+    """
+    Starts span which is a child of the current one (or a root of a new trace).
+    The span must be finished by finish_span in the same context.
+
+    :param name: Name of the span.
+    :param attributes: Attributes of the span (user_id, handler, query...).
+    :return: Span and token for restoring the current span.
+    """
+    parent = _current_span.get()
+    trace = parent.trace if parent is not None else Trace()
+
+    span = Span(name, trace, parent, attributes)
+    return span, _current_span.set(span)
+
+
+def finish_span(span: Span, token: contextvars.Token, error: BaseException = None):
+    """
+    Finishes span started by start_span and exports the trace if it is the root span.
+
+    :param span: Span.
+    :param token: Token returned by start_span.
+    :param error: Exception raised in the span.
+    """
+    span.finish(error)
+    _current_span.reset(token)
+
+    if span.parent_id is None:
+        _export(span.trace)
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Context manager measuring the block as a span.
+
+    :param name: Name of the span.
+    :param attributes: Attributes of the span.
+    """
+    current, token = start_span(name, **attributes)
+    try:
+        yield current
+    except BaseException as exc:
+        finish_span(current, token, exc)
+        raise
+    else:
+        finish_span(current, token)
+
+
+def get_traces() -> typing.List[Trace]:
+    """Returns finished traces from the ring buffer, the newest first."""
+    with _traces_lock:
+        return list(reversed(traces))
+
+
+def _export(trace: Trace):
+    """Puts trace to the ring buffer and to the file if it is slow enough."""
+    if trace.root.duration < TRACE_MIN_SECONDS:
+        return
+
+    with _traces_lock:
+        traces.append(trace)
+
+    if TRACE_FILE:
+        _writer.submit(_write, json.dumps(trace.to_dict(), ensure_ascii=False))
+
+
+def _write(line: str):
+    try:
+        with open(TRACE_FILE, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+    except OSError as exc:
+        logging.error("Exception during writing trace!", exc_info=exc)
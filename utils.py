@@ -1,11 +1,16 @@
 import functools
+import logging
 import typing
 import gspread
 
 from aiogram import types
+from aiogram.utils import exceptions
 
+from sender import Job
 from server import bot
 from database import get_user
+from google_sheet.client import service_account
+from keyboards import get_page, settings_keyboard
 
 
 def auth(func):
@@ -14,7 +19,7 @@ def auth(func):
     async def wrapper(message_or_callback: typing.Union[types.Message, types.CallbackQuery], *args, **kwargs):
         is_logged_in = True
         try:
-            user = get_user(message_or_callback.from_user.id)
+            user = await get_user(message_or_callback.from_user.id)
         except ValueError:
             is_logged_in = False
         else:
@@ -24,37 +29,92 @@ def auth(func):
         if is_logged_in:
             await func(message_or_callback, *args, **kwargs)
         else:
-            await bot.send_message(message_or_callback.from_user.id,
-                                   "😐 Сначала подключи меня к таблице командой /register, "
-                                   "а потом используй все мои возможности.")
+            bot.enqueue(message_or_callback.from_user.id,
+                        "😐 Сначала подключи меня к таблице командой /register, "
+                        "а потом используй все мои возможности.")
 
     return wrapper
 
 
-def delete_previous_message(func):
-    """This decorator delets previous message"""
-    @functools.wraps(func)
-    async def wrapper(callback_or_message: typing.Union[types.CallbackQuery, types.Message], *args, **kwargs):
-        if type(callback_or_message) == types.CallbackQuery:
-            callback = callback_or_message
-            await bot.delete_message(callback.from_user.id, callback.message.message_id)
-            return await func(callback, *args, **kwargs)
+def reply(message: types.Message, text: str,
+          reply_markup: typing.Union[types.InlineKeyboardMarkup, types.ReplyKeyboardMarkup] = None,
+          parse_mode: str = None) -> Job:
+    """
+    Queues the answer to the message. The handler does not wait until Telegram gets it,
+    the order of messages to the chat is kept by the scheduler (see sender.py).
 
-        elif type(callback_or_message) == types.Message:
-            message = callback_or_message
-            await bot.delete_message(message.from_user.id, message.message_id)
-            return await func(message, *args, **kwargs)
+    :param message: User's message.
+    :param text: Text of the answer.
+    :param reply_markup: Keyboard of the answer.
+    :param parse_mode: Parse mode of the text.
+    :return: Job of the queued request.
+    """
+    return bot.enqueue(message.chat.id, text, parse_mode=parse_mode, reply_markup=reply_markup)
 
-        else:
-            raise ValueError(f"'callback_or_message' must be types.CallbackQuery "
-                             f"or types.Message but not {type(callback_or_message)}!")
 
-    return wrapper
+async def update_message(message_or_callback: typing.Union[types.Message, types.CallbackQuery], text: str,
+                         reply_markup: typing.Union[types.InlineKeyboardMarkup, types.ReplyKeyboardMarkup] = None,
+                         parse_mode: str = None) -> typing.Optional[types.Message]:
+    """
+    Shows the next step of a flow. If user pressed a button, the message with the button
+    is edited in place, so the step costs one request to Telegram instead of two.
+    The message is deleted and sent again only if it can not be edited: it is too old
+    or the new message has a reply keyboard (edited messages can have only inline keyboards).
+    If user sent a message, the answer is sent as a new message.
+
+    :param message_or_callback: User's message or callback query.
+    :param text: Text of the message.
+    :param reply_markup: Keyboard of the message.
+    :param parse_mode: Parse mode of the text.
+    :return: Edited message or None if the message is queued to be sent (see reply).
+
+    :raise ValueError: If message_or_callback is not a message or a callback query.
+    """
+    if isinstance(message_or_callback, types.Message):
+        reply(message_or_callback, text, parse_mode=parse_mode, reply_markup=reply_markup)
+        return None
+
+    if not isinstance(message_or_callback, types.CallbackQuery):
+        raise ValueError(f"'message_or_callback' must be types.CallbackQuery "
+                         f"or types.Message but not {type(message_or_callback)}!")
+
+    message = message_or_callback.message
+    if reply_markup is None or isinstance(reply_markup, types.InlineKeyboardMarkup):
+        try:
+            return await message.edit_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+        except exceptions.MessageNotModified:
+            return message
+        except exceptions.BadRequest as exc:
+            logging.debug("Message can not be edited, it is sent again: %s", exc)
+
+    try:
+        await message.delete()
+    except exceptions.BadRequest as exc:
+        logging.debug("Message can not be deleted: %s", exc)
+
+    reply(message, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    return None
+
+
+async def answer_keyboard_page(message: types.Message, settings: dict, items: str) -> bool:
+    """
+    Shows another page of the keyboard if user pressed a page button.
+
+    :param message: User's message.
+    :param settings: User's settings snapshot.
+    :param items: Name of the list of the keyboard (see keyboards.settings_keyboard).
+    :return: True if the message was a page button.
+    """
+    page = get_page(message.text)
+    if page is None:
+        return False
+
+    reply(message, f"Страница {page + 1}", reply_markup=settings_keyboard(settings, items, page))
+    return True
 
 
 def is_gsheet_id_correct(gsheet_id: str) -> bool:
     """Checks that user's Google sheet ID is correct"""
-    service_account = gspread.service_account(filename="google_token.json")
     try:
         service_account.open_by_key(gsheet_id)
     except gspread.exceptions.APIError:
@@ -0,0 +1,118 @@
+"""
+aiohttp application for webhook mode. Besides the webhook it serves service
+endpoints (/health, /metrics), so the bot can be put behind a TLS-terminating proxy
+which forwards https://WEBHOOK_HOST/WEBHOOK_PATH to WEBAPP_HOST:WEBAPP_PORT.
+In polling mode service endpoints may be served on METRICS_PORT.
+"""
+import asyncio
+import logging
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiohttp import web
+
+import metrics
+from background import spawn
+from config import WEBHOOK_CONCURRENCY, WEBHOOK_SECRET
+
+
+SEMAPHORE_KEY = "updates_semaphore"
+SHUTDOWN_TIMEOUT = 30  # Seconds to wait for updates being processed when the bot stops.
+
+
+class WebhookHandler(WebhookRequestHandler):
+    """
+    Answers Telegram right after the update is accepted and processes it in background,
+    so a slow handler (e.g. writing to Google sheet) does not hold the connection.
+    At most WEBHOOK_CONCURRENCY updates are processed at once, the next requests
+    wait for a free slot, which makes Telegram slow down sending updates.
+    """
+
+    async def post(self):
+        self.validate_ip()
+        if WEBHOOK_SECRET and self.request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            raise web.HTTPUnauthorized()
+
+        dispatcher = self.get_dispatcher()
+        update = await self.parse_update(dispatcher.bot)
+
+        semaphore = self.request.app[SEMAPHORE_KEY]
+        await semaphore.acquire()
+        spawn(_process_update(dispatcher, update, semaphore), name=f"update:{update.update_id}")
+
+        return web.Response(text="ok")
+
+
+async def _process_update(dispatcher: Dispatcher, update: types.Update, semaphore: asyncio.Semaphore):
+    """Processes update and frees the slot taken for it."""
+    try:
+        await dispatcher.updates_handler.notify(update)
+    finally:
+        semaphore.release()
+
+
+async def health(request: web.Request) -> web.Response:
+    """Tells that the bot is running."""
+    return web.json_response({"status": "ok"})
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Returns metrics in Prometheus text format."""
+    return web.Response(
+        body=metrics.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def _on_startup(app: web.Application):
+    app[SEMAPHORE_KEY] = asyncio.Semaphore(WEBHOOK_CONCURRENCY)
+
+
+async def _on_shutdown(app: web.Application):
+    """Waits for updates being processed before the database is closed."""
+    semaphore = app[SEMAPHORE_KEY]
+
+    async def wait_updates():
+        for _ in range(WEBHOOK_CONCURRENCY):
+            await semaphore.acquire()
+
+    try:
+        await asyncio.wait_for(wait_updates(), SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        logging.warning("Some updates were not processed before shutdown!")
+
+
+def create_service_app() -> web.Application:
+    """Creates application with service endpoints."""
+    app = web.Application()
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_handler)
+
+    return app
+
+
+def create_app() -> web.Application:
+    """
+    Creates application for webhook mode. The webhook route is added by aiogram's executor.
+    """
+    app = create_service_app()
+    app.on_startup.append(_on_startup)
+    # Must run before executor's shutdown which closes the storage.
+    app.on_shutdown.append(_on_shutdown)
+
+    return app
+
+
+async def start_service_server(host: str, port: int) -> web.AppRunner:
+    """
+    Starts serving service endpoints in the running event loop (polling mode).
+
+    :param host: Address to listen.
+    :param port: Port to listen.
+    :return: Runner which must be cleaned up on shutdown.
+    """
+    runner = web.AppRunner(create_service_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner